@@ -0,0 +1,81 @@
+"""
+Measures the build time, query latency and recall@k of the IVF recipe index against exact search, to choose `lists` and `nprobe` for a catalog.
+
+Run it from the ReAct folder, either on synthetic embeddings or on the embeddings of an existing recipe store:
+
+    python -m benchmarks.ann_benchmark --count 1000000 --dimensions 256
+    python -m benchmarks.ann_benchmark --store ./recipes --nprobe 8 16 32
+"""
+
+from typing import List, Optional
+import argparse
+import time
+import numpy as np
+from benchmarks.quantization_recall import create_embeddings, create_queries
+from helpers.ivf_index import IVFIndex
+from helpers.recipe_index import RecipeIndex
+from helpers.recipe_store import RecipeStore
+
+
+def run(embeddings: np.ndarray, queries: np.ndarray, k: int, lists: Optional[int], nprobes: List[int], quantization: str) -> None:
+    exact_index = RecipeIndex()
+    exact_index.attach(embeddings)
+
+    started = time.perf_counter()
+    exact = [exact_index.search(query, k)[0] for query in queries]
+    exact_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+    ivf_index = IVFIndex(lists=lists, quantization=quantization)
+    index = RecipeIndex(ann_index=ivf_index)
+    index.attach(embeddings)
+
+    started = time.perf_counter()
+    ivf_index.update(index.matrix)
+    build_s = time.perf_counter() - started
+
+    print(f"{embeddings.shape[0]} embeddings of {embeddings.shape[1]} dimensions, {len(queries)} queries, k={k}")
+    print(f"exact search: {exact_ms:.2f} ms/query")
+    print(f"IVF: {len(ivf_index.centroids)} lists of {quantization} rows, built in {build_s:.1f}s")
+    print(f"{'nprobe':>6} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8}")
+
+    for nprobe in nprobes:
+        ivf_index.nprobe = nprobe
+        latencies = []
+        found = []
+
+        for query in queries:
+            started = time.perf_counter()
+            found.append(index.search(query, k)[0])
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        recall = np.mean([len(np.intersect1d(rows, expected)) / max(len(expected), 1)
+                          for rows, expected in zip(found, exact)])
+        print(f"{nprobe:>6} {recall:>9.4f} {np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 95):>8.2f}")
+
+
+def main(arguments: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", help="The prefix of a recipe store whose embeddings to use, instead of synthetic embeddings.")
+    parser.add_argument("--count", type=int, default=200000, help="The number of synthetic embeddings.")
+    parser.add_argument("--dimensions", type=int, default=1536, help="The dimensions of the synthetic embeddings.")
+    parser.add_argument("--clusters", type=int, default=1000, help="The number of topics the synthetic embeddings cluster around.")
+    parser.add_argument("--queries", type=int, default=200, help="The number of queries.")
+    parser.add_argument("--noise", type=float, default=4.0, help="How far queries are from the embeddings they are drawn from.")
+    parser.add_argument("-k", type=int, default=10, help="The number of rows each search returns.")
+    parser.add_argument("--lists", type=int, help="The number of IVF lists, by default about 4·√N.")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32, 64], help="The numbers of lists to probe.")
+    parser.add_argument("--quantization", default="int8", choices=RecipeIndex.QUANTIZATIONS, help="How the IVF lists hold their rows.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(arguments)
+
+    if args.store:
+        _, embeddings = RecipeStore(args.store).load()
+    else:
+        embeddings = create_embeddings(args.count, args.dimensions, args.clusters, args.seed)
+
+    queries = create_queries(embeddings, args.queries, args.noise, args.seed)
+    run(embeddings, queries, args.k, args.lists, args.nprobe, args.quantization)
+
+
+if __name__ == "__main__":
+    main()
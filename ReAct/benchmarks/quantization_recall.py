@@ -0,0 +1,97 @@
+"""
+Measures the recall@k of the quantized recipe index modes against exact float32 search, to choose a quantization for a catalog.
+
+Run it from the ReAct folder, either on synthetic embeddings or on the embeddings of an existing recipe store:
+
+    python -m benchmarks.quantization_recall --count 100000 --dimensions 1536
+    python -m benchmarks.quantization_recall --store ./recipes
+"""
+
+from typing import List, Optional
+import argparse
+import time
+import numpy as np
+from helpers.recipe_index import RecipeIndex
+from helpers.recipe_store import RecipeStore
+
+
+def create_embeddings(count: int, dimensions: int, clusters: int, seed: int) -> np.ndarray:
+    # Text embeddings share a common direction and cluster by topic, so random vectors alone would make the quantized modes look better than they are.
+    rng = np.random.default_rng(seed)
+    common = rng.normal(size=dimensions).astype(np.float32)
+    centers = common + rng.normal(size=(clusters, dimensions)).astype(np.float32) * 0.6
+    embeddings = np.empty((count, dimensions), dtype=np.float32)
+
+    # Generated in blocks, so that a million embeddings don't need several times their size in temporary arrays.
+    for start in range(0, count, 65536):
+        stop = min(start + 65536, count)
+        labels = rng.integers(clusters, size=stop - start)
+        noise = rng.standard_normal(size=(stop - start, dimensions), dtype=np.float32) * 0.5
+        embeddings[start:stop] = RecipeIndex.normalize(centers[labels] + noise)
+
+    return embeddings
+
+
+def create_queries(embeddings: np.ndarray, count: int, noise: float, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed + 1)
+    rows = embeddings[rng.integers(embeddings.shape[0], size=count)]
+    return RecipeIndex.normalize(rows + rng.normal(size=rows.shape) * noise / np.sqrt(embeddings.shape[1]))
+
+
+def run(embeddings: np.ndarray, queries: np.ndarray, k: int, min_score: float, rescore_factors: List[int]) -> None:
+    exact_index = RecipeIndex()
+    exact_index.attach(embeddings)
+
+    started = time.perf_counter()
+    exact = [exact_index.search(query, k)[0] for query in queries]
+    exact_ms = (time.perf_counter() - started) * 1000 / len(queries)
+    exact_matches = [exact_index.scores(query) > min_score for query in queries]
+
+    print(f"{embeddings.shape[0]} embeddings of {embeddings.shape[1]} dimensions, {len(queries)} queries, k={k}")
+    print(f"{'mode':<8} {'rescore':>7} {'recall@k':>9} {'threshold':>9} {'scan MB':>8} {'ms/query':>9}")
+    print(f"{'float32':<8} {'-':>7} {1.0:>9.4f} {1.0:>9.4f} {exact_index.nbytes / 1e6:>8.1f} {exact_ms:>9.2f}")
+
+    for quantization in ("float16", "int8"):
+        for rescore_factor in rescore_factors:
+            index = RecipeIndex(quantization=quantization, rescore_factor=rescore_factor)
+            index.attach(embeddings)
+
+            started = time.perf_counter()
+            found = [index.search(query, k)[0] for query in queries]
+            elapsed_ms = (time.perf_counter() - started) * 1000 / len(queries)
+
+            recall = np.mean([len(np.intersect1d(rows, expected)) / max(len(expected), 1)
+                              for rows, expected in zip(found, exact)])
+            # The fraction of queries for which thresholding the scores matches exactly the same rows as the exact path.
+            threshold = np.mean([np.array_equal(index.scores(query, min_score=min_score, shortlist=k) > min_score, expected)
+                                 for query, expected in zip(queries, exact_matches)])
+
+            print(f"{quantization:<8} {rescore_factor:>7} {recall:>9.4f} {threshold:>9.4f} {index.nbytes / 1e6:>8.1f} {elapsed_ms:>9.2f}")
+
+
+def main(arguments: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--store", help="The prefix of a recipe store whose embeddings to use, instead of synthetic embeddings.")
+    parser.add_argument("--count", type=int, default=50000, help="The number of synthetic embeddings.")
+    parser.add_argument("--dimensions", type=int, default=1536, help="The dimensions of the synthetic embeddings.")
+    parser.add_argument("--clusters", type=int, default=200, help="The number of topics the synthetic embeddings cluster around.")
+    parser.add_argument("--queries", type=int, default=200, help="The number of queries.")
+    parser.add_argument("--noise", type=float, default=8.0, help="How far queries are from the embeddings they are drawn from.")
+    parser.add_argument("-k", type=int, default=10, help="The number of rows each search returns.")
+    parser.add_argument("--min-score", type=float, default=0.5, help="The similarity threshold to check.")
+    parser.add_argument("--rescore-factors", type=int, nargs="+", default=[1, 2, 4, 8],
+                        help="The shortlist sizes to try, as multiples of k.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(arguments)
+
+    if args.store:
+        _, embeddings = RecipeStore(args.store).load()
+    else:
+        embeddings = create_embeddings(args.count, args.dimensions, args.clusters, args.seed)
+
+    queries = create_queries(embeddings, args.queries, args.noise, args.seed)
+    run(embeddings, queries, args.k, args.min_score, args.rescore_factors)
+
+
+if __name__ == "__main__":
+    main()
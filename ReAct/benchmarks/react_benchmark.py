@@ -0,0 +1,327 @@
+"""
+Benchmarks the recipe agent and the ReAct loop offline, against a `FakeOpenAI` that replays recorded responses or answers from a script,
+with latency injected to approximate a deployment. Reports p50/p95 latency, and LLM calls and tokens per task, for:
+
+- cold start: creating a catalog from the seed recipes, and loading it again from its store,
+- search: `find_recipes_by_description` over synthetic catalogs of each size,
+- tool dispatch: running a batch of tool calls,
+- ReAct: full runs of the notebook's task, with the notebook's prompts, also with speculative validation, a plan cache and a loop detector,
+  and runs of a task that can't be completed, with the validator or a loop detector judging loops.
+
+Run it from the ReAct folder:
+
+    python -m benchmarks.react_benchmark
+    python -m benchmarks.react_benchmark --sizes 1000 100000 1000000 --output results.json
+    python -m benchmarks.react_benchmark --recording ./recording.jsonl --request-latency 0.5 --token-latency 0.01
+    python -m benchmarks.react_benchmark --sizes 1000 --trace ./traces.jsonl
+
+A recording can be made by wrapping the notebook's clients, e.g. `RecordingOpenAI(openai_client, LLMRecording("recording.jsonl"))`.
+Requests that weren't recorded are answered by the script.
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import ast
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import numpy as np
+from helpers.async_helpers import run_sync
+from helpers.embedding_pipeline import EmbeddingPipeline
+from helpers.fake_openai import AsyncFakeOpenAI, FakeOpenAI, LatencyModel, LLMRecording, create_completion
+from helpers.ivf_index import IVFIndex
+from helpers.loop_detector import LoopDetector
+from helpers.plan_cache import PlanCache
+from helpers.react_orchestrator import ReActOrchestrator, ReActPrompts
+from helpers.recipe_agent import RecipeAgent
+from helpers.recipe_catalog import RecipeCatalog
+from helpers.recipe_models import RecipeRecord
+from helpers.recipe_store import RecipeStore
+from helpers.request_models import ProgressValidationModel, RequestValidationModel
+from helpers.seed_recipes import create_seed_recipes
+from helpers.skill_cache import SkillCache
+from helpers.tracing import JsonLinesExporter, Tracer, disable_tracing, enable_tracing
+
+NOTEBOOK_PATH = os.path.join(os.path.dirname(__file__), "..", "ReAct.ipynb")
+
+# The steps the scripted model takes to answer a task: the instruction the validator gives, and the tool calls the agent makes for it.
+SCRIPT = [
+    ("Find a spaghetti bolognese recipe that can be made vegan.",
+     [("find_recipes_by_description", {"description": "spaghetti bolognese", "available_ingredients": None, "count": 1})]),
+    ("Find the ingredients that are available in the kitchen.",
+     [("find_ingredients_in_kitchen", {})]),
+    ("Make the Spaghetti Bolognese recipe vegan.",
+     [("modify_recipe_if_not_vegan", {"recipe_name": "Spaghetti Bolognese"})]),
+    ("Generate a shopping list for the vegan recipe, using the ingredients in the kitchen.",
+     [("generate_shopping_list_from_recipe", {"recipe_name": "Vegan Spaghetti Bolognese", "available_ingredients": ["100g pasta", "2 cans of tomatoes"]})]),
+]
+
+# A task the scripted model can't make progress on, which repeats the same step until the run replans and gives up.
+STUCK_TASK = "Find a recipe for unicorn stew, and make a shopping list for it."
+STUCK_STEP = ("Find a unicorn stew recipe.",
+              [("find_recipes_by_description", {"description": "unicorn stew", "available_ingredients": None, "count": 1})])
+# Like the model, the scripted validator only judges a stuck run to be in a loop once the step has been given this many times.
+LOOP_JUDGED_AFTER = 3
+
+
+def _role(message: Any) -> Optional[str]:
+    return message.get("role") if isinstance(message, dict) else getattr(message, "role", None)
+
+
+def _content(message: Any) -> str:
+    content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+    return content if isinstance(content, str) else json.dumps(content, default=str)
+
+
+def scripted_responder(kind: str, request: Dict[str, Any]) -> Any:
+    """
+    Answers the requests of a ReAct run over the recipe agent, following `SCRIPT`, with responses of a realistic length.
+    """
+
+    messages = request["messages"]
+
+    if kind == "parse" and request["response_format"] in (RequestValidationModel, ProgressValidationModel):
+        # Every user message before the trailing validation prompt is an instruction that was already given.
+        step = sum(_role(message) == "user" for message in messages[:-1])
+        stuck = any(STUCK_TASK in _content(message) for message in messages)
+        done = not stuck and step >= len(SCRIPT)
+        in_loop = stuck and step >= LOOP_JUDGED_AFTER
+        validation = {
+            "is_request_completed": {"reason": "All the steps of the plan have been executed." if done else "Some steps of the plan are left.", "answer": done},
+            "is_in_loop": {"reason": "The same step keeps failing." if in_loop else "Each step made progress.", "answer": in_loop},
+            "next_instruction_or_question": {"reason": "Following the plan.", "answer": STUCK_STEP[0] if stuck else SCRIPT[min(step, len(SCRIPT) - 1)][0]},
+        }
+        return request["response_format"].model_validate({name: validation[name] for name in request["response_format"].model_fields})
+
+    if kind == "parse":
+        # The vegan conversion of a recipe.
+        return request["response_format"].model_validate({
+            "name": "Vegan Spaghetti Bolognese", "author": "Recipe Agent",
+            "ingredients": ["400g spaghetti", "2 tbsp olive oil", "1 onion, finely chopped", "2 garlic cloves, minced", "400g lentils", "2 cans of tomatoes", "Salt and pepper to taste"],
+            "steps": ["Cook the spaghetti.", "Fry the onion and garlic in the oil.", "Add the lentils and tomatoes and simmer for 20 minutes.", "Season and serve over the spaghetti."],
+            "embedding": [],
+        })
+
+    if request.get("tools"):
+        if _role(messages[-1]) == "tool":
+            results = [_content(message)[:200] for message in messages if _role(message) == "tool"]
+            return "Here is what I found:\n\n" + "\n\n".join(results[-4:])
+
+        instruction = _content(messages[-1])
+        for step_instruction, tool_calls in [*SCRIPT, STUCK_STEP]:
+            if instruction.endswith(step_instruction):
+                return create_completion(tool_calls=tool_calls, model=request["model"])
+
+        return "I can't help with that."
+
+    return " ".join(["The request and the steps taken to address it are summarized here."] * 12)
+
+
+def load_notebook_values(path: str = NOTEBOOK_PATH) -> Dict[str, str]:
+    """
+    Reads the string variables assigned in the notebook's code cells, i.e. the task and the prompts, without running the notebook.
+    """
+
+    with open(path, "r") as f:
+        notebook = json.load(f)
+
+    values = {}
+    for cell in notebook["cells"]:
+        if cell["cell_type"] != "code":
+            continue
+        try:
+            tree = ast.parse("".join(cell["source"]))
+        except SyntaxError:
+            continue
+        for node in tree.body:
+            if (isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)
+                    and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)):
+                values[node.targets[0].id] = node.value.value
+
+    return values
+
+
+def percentiles(values: List[float]) -> Tuple[float, float]:
+    return float(np.percentile(values, 50)), float(np.percentile(values, 95))
+
+
+def measure(function: Callable[[], Any], repeat: int) -> List[float]:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+class Benchmark:
+    """
+    A class representing a benchmark run, with the fake clients shared by its scenarios and the results of each scenario.
+    """
+
+    def __init__(self, directory: str, recording: LLMRecording, latency: LatencyModel, embedding_dimensions: int):
+        self.directory = directory
+        self.client = FakeOpenAI(recording, scripted_responder, latency, embedding_dimensions)
+        self.async_client = AsyncFakeOpenAI(recording, scripted_responder, latency, embedding_dimensions)
+        self.results: List[Dict[str, Any]] = []
+
+    def report(self, scenario: str, latencies: List[float], llm_calls: Optional[float] = None, tokens: Optional[float] = None) -> None:
+        p50, p95 = percentiles(latencies)
+        self.results.append({"scenario": scenario, "runs": len(latencies), "p50_ms": p50, "p95_ms": p95,
+                             "llm_calls_per_task": llm_calls, "tokens_per_task": tokens})
+
+        calls = f"{llm_calls:>9.1f}" if llm_calls is not None else f"{'-':>9}"
+        tokens_text = f"{tokens:>10.0f}" if tokens is not None else f"{'-':>10}"
+        print(f"{scenario:<44} {len(latencies):>5} {p50:>10.2f} {p95:>10.2f} {calls} {tokens_text}")
+
+    def create_pipeline(self) -> EmbeddingPipeline:
+        return EmbeddingPipeline(self.client, "embedding", async_client=self.async_client)
+
+    def create_agent(self, catalog: RecipeCatalog) -> RecipeAgent:
+        return RecipeAgent(self.client, "model", "embedding", embedding_pipeline=self.create_pipeline(),
+                           async_client=self.async_client, skill_cache=SkillCache(), catalog=catalog)
+
+    def run_cold_start(self, repeat: int) -> None:
+        prefixes = [os.path.join(self.directory, f"cold_{i}") for i in range(repeat)]
+        pipeline = self.create_pipeline()
+
+        iterations = iter(prefixes)
+        self.report("cold start (seed recipes)", measure(lambda: RecipeCatalog(RecipeStore(next(iterations))).load(pipeline), repeat))
+
+        iterations = iter(prefixes)
+        self.report("cold start (from store)", measure(lambda: RecipeCatalog(RecipeStore(next(iterations))).load(pipeline), repeat))
+
+    def create_catalog(self, size: int, index: str) -> RecipeCatalog:
+        prefix = os.path.join(self.directory, f"synthetic_{size}")
+        store = RecipeStore(prefix)
+
+        if not store.exists():
+            rng = random.Random(size)
+            seeds = create_seed_recipes()
+            ingredients = sorted({ingredient for recipe in seeds for ingredient in recipe.ingredients})
+            records = []
+            embeddings = np.empty((size, self.client.embedding_dimensions), dtype=np.float32)
+
+            for row in range(size):
+                seed = seeds[row % len(seeds)]
+                record = RecipeRecord(f"{seed.name} {row}", seed.author,
+                                      rng.sample(seed.ingredients, k=max(1, len(seed.ingredients) - 2)) + rng.sample(ingredients, k=2), seed.steps, row)
+                records.append(record)
+                embeddings[row] = self.client.embed(record.model_dump_markdown())
+
+            store.save(records, embeddings)
+
+        # "auto" leaves the catalog to choose, i.e. an IVF index from `RecipeCatalog.ANN_THRESHOLD` recipes.
+        if index == "flat":
+            return RecipeCatalog(store, ann_threshold=None).load(self.create_pipeline())
+        return RecipeCatalog(store, ann_index=IVFIndex() if index == "ivf" else None).load(self.create_pipeline())
+
+    def run_search(self, sizes: List[int], queries: int, index: str) -> None:
+        seeds = create_seed_recipes()
+        rng = random.Random(0)
+
+        for size in sizes:
+            catalog = self.create_catalog(size, index)
+            agent = self.create_agent(catalog)
+            # Descriptions name a recipe and some of its ingredients, so that many recipes pass the vector threshold and are ranked with their lexical scores.
+            # Every description is different, so that no search is answered from the skill cache.
+            descriptions = iter([f"{seed.name} with {' and '.join(rng.sample(seed.ingredients, 2))}, number {i}"
+                                 for i, seed in enumerate(rng.choices(seeds, k=queries))])
+            search = lambda: run_sync(agent.find_recipes_by_description(next(descriptions), None, 3))
+            kind = "IVF" if catalog.recipe_index.ann_index is not None else "flat"
+            self.report(f"search ({size} recipes, {kind})", measure(search, queries), llm_calls=0)
+
+    def run_tool_dispatch(self, repeat: int, batch_size: int) -> None:
+        agent = self.create_agent(RecipeCatalog(RecipeStore(os.path.join(self.directory, "cold_0"))))
+        calls = [("find_ingredients_in_kitchen", {}),
+                 ("generate_shopping_list_from_recipe", {"recipe_name": "Spaghetti Bolognese", "available_ingredients": ["100g pasta"]})]
+        tool_calls = create_completion(tool_calls=[calls[i % len(calls)] for i in range(batch_size)]).choices[0].message.tool_calls
+
+        # The catalog is loaded before measuring, so that only the dispatch is measured.
+        agent.catalog
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies = measure(lambda: run_sync(agent.acall_tools(tool_calls)), repeat)
+
+        self.report(f"tool dispatch ({batch_size} calls)", latencies, llm_calls=0)
+
+    def run_react(self, repeat: int, speculative_validation: bool, plan_cache: bool = False, loop_detection: bool = False, stuck: bool = False) -> None:
+        values = load_notebook_values()
+        prompts = ReActPrompts(**{name: values[name] for name in ReActPrompts.model_fields if name in values})
+        agent = self.create_agent(RecipeCatalog(RecipeStore(os.path.join(self.directory, "cold_0"))))
+        orchestrator = ReActOrchestrator(self.client, "model", agent, prompts, async_client=self.async_client,
+                                         speculative_validation=speculative_validation,
+                                         plan_cache=PlanCache(embedding_pipeline=self.create_pipeline()) if plan_cache else None,
+                                         loop_detector=LoopDetector if loop_detection else None)
+        task = STUCK_TASK if stuck else values["task"]
+
+        results = []
+
+        def _run() -> None:
+            # Each run starts from an empty skill cache, so that the vegan conversion isn't reused across runs.
+            agent.skill_cache.clear()
+            results.append(run_sync(orchestrator.arun(task, values.get("context", ""))))
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            latencies = measure(_run, repeat)
+
+        options = [name for name, enabled in (("speculative", speculative_validation), ("plan cache", plan_cache), ("loop detector", loop_detection)) if enabled]
+        self.report(f"ReAct {'failed task' if stuck else 'run'}{' (' + ', '.join(options) + ')' if options else ''}", latencies,
+                    llm_calls=float(np.mean([result.stats.llm_calls for result in results])),
+                    tokens=float(np.mean([result.stats.prompt_tokens + result.stats.completion_tokens for result in results])))
+
+
+def main(arguments: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000],
+                        help="The sizes of the synthetic catalogs to search. A million recipes needs several GB of memory.")
+    parser.add_argument("--index", default="auto", choices=["auto", "flat", "ivf"],
+                        help="How the synthetic catalogs are searched: as the catalog chooses by its size, by scanning every embedding, or with an IVF index.")
+    parser.add_argument("--queries", type=int, default=100, help="The number of searches per catalog.")
+    parser.add_argument("--repeat", type=int, default=10, help="The number of runs of the other scenarios.")
+    parser.add_argument("--batch-size", type=int, default=8, help="The number of tool calls per dispatch.")
+    parser.add_argument("--recording", help="A recording to replay, made with RecordingOpenAI.")
+    parser.add_argument("--request-latency", type=float, default=0.0, help="Seconds until the first token of a completion.")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds per completion token.")
+    parser.add_argument("--embedding-latency", type=float, default=0.0, help="Seconds per embedding request.")
+    parser.add_argument("--jitter", type=float, default=0.2, help="The relative random variation of each delay.")
+    parser.add_argument("--dimensions", type=int, default=256, help="The dimensions of the fake embeddings.")
+    parser.add_argument("--output", help="A JSON file to write the results to, e.g. to compare them across commits.")
+    parser.add_argument("--trace", help="A JSON Lines file to write the spans of the runs to, and print which operations dominate them.")
+    args = parser.parse_args(arguments)
+
+    latency = LatencyModel(args.request_latency, args.token_latency, args.embedding_latency, jitter=args.jitter)
+    tracer = enable_tracing(Tracer([JsonLinesExporter(args.trace)], max_spans=None)) if args.trace else None
+
+    with tempfile.TemporaryDirectory() as directory:
+        benchmark = Benchmark(directory, LLMRecording(args.recording), latency, args.dimensions)
+
+        print(f"{'scenario':<44} {'runs':>5} {'p50 ms':>10} {'p95 ms':>10} {'LLM calls':>9} {'tokens':>10}")
+        benchmark.run_cold_start(args.repeat)
+        benchmark.run_search(args.sizes, args.queries, args.index)
+        benchmark.run_tool_dispatch(args.repeat, args.batch_size)
+        benchmark.run_react(args.repeat, speculative_validation=False)
+        benchmark.run_react(args.repeat, speculative_validation=True)
+        benchmark.run_react(args.repeat, speculative_validation=True, plan_cache=True)
+        benchmark.run_react(args.repeat, speculative_validation=False, loop_detection=True)
+        benchmark.run_react(args.repeat, speculative_validation=False, stuck=True)
+        benchmark.run_react(args.repeat, speculative_validation=False, loop_detection=True, stuck=True)
+
+    if tracer is not None:
+        disable_tracing()
+        print(f"\n{'span':<42} {'count':>6} {'total ms':>10} {'p50 ms':>8} {'p95 ms':>8} {'tokens':>9} {'cache hits':>10}")
+        for name, summary in tracer.summarize().items():
+            tokens = summary.get("prompt_tokens", 0) + summary.get("completion_tokens", 0)
+            cache_hits = summary.get("cache_hit", 0) + summary.get("cache_hits", 0)
+            print(f"{name:<42} {summary['count']:>6} {summary['total_ms']:>10.1f} {summary['p50_ms']:>8.2f} {summary['p95_ms']:>8.2f} {tokens:>9.0f} {cache_hits:>10.0f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(benchmark.results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
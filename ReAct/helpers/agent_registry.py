@@ -0,0 +1,210 @@
+from openai.types.chat import ChatCompletionMessage
+from openai.types.chat.chat_completion_user_message_param import ChatCompletionUserMessageParam
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional, Tuple
+import asyncio
+import re
+import numpy as np
+from helpers.async_helpers import iterate_sync, run_sync
+from helpers.base_agent import BaseAgent
+from helpers.embedding_pipeline import EmbeddingPipeline
+from helpers.stream_helpers import StreamEvent
+from helpers.tracing import current_span, traced
+
+
+class AgentRegistry:
+    """
+    A class representing a team of agents that an orchestrator drives as if it was a single agent, e.g. `ReActOrchestrator(..., agent=AgentRegistry([...], pipeline))`.
+
+    Each instruction is routed without an LLM call, through an index of the embeddings of each agent's description and skill descriptions, built on first use.
+    The instruction is split into sentences, and a sentence that starts by referring to the previous one (e.g. "Then ...") is kept with it.
+    Each part goes to the agent whose descriptions are most similar to it, if that agent leads the others by at least `min_margin`; parts without a clear agent go with their neighbours.
+    When the parts go to different agents, the agents run concurrently, each with its own part of the instruction, and their responses are merged into a single message,
+    so that an instruction that spans several domains is executed in a single turn.
+
+    The team is described to the orchestrator by the details of all its agents. A registry with a single agent passes every query to it.
+    """
+
+    DEPENDENT_PATTERN = re.compile(r"^(then|after|afterwards|next|finally|also|using|based on|with (it|them|this|that|those|the))\b", re.IGNORECASE)
+    SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+|\n+")
+
+    def __init__(self, agents: List[BaseAgent], embedding_pipeline: EmbeddingPipeline, min_margin: float = 0.05):
+        if not agents:
+            raise ValueError("An agent registry needs at least one agent.")
+
+        self.agents: List[BaseAgent] = []
+        self.embedding_pipeline = embedding_pipeline
+        self.min_margin = min_margin
+        self._index: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+        for agent in agents:
+            self.register(agent)
+
+    def register(self, agent: BaseAgent) -> None:
+        if any(registered.name == agent.name for registered in self.agents):
+            raise ValueError(f"An agent named {agent.name} is already registered.")
+
+        self.agents.append(agent)
+        self._index = None
+
+    def get_agent_details(self) -> str:
+        return "\n\n".join(agent.get_agent_details() for agent in self.agents)
+
+    @staticmethod
+    def _get_descriptions(agent: BaseAgent) -> List[str]:
+        return [f"{agent.name}: {agent.description}",
+                *[f"{skill['function']['name']}: {skill['function']['description']}" for skill in agent.skills]]
+
+    async def _aget_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._index is None:
+            descriptions = [(i, text) for i, agent in enumerate(self.agents) for text in self._get_descriptions(agent)]
+            embeddings = np.asarray(await self.embedding_pipeline.acreate_embeddings([text for _, text in descriptions]), dtype=np.float32)
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+            self._index = embeddings, np.array([i for i, _ in descriptions])
+
+        return self._index
+
+    def split_instruction(self, instruction: str) -> List[str]:
+        """
+        Splits an instruction into the parts that can be executed independently: its sentences, with each sentence that refers to the previous one kept with it.
+        """
+
+        parts = []
+        for sentence in self.SENTENCE_PATTERN.split(instruction.strip()):
+            sentence = sentence.strip().lstrip("-*• ").strip()
+            if not sentence:
+                continue
+
+            if parts and self.DEPENDENT_PATTERN.match(sentence):
+                parts[-1] += " " + sentence
+            else:
+                parts.append(sentence)
+
+        return parts or [instruction]
+
+    async def aroute(self, instruction: str) -> List[Tuple[BaseAgent, str]]:
+        """
+        Routes an instruction to the agents of the team.
+
+        Returns:
+            List[Tuple[BaseAgent, str]]: The agents to run, each with its part of the instruction, in the order the parts appear in the instruction.
+        """
+
+        if len(self.agents) == 1:
+            return [(self.agents[0], instruction)]
+
+        parts = self.split_instruction(instruction)
+        embeddings, owners = await self._aget_index()
+        queries = np.asarray(await self.embedding_pipeline.acreate_embeddings([instruction, *parts]), dtype=np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        # The score of an agent is the similarity of its closest description.
+        scores = np.full((queries.shape[0], len(self.agents)), -np.inf, dtype=np.float32)
+        np.maximum.at(scores.T, owners, (queries @ embeddings.T).T)
+
+        ranked = np.sort(scores, axis=1)
+        best = np.argmax(scores, axis=1)
+        confident = ranked[:, -1] - ranked[:, -2] >= self.min_margin
+
+        # Parts without a clear agent go with the previous part, or, at the start, with the next one.
+        routes = [int(best[i + 1]) if confident[i + 1] else None for i in range(len(parts))]
+        for i in range(1, len(routes)):
+            if routes[i] is None:
+                routes[i] = routes[i - 1]
+        for i in range(len(routes) - 2, -1, -1):
+            if routes[i] is None:
+                routes[i] = routes[i + 1]
+
+        if routes[0] is None or len(set(routes)) == 1:
+            return [(self.agents[routes[0] if routes[0] is not None else int(best[0])], instruction)]
+
+        grouped = {}
+        for route, part in zip(routes, parts):
+            grouped.setdefault(route, []).append(part)
+
+        return [(self.agents[route], " ".join(group)) for route, group in grouped.items()]
+
+    @staticmethod
+    def _get_instruction(messages: List[Any]) -> str:
+        message = messages[-1]
+        content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+        return content if isinstance(content, str) else ""
+
+    @staticmethod
+    def _replace_instruction(messages: List[Any], instruction: str) -> List[Any]:
+        return [*messages[:-1], ChatCompletionUserMessageParam(role="user", content=instruction)]
+
+    def process_query(self, messages: List[Any], on_tool_results: Optional[Callable[[List[Any]], None]] = None) -> ChatCompletionMessage:
+        return run_sync(self.aprocess_query(messages, on_tool_results))
+
+    @traced
+    async def aprocess_query(self, messages: List[Any], on_tool_results: Optional[Callable[[List[Any]], None]] = None) -> ChatCompletionMessage:
+        """
+        Routes the last message of the conversation, the instruction, to the agents of the team, and responds with their merged responses.
+
+        Args:
+            messages: The conversation to respond to, ending with the instruction.
+            on_tool_results: See `BaseAgent.aprocess_query`. When several agents run, it is invoked once, with the tool results of all of them,
+                as soon as every agent has either run its tools or responded without calling any.
+        """
+
+        routes = await self.aroute(self._get_instruction(messages))
+        current_span().set_attributes(agents=len(routes))
+
+        if len(routes) == 1:
+            agent, _ = routes[0]
+            return await agent.aprocess_query(messages, on_tool_results)
+
+        return await self._afan_out(messages, routes, on_tool_results)
+
+    async def _afan_out(self, messages: List[Any], routes: List[Tuple[BaseAgent, str]], on_tool_results: Optional[Callable[[List[Any]], None]]) -> ChatCompletionMessage:
+        tool_results = []
+        pending = len(routes)
+
+        def _report(results: List[Any]) -> None:
+            nonlocal pending
+            tool_results.extend(results)
+            pending -= 1
+
+            if pending == 0 and tool_results and on_tool_results is not None:
+                on_tool_results(tool_results)
+
+        async def _run(agent: BaseAgent, instruction: str) -> ChatCompletionMessage:
+            reported = False
+
+            def _on_tool_results(results: List[Any]) -> None:
+                nonlocal reported
+                reported = True
+                _report(results)
+
+            message = await agent.aprocess_query(self._replace_instruction(messages, instruction), _on_tool_results)
+
+            if not reported:
+                _report([])
+
+            return message
+
+        responses = await asyncio.gather(*[_run(agent, instruction) for agent, instruction in routes])
+
+        return ChatCompletionMessage(role="assistant", content="\n\n".join(
+            f"{agent.name}:\n{response.content}" for (agent, _), response in zip(routes, responses)))
+
+    def stream_query(self, messages: List[Any], on_tool_results: Optional[Callable[[List[Any]], None]] = None) -> Iterator[StreamEvent]:
+        return iterate_sync(self.astream_query(messages, on_tool_results))
+
+    @traced
+    async def astream_query(self, messages: List[Any], on_tool_results: Optional[Callable[[List[Any]], None]] = None) -> AsyncIterator[StreamEvent]:
+        """
+        Responds like `aprocess_query`, streaming the response of the agent when the instruction is routed to a single agent.
+        When several agents run concurrently, only their merged response is yielded, as a `message` event.
+        """
+
+        routes = await self.aroute(self._get_instruction(messages))
+        current_span().set_attributes(agents=len(routes))
+
+        if len(routes) == 1:
+            agent, _ = routes[0]
+            async for event in agent.astream_query(messages, on_tool_results):
+                yield event
+            return
+
+        yield StreamEvent(type="message", message=await self._afan_out(messages, routes, on_tool_results))
@@ -0,0 +1,95 @@
+from typing import Any, AsyncIterable, Awaitable, Iterator, Optional, TypeVar
+import asyncio
+import queue
+import threading
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_loop_lock = threading.Lock()
+
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _loop_thread
+
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(
+                target=_loop.run_forever, name="async-helpers-loop", daemon=True)
+            _loop_thread.start()
+
+    return _loop
+
+
+def run_sync(awaitable: Awaitable[T]) -> T:
+    """
+    Runs an awaitable to completion from synchronous code and returns its result.
+
+    All awaitables are run on a single, shared background event loop. This works whether or not the caller already has a running event loop (e.g. in a Jupyter notebook),
+    and keeps async clients, whose connection pools are bound to the loop they were first used on, on the same loop across calls.
+
+    Args:
+        awaitable: The coroutine or awaitable to run.
+
+    Returns:
+        The result of the awaitable.
+    """
+
+    loop = _get_background_loop()
+
+    if threading.current_thread() is _loop_thread:
+        raise RuntimeError(
+            "run_sync cannot be called from a coroutine running on the shared event loop; await the coroutine instead.")
+
+    async def _await() -> Any:
+        return await awaitable
+
+    return asyncio.run_coroutine_threadsafe(_await(), loop).result()
+
+
+def iterate_sync(iterable: AsyncIterable[T]) -> Iterator[T]:
+    """
+    Iterates an async iterable from synchronous code, yielding each item as soon as it is produced.
+
+    The whole iteration runs as a single task on the shared background event loop, so context variables set by the iterable (e.g. the run's stats) are kept across items.
+    Stopping the iteration early cancels the task.
+
+    Args:
+        iterable: The async iterable to iterate, e.g. an async generator.
+
+    Returns:
+        Iterator[T]: The items of the iterable.
+    """
+
+    loop = _get_background_loop()
+
+    if threading.current_thread() is _loop_thread:
+        raise RuntimeError(
+            "iterate_sync cannot be called from a coroutine running on the shared event loop; use async for instead.")
+
+    items: queue.Queue = queue.Queue()
+    done = object()
+
+    async def _pump() -> None:
+        try:
+            async for item in iterable:
+                items.put((item, None))
+        except BaseException as e:
+            items.put((None, e))
+        finally:
+            items.put((done, None))
+
+    future = asyncio.run_coroutine_threadsafe(_pump(), loop)
+
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        future.cancel()
@@ -1,8 +1,18 @@
-from openai import OpenAI
-from openai.types.chat import ChatCompletionMessage
-from typing import Callable, List, Any
+from concurrent.futures import ThreadPoolExecutor
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ChatCompletionMessage, ChatCompletionMessageToolCall, ParsedChatCompletion
+from typing import AsyncIterator, Callable, Iterator, List, Any, Optional, Tuple
+import asyncio
+import contextvars
+import functools
 import inspect
+import json
 from pydantic import create_model
+from helpers.async_helpers import iterate_sync, run_sync
+from helpers.run_stats import record_stat, record_usage
+from helpers.skill_cache import SkillCache
+from helpers.stream_helpers import StreamEvent, acreate_completion_stream, astream_message
+from helpers.tracing import current_span, trace, traced
 
 
 def _remove_schema_titles(schema: dict) -> dict:
@@ -15,7 +25,66 @@ def _remove_schema_titles(schema: dict) -> dict:
     return schema
 
 
-def skill(func: Callable) -> Callable:
+def _memoize(func: Callable, signature: inspect.Signature, ttl: Optional[float], max_entries: Optional[int], persist: bool, versioned: bool, cache_if: Optional[Callable[[Any], bool]]) -> Callable:
+    def _get_key(self: "BaseAgent", args: tuple, kwargs: dict) -> str:
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments = {name: value for name, value in bound.arguments.items() if name != "self"}
+        return self.skill_cache.create_key(arguments, self.catalog_version if versioned else None)
+
+    def _store(self: "BaseAgent", key: str, result: Any) -> None:
+        if cache_if is None or cache_if(result):
+            self.skill_cache.set(func.__name__, key, result, max_entries, persist)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(self: "BaseAgent", *args, **kwargs) -> Any:
+            key = _get_key(self, args, kwargs)
+            hit, result = self.skill_cache.get(func.__name__, key, ttl)
+            current_span().set_attribute("cache_hit", hit)
+            if hit:
+                record_stat("skill_cache_hits")
+                return result
+
+            result = await func(self, *args, **kwargs)
+            _store(self, key, result)
+            return result
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(self: "BaseAgent", *args, **kwargs) -> Any:
+        key = _get_key(self, args, kwargs)
+        hit, result = self.skill_cache.get(func.__name__, key, ttl)
+        current_span().set_attribute("cache_hit", hit)
+        if hit:
+            record_stat("skill_cache_hits")
+            return result
+
+        result = func(self, *args, **kwargs)
+        _store(self, key, result)
+        return result
+
+    return wrapper
+
+
+def skill(func: Optional[Callable] = None, *, memoize: bool = False, ttl: Optional[float] = None, max_entries: Optional[int] = 128, persist: bool = False, versioned: bool = True, cache_if: Optional[Callable[[Any], bool]] = None) -> Callable:
+    """
+    Registers a method as a skill of its agent, which can be used as `@skill` or with memoization options, e.g. `@skill(memoize=True, ttl=600)`.
+    Calls of the skill are traced as `skill.<name>` spans, with whether memoized skills were answered from the cache.
+
+    Args:
+        memoize: Whether to memoize the skill's results in the agent's `skill_cache`, keyed on the skill's name, canonicalized arguments and, if `versioned`, the agent's `catalog_version`.
+        ttl: The number of seconds a memoized result is reused for, or None to reuse it until it is evicted.
+        max_entries: The maximum number of memoized results to keep for the skill, evicting the least recently used.
+        persist: Whether to persist memoized results, so that they are reused across runs.
+        versioned: Whether memoized results depend on the agent's catalog, and so are not reused once it changes.
+        cache_if: An optional predicate on a result that must hold for it to be memoized, e.g. to not memoize failures.
+    """
+
+    if func is None:
+        return lambda func: skill(func, memoize=memoize, ttl=ttl, max_entries=max_entries, persist=persist, versioned=versioned, cache_if=cache_if)
+
     try:
         signature = inspect.signature(func)
     except ValueError as e:
@@ -39,6 +108,11 @@ def skill(func: Callable) -> Callable:
     desc = func.__doc__ or ""
     desc = desc.strip().replace("\n", " ")
 
+    if memoize:
+        func = _memoize(func, signature, ttl, max_entries, persist, versioned, cache_if)
+
+    func = traced(func, name=f"skill.{func.__name__}")
+
     func.__skill_schema__ = {
         "type": "function",
         "function": {
@@ -52,18 +126,35 @@ def skill(func: Callable) -> Callable:
 
 
 class BaseAgent:
-    def __init__(self, name: str, description: str, client: OpenAI, model_deployment: str):
+    _skill_schemas: List[dict] = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        # Register function skills once per class, rather than reflecting over every instance
+        cls._skill_schemas = []
+        for attr_name in dir(cls):
+            attr = getattr(cls, attr_name, None)
+            if callable(attr) and getattr(attr, "__is_skill__", False):
+                cls._skill_schemas.append(attr.__skill_schema__)
+
+    def __init__(self, name: str, description: str, client: OpenAI, model_deployment: str, max_tool_concurrency: int = 4, async_client: Optional[AsyncOpenAI] = None, skill_cache: Optional[SkillCache] = None):
         self.name = name
         self.description = description
         self.client = client
+        self.async_client = async_client
         self.model_deployment = model_deployment
-        self.skills = []
+        self.max_tool_concurrency = max(1, max_tool_concurrency)
+        self.skill_cache = skill_cache or SkillCache()
+        self.skills = list(self._skill_schemas)
 
-        # Register function skills
-        for attr_name in dir(self):
-            attr = getattr(self, attr_name)
-            if callable(attr) and getattr(attr, "__is_skill__", False):
-                self.skills.append(attr.__skill_schema__)
+    @property
+    def catalog_version(self) -> Any:
+        """
+        Gets the version of the data the agent's skills read, which keys memoized skill results. Agents whose data changes should override it.
+        """
+
+        return 0
 
     def get_agent_details(self) -> str:
         if len(self.skills) == 0:
@@ -74,11 +165,144 @@ class BaseAgent:
 
         return f"- Name: {self.name}\n- Description: {self.description}\n- Skills:\n{skills}"
 
+    async def acreate_completion(self, **kwargs) -> ChatCompletion:
+        """
+        Creates a chat completion with the async client, or with the sync client on a worker thread if no async client was provided.
+        """
+
+        with trace("llm.chat", model=kwargs.get("model")) as span:
+            record_stat("llm_calls")
+
+            if self.async_client is not None:
+                completion = await self.async_client.chat.completions.create(**kwargs)
+            else:
+                completion = await asyncio.to_thread(self.client.chat.completions.create, **kwargs)
+
+            record_usage(completion)
+            span.record_usage(completion)
+            return completion
+
+    async def aparse_completion(self, **kwargs) -> ParsedChatCompletion:
+        """
+        Creates a structured output chat completion with the async client, or with the sync client on a worker thread if no async client was provided.
+        """
+
+        with trace("llm.parse", model=kwargs.get("model")) as span:
+            record_stat("llm_calls")
+
+            if self.async_client is not None:
+                completion = await self.async_client.beta.chat.completions.parse(**kwargs)
+            else:
+                completion = await asyncio.to_thread(self.client.beta.chat.completions.parse, **kwargs)
+
+            record_usage(completion)
+            span.record_usage(completion)
+            return completion
+
+    def acreate_completion_stream(self, **kwargs) -> AsyncIterator[ChatCompletionChunk]:
+        """
+        Creates a streamed chat completion with the async client, or with the sync client on a worker thread if no async client was provided.
+        """
+
+        return acreate_completion_stream(self.client, self.async_client, **kwargs)
+
     def call_function(self, function_name: str, **kwargs) -> Any:
-        return getattr(self, function_name)(**kwargs)
+        with trace("call_function", function=function_name):
+            result = getattr(self, function_name)(**kwargs)
+
+            if inspect.isawaitable(result):
+                return run_sync(result)
+
+            return result
+
+    async def acall_function(self, function_name: str, **kwargs) -> Any:
+        with trace("call_function", function=function_name):
+            function = getattr(self, function_name)
 
-    def process_query(self, messages: List[str]) -> ChatCompletionMessage:
-        completion = self.client.chat.completions.create(
+            if inspect.iscoroutinefunction(function):
+                return await function(**kwargs)
+
+            return await asyncio.to_thread(function, **kwargs)
+
+    def _parse_tool_call(self, tool_call: ChatCompletionMessageToolCall) -> Tuple[str, dict]:
+        function_name = tool_call.function.name
+        function_args = json.loads(tool_call.function.arguments or "{}")
+
+        print(f"Executing tool function: {function_name} with arguments: {function_args}")
+
+        return function_name, function_args
+
+    def _create_tool_message(self, tool_call: ChatCompletionMessageToolCall, content: Any) -> dict:
+        return {
+            "tool_call_id": tool_call.id,
+            "role": "tool",
+            "name": tool_call.function.name,
+            "content": content
+        }
+
+    def call_tool(self, tool_call: ChatCompletionMessageToolCall) -> dict:
+        """
+        Executes a single tool call and returns its tool message. Any exception raised by the skill is returned as the tool's content, so that the model can react to it.
+        """
+
+        try:
+            function_name, function_args = self._parse_tool_call(tool_call)
+            content = self.call_function(function_name, **function_args)
+        except Exception as e:
+            content = f"Error executing tool function {tool_call.function.name}: {e}"
+
+        return self._create_tool_message(tool_call, content)
+
+    async def acall_tool(self, tool_call: ChatCompletionMessageToolCall) -> dict:
+        try:
+            function_name, function_args = self._parse_tool_call(tool_call)
+            content = await self.acall_function(function_name, **function_args)
+        except Exception as e:
+            content = f"Error executing tool function {tool_call.function.name}: {e}"
+
+        return self._create_tool_message(tool_call, content)
+
+    def call_tools(self, tool_calls: List[ChatCompletionMessageToolCall]) -> List[dict]:
+        """
+        Executes the tool calls of a completion, running up to `max_tool_concurrency` of them at the same time.
+
+        Returns:
+            List[dict]: The tool messages, in the same order as `tool_calls`.
+        """
+
+        if len(tool_calls) <= 1 or self.max_tool_concurrency == 1:
+            return [self.call_tool(tool_call) for tool_call in tool_calls]
+
+        # Each tool runs in a copy of the caller's context, so that its stats and spans are recorded in the caller's run.
+        context = contextvars.copy_context()
+
+        with ThreadPoolExecutor(max_workers=min(self.max_tool_concurrency, len(tool_calls))) as executor:
+            return list(executor.map(lambda tool_call: context.copy().run(self.call_tool, tool_call), tool_calls))
+
+    async def acall_tools(self, tool_calls: List[ChatCompletionMessageToolCall]) -> List[dict]:
+        semaphore = asyncio.Semaphore(self.max_tool_concurrency)
+
+        async def _call(tool_call: ChatCompletionMessageToolCall) -> dict:
+            async with semaphore:
+                return await self.acall_tool(tool_call)
+
+        return list(await asyncio.gather(*[_call(tool_call) for tool_call in tool_calls]))
+
+    def process_query(self, messages: List[str], on_tool_results: Optional[Callable[[List[Any]], None]] = None) -> ChatCompletionMessage:
+        return run_sync(self.aprocess_query(messages, on_tool_results))
+
+    @traced
+    async def aprocess_query(self, messages: List[str], on_tool_results: Optional[Callable[[List[Any]], None]] = None) -> ChatCompletionMessage:
+        """
+        Responds to the conversation in `messages`.
+
+        Args:
+            messages: The conversation to respond to.
+            on_tool_results: An optional callback for agents that call tools. It is invoked with the tool-calling assistant message and the tool messages as soon as the tools have run,
+                before the agent produces its response, so that the caller can start dependent work (e.g. validation) early.
+        """
+
+        completion = await self.acreate_completion(
             model=self.model_deployment,
             messages=messages,
             temperature=0.3,
@@ -86,3 +310,29 @@ class BaseAgent:
         )
 
         return completion.choices[0].message
+
+    def stream_query(self, messages: List[str], on_tool_results: Optional[Callable[[List[Any]], None]] = None) -> Iterator[StreamEvent]:
+        return iterate_sync(self.astream_query(messages, on_tool_results))
+
+    @traced
+    async def astream_query(self, messages: List[str], on_tool_results: Optional[Callable[[List[Any]], None]] = None) -> AsyncIterator[StreamEvent]:
+        """
+        Responds to the conversation in `messages`, like `aprocess_query`, but streams the response as it is generated.
+
+        Args:
+            messages: The conversation to respond to.
+            on_tool_results: See `aprocess_query`.
+
+        Returns:
+            AsyncIterator[StreamEvent]: A `token` event for each piece of the response, followed by a `message` event with the full response.
+        """
+
+        chunks = self.acreate_completion_stream(
+            model=self.model_deployment,
+            messages=messages,
+            temperature=0.3,
+            top_p=0.3,
+        )
+
+        async for event in astream_message(chunks):
+            yield event
@@ -0,0 +1,131 @@
+from openai.types.chat.chat_completion_user_message_param import ChatCompletionUserMessageParam
+from typing import Any, Callable, Iterable, List, Optional
+from helpers.message_helpers import get_message_content, get_message_role, get_message_tool_calls, with_message_content
+from helpers.text_helpers import estimate_tokens
+
+
+class ConversationCompactor:
+    """
+    A class representing a token budget for a conversation that is resent on every request, such as the ReAct `execute_messages`.
+
+    When the conversation is over `max_tokens`, older messages are compacted, oldest first, until it fits:
+
+    1. Older tool outputs, then other older messages, are truncated to `max_old_message_tokens`.
+    2. If that is not enough, older messages are dropped and replaced with a single note, or with a summary from the optional `summarize` callback.
+
+    Pinned messages (by default the first message, e.g. an execution header) and the `keep_recent` most recent messages are never compacted.
+    An assistant message with tool calls and its tool messages are always kept or dropped together.
+    """
+
+    def __init__(self, max_tokens: int = 16_000, keep_recent: int = 6, max_old_message_tokens: int = 200, summarize: Optional[Callable[[List[Any]], str]] = None):
+        self.max_tokens = max_tokens
+        self.keep_recent = keep_recent
+        self.max_old_message_tokens = max_old_message_tokens
+        self.summarize = summarize
+
+    @staticmethod
+    def count_tokens(message: Any) -> int:
+        tokens = estimate_tokens(get_message_content(message)) + 4
+
+        for tool_call in get_message_tool_calls(message):
+            function = tool_call["function"] if isinstance(tool_call, dict) else tool_call.function
+            arguments = function["arguments"] if isinstance(function, dict) else function.arguments
+            tokens += estimate_tokens(arguments or "") + 8
+
+        return tokens
+
+    def _truncate(self, message: Any) -> Any:
+        content = get_message_content(message)
+        max_chars = self.max_old_message_tokens * 4
+
+        if len(content) <= max_chars:
+            return message
+
+        omitted = estimate_tokens(content[max_chars:])
+        return with_message_content(message, f"{content[:max_chars]}\n\n[... {omitted} tokens truncated ...]")
+
+    def _groups(self, messages: List[Any], indices: Iterable[int]) -> List[List[int]]:
+        # Groups tool messages with the assistant message that requested them.
+        groups: List[List[int]] = []
+        for i in indices:
+            if get_message_role(messages[i]) == "tool" and groups and get_message_tool_calls(messages[groups[-1][0]]):
+                groups[-1].append(i)
+            else:
+                groups.append([i])
+        return groups
+
+    def compact(self, messages: List[Any], pinned: Iterable[int] = (0,)) -> List[Any]:
+        """
+        Compacts the conversation to fit within the token budget.
+
+        Args:
+            messages: The conversation. It is not modified.
+            pinned: The positions of messages that must be kept as-is.
+
+        Returns:
+            List[Any]: The conversation as it should be sent; the same list when it is already within budget.
+        """
+
+        counts = [self.count_tokens(message) for message in messages]
+        total = sum(counts)
+
+        if total <= self.max_tokens:
+            return messages
+
+        pinned = {i if i >= 0 else len(messages) + i for i in pinned}
+
+        # The recent window must not start with tool messages that would be separated from their assistant message.
+        recent_start = max(0, len(messages) - self.keep_recent)
+        while 0 < recent_start < len(messages) and get_message_role(messages[recent_start]) == "tool":
+            recent_start -= 1
+
+        compactable = [i for i in range(recent_start) if i not in pinned]
+        compacted = list(messages)
+
+        # 1 - Truncate older tool outputs first, as they are the largest and least useful once acted upon, then other older messages.
+        by_priority = sorted(compactable, key=lambda i: (
+            get_message_role(messages[i]) != "tool", i))
+
+        for i in by_priority:
+            if total <= self.max_tokens:
+                return compacted
+
+            truncated = self._truncate(compacted[i])
+            if truncated is not compacted[i]:
+                tokens = self.count_tokens(truncated)
+                total -= counts[i] - tokens
+                counts[i] = tokens
+                compacted[i] = truncated
+
+        if total <= self.max_tokens:
+            return compacted
+
+        # 2 - Drop the oldest groups of messages until the conversation fits.
+        # Leaves room for the note that replaces the dropped messages.
+        total += 32
+        dropped = set()
+        for group in self._groups(messages, compactable):
+            if total <= self.max_tokens:
+                break
+            dropped.update(group)
+            total -= sum(counts[i] for i in group)
+
+        if not dropped:
+            return compacted
+
+        if self.summarize is not None:
+            note = self.summarize([messages[i] for i in sorted(dropped)])
+        else:
+            note = f"[{len(dropped)} earlier messages were omitted to stay within the context budget.]"
+
+        result = []
+        note_added = False
+        for i, message in enumerate(compacted):
+            if i in dropped:
+                if not note_added:
+                    result.append(ChatCompletionUserMessageParam(role="user", content=note))
+                    note_added = True
+                continue
+            result.append(message)
+
+        return result
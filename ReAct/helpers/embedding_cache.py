@@ -0,0 +1,195 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from helpers.storage_helpers import get_data_path
+
+
+class EmbeddingCache:
+    """
+    A class representing a content-addressed embedding cache keyed by embedding deployment and the SHA-256 of the input text.
+
+    Lookups are served from an in-process LRU tier first and then from an optional on-disk SQLite tier, with hits on disk promoted into memory.
+    Both tiers are size-bounded; the disk tier evicts its least recently used entries in batches once it grows past its limit.
+    """
+
+    def __init__(self, path: Optional[str] = get_data_path("embedding_cache.sqlite3"), max_memory_entries: int = 10_000, max_disk_entries: int = 1_000_000):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        self._memory: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._disk_entries = 0
+
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash))""")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._connection.commit()
+            self._disk_entries = self._connection.execute(
+                "SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "memory_entries": len(self._memory),
+            "disk_entries": self._disk_entries,
+        }
+
+    def _remember(self, key: Tuple[str, str], embedding: np.ndarray) -> None:
+        self._memory[key] = embedding
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model_deployment: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """
+        Looks up the cached embeddings for the given texts.
+
+        Args:
+            model_deployment: The embedding deployment the embeddings were created with.
+            texts: The texts to look up.
+
+        Returns:
+            List[Optional[List[float]]]: The cached embedding for each text, or None where the text has not been cached.
+        """
+
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        disk_lookups: Dict[str, List[int]] = {}
+
+        with self._lock:
+            for i, text in enumerate(texts):
+                key = (model_deployment, self.hash_text(text))
+                embedding = self._memory.get(key)
+
+                if embedding is not None:
+                    self._memory.move_to_end(key)
+                    results[i] = embedding.tolist()
+                    self.memory_hits += 1
+                else:
+                    disk_lookups.setdefault(key[1], []).append(i)
+
+            if disk_lookups and self._connection is not None:
+                hashes = list(disk_lookups.keys())
+                found = []
+
+                # Stay well below SQLite's bound parameter limit.
+                for start in range(0, len(hashes), 500):
+                    chunk = hashes[start:start + 500]
+                    rows = self._connection.execute(
+                        f"SELECT text_hash, embedding FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(chunk))})",
+                        [model_deployment, *chunk]).fetchall()
+
+                    for text_hash, blob in rows:
+                        embedding = np.frombuffer(blob, dtype=np.float32)
+                        self._remember((model_deployment, text_hash), embedding)
+                        for i in disk_lookups[text_hash]:
+                            results[i] = embedding.tolist()
+                        self.disk_hits += len(disk_lookups[text_hash])
+                        found.append(text_hash)
+
+                if found:
+                    now = time.time()
+                    self._connection.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                        [(now, model_deployment, text_hash) for text_hash in found])
+                    self._connection.commit()
+
+            found_count = sum(1 for result in results if result is not None)
+            self.hits += found_count
+            self.misses += len(texts) - found_count
+
+        return results
+
+    def get(self, model_deployment: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model_deployment, [text])[0]
+
+    def set_many(self, model_deployment: str, texts: Sequence[str], embeddings: Sequence[Sequence[float]]) -> None:
+        """
+        Stores embeddings for the given texts in both cache tiers.
+
+        Args:
+            model_deployment: The embedding deployment the embeddings were created with.
+            texts: The texts that were embedded.
+            embeddings: The embeddings, in the same order as `texts`.
+        """
+
+        now = time.time()
+        rows = []
+
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                text_hash = self.hash_text(text)
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember((model_deployment, text_hash), vector)
+                rows.append((model_deployment, text_hash, vector.tobytes(), now))
+
+            if rows and self._connection is not None:
+                before = self._connection.total_changes
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO embeddings (model, text_hash, embedding, last_used) VALUES (?, ?, ?, ?)", rows)
+                self._disk_entries += self._connection.total_changes - before
+                self._evict()
+                self._connection.commit()
+
+    def set(self, model_deployment: str, text: str, embedding: Sequence[float]) -> None:
+        self.set_many(model_deployment, [text], [embedding])
+
+    def _evict(self) -> None:
+        if self._disk_entries <= self.max_disk_entries:
+            return
+
+        # Evict down to 90% of the limit so that eviction runs once per batch of inserts rather than on every insert.
+        target = int(self.max_disk_entries * 0.9)
+        excess = self._disk_entries - target
+        self._connection.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+        self._disk_entries -= excess
+        self.evictions += excess
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._connection is not None:
+                self._connection.execute("DELETE FROM embeddings")
+                self._connection.commit()
+                self._disk_entries = 0
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
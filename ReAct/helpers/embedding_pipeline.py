@@ -0,0 +1,188 @@
+from concurrent.futures import ThreadPoolExecutor
+from openai import AsyncOpenAI, OpenAI
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import contextvars
+from helpers.embedding_cache import EmbeddingCache
+from helpers.text_helpers import estimate_tokens
+from helpers.tracing import trace
+
+
+class EmbeddingPipeline:
+    """
+    A class representing a batched embedding pipeline for an embeddings deployment.
+
+    Texts are grouped into batches bounded by both an input count and an approximate token budget, each batch is sent as a single list input to the embeddings API,
+    and a bounded number of batches are in flight at the same time. Results are mapped back to the original text positions using the index of each returned item.
+
+    When a cache is provided, only texts that are not already cached are sent to the API, and duplicate texts within a call are embedded once.
+
+    The client only needs to expose `embeddings.create(input=..., model=...)`, so a fake local client can be used in place of an `OpenAI` client.
+    The async methods use the async client when one is provided, and otherwise run the sync client on worker threads.
+    """
+
+    def __init__(self, client: OpenAI, model_deployment: str, batch_size: int = 256, max_batch_tokens: int = 100_000, max_concurrency: int = 4, cache: Optional[EmbeddingCache] = None, async_client: Optional[AsyncOpenAI] = None):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1.")
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1.")
+
+        self.client = client
+        self.async_client = async_client
+        self.model_deployment = model_deployment
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+
+    def create_batches(self, texts: List[str]) -> List[List[int]]:
+        """
+        Groups the positions of the given texts into batches that respect the batch size and token budget.
+        A single text that exceeds the token budget on its own is sent in a batch of one.
+
+        Args:
+            texts: The texts to group.
+
+        Returns:
+            List[List[int]]: The batches, as lists of positions into `texts`.
+        """
+
+        batches = []
+        batch = []
+        batch_tokens = 0
+
+        for i, text in enumerate(texts):
+            tokens = estimate_tokens(text)
+
+            if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+
+            batch.append(i)
+            batch_tokens += tokens
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+    def _embed_batch(self, texts: List[str], batch: List[int]) -> Dict[int, List[float]]:
+        with trace("embeddings.request", inputs=len(batch)) as span:
+            response = self.client.embeddings.create(
+                input=[texts[i] for i in batch],
+                model=self.model_deployment)
+            span.record_usage(response)
+
+        return {batch[item.index]: item.embedding for item in response.data}
+
+    async def _aembed_batch(self, texts: List[str], batch: List[int]) -> Dict[int, List[float]]:
+        if self.async_client is None:
+            return await asyncio.to_thread(self._embed_batch, texts, batch)
+
+        with trace("embeddings.request", inputs=len(batch)) as span:
+            response = await self.async_client.embeddings.create(
+                input=[texts[i] for i in batch],
+                model=self.model_deployment)
+            span.record_usage(response)
+
+        return {batch[item.index]: item.embedding for item in response.data}
+
+    def _lookup_cached(self, texts: List[str]) -> Tuple[List[Optional[List[float]]], List[str]]:
+        if self.cache is None:
+            return [None] * len(texts), list(dict.fromkeys(texts))
+
+        embeddings = self.cache.get_many(self.model_deployment, texts)
+        pending = list(dict.fromkeys(
+            text for text, embedding in zip(texts, embeddings) if embedding is None))
+        return embeddings, pending
+
+    def _merge_created(self, texts: List[str], embeddings: List[Optional[List[float]]], pending: List[str], created: List[List[float]]) -> List[List[float]]:
+        if self.cache is not None:
+            self.cache.set_many(self.model_deployment, pending, created)
+
+        created_by_text = dict(zip(pending, created))
+        return [embedding if embedding is not None else created_by_text[text]
+                for text, embedding in zip(texts, embeddings)]
+
+    @staticmethod
+    def _ordered_results(texts: List[str], results: Dict[int, List[float]]) -> List[List[float]]:
+        missing = [i for i in range(len(texts)) if i not in results]
+        if missing:
+            raise ValueError(
+                f"The embeddings response did not include results for {len(missing)} of {len(texts)} inputs.")
+
+        return [results[i] for i in range(len(texts))]
+
+    def create_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        Creates embeddings for the given texts.
+
+        Args:
+            texts: The texts to embed.
+
+        Returns:
+            List[List[float]]: The embeddings, in the same order as `texts`.
+        """
+
+        if not texts:
+            return []
+
+        with trace("embeddings.create", texts=len(texts)) as span:
+            embeddings, pending = self._lookup_cached(texts)
+            span.set_attribute("cache_hits", len(texts) - sum(embedding is None for embedding in embeddings))
+
+            if pending:
+                embeddings = self._merge_created(
+                    texts, embeddings, pending, self._create_uncached_embeddings(pending))
+
+            return embeddings
+
+    async def acreate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        with trace("embeddings.create", texts=len(texts)) as span:
+            embeddings, pending = self._lookup_cached(texts)
+            span.set_attribute("cache_hits", len(texts) - sum(embedding is None for embedding in embeddings))
+
+            if pending:
+                embeddings = self._merge_created(
+                    texts, embeddings, pending, await self._acreate_uncached_embeddings(pending))
+
+            return embeddings
+
+    def _create_uncached_embeddings(self, texts: List[str]) -> List[List[float]]:
+        batches = self.create_batches(texts)
+        results: Dict[int, List[float]] = {}
+
+        if len(batches) == 1 or self.max_concurrency == 1:
+            for batch in batches:
+                results.update(self._embed_batch(texts, batch))
+        else:
+            context = contextvars.copy_context()
+
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                for batch_results in executor.map(lambda batch: context.copy().run(self._embed_batch, texts, batch), batches):
+                    results.update(batch_results)
+
+        return self._ordered_results(texts, results)
+
+    async def _acreate_uncached_embeddings(self, texts: List[str]) -> List[List[float]]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def _embed(batch: List[int]) -> Dict[int, List[float]]:
+            async with semaphore:
+                return await self._aembed_batch(texts, batch)
+
+        results: Dict[int, List[float]] = {}
+        for batch_results in await asyncio.gather(*[_embed(batch) for batch in self.create_batches(texts)]):
+            results.update(batch_results)
+
+        return self._ordered_results(texts, results)
+
+    def create_embedding(self, text: str) -> List[float]:
+        return self.create_embeddings([text])[0]
+
+    async def acreate_embedding(self, text: str) -> List[float]:
+        return (await self.acreate_embeddings([text]))[0]
@@ -0,0 +1,432 @@
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Type
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import numpy as np
+from openai.types import CreateEmbeddingResponse
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ParsedChatCompletion
+from pydantic import BaseModel
+from helpers.storage_helpers import CustomEncoder, append_json_line, read_json_lines
+from helpers.text_helpers import estimate_tokens
+
+# Request arguments that don't change the response, so that e.g. a streamed request replays a non-streamed recording.
+_IGNORED_ARGUMENTS = frozenset(["stream", "stream_options", "timeout", "extra_headers", "extra_query", "extra_body"])
+
+
+def create_completion(content: Optional[str] = None, tool_calls: Sequence[Tuple[str, Dict[str, Any]]] = (), model: str = "fake", usage: Optional[Tuple[int, int]] = None) -> ChatCompletion:
+    """
+    Creates a chat completion with an assistant message, e.g. for a responder of a `FakeOpenAI`.
+
+    Args:
+        content: The content of the message.
+        tool_calls: The tool calls of the message, as (function name, arguments) pairs.
+        model: The model the completion is attributed to.
+        usage: The (prompt, completion) tokens of the completion, if known.
+
+    Returns:
+        ChatCompletion: The completion.
+    """
+
+    message: Dict[str, Any] = {"role": "assistant", "content": content}
+    if tool_calls:
+        message["tool_calls"] = [{"id": f"call_{i}", "type": "function", "function": {"name": name, "arguments": json.dumps(arguments)}}
+                                 for i, (name, arguments) in enumerate(tool_calls)]
+
+    data: Dict[str, Any] = {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": 0,
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": "tool_calls" if tool_calls else "stop", "message": message}],
+    }
+    if usage is not None:
+        data["usage"] = {"prompt_tokens": usage[0], "completion_tokens": usage[1], "total_tokens": sum(usage)}
+
+    return ChatCompletion.model_validate(data)
+
+
+class LLMRecording:
+    """
+    A class representing recorded responses of chat completion, structured output and embedding requests, for replaying them with a `FakeOpenAI`.
+
+    Requests are keyed on their arguments, except for arguments that don't change the response (e.g. `stream`), so that a run that sends the same requests
+    gets the same responses. Recordings are appended to a JSON Lines file, if a path is given, and reloaded when the recording is created.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._responses: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+        if path is not None:
+            for item in read_json_lines(path):
+                self._responses[item["key"]] = item["response"]
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    @staticmethod
+    def create_key(kind: str, request: Dict[str, Any]) -> str:
+        arguments = {name: value for name, value in request.items() if name not in _IGNORED_ARGUMENTS}
+
+        # Structured output formats are pydantic classes, which are identified by their name.
+        if isinstance(arguments.get("response_format"), type):
+            arguments["response_format"] = arguments["response_format"].__name__
+
+        payload = json.dumps([kind, arguments], sort_keys=True, cls=CustomEncoder)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, kind: str, request: Dict[str, Any]) -> Optional[Any]:
+        with self._lock:
+            return self._responses.get(self.create_key(kind, request))
+
+    def add(self, kind: str, request: Dict[str, Any], response: Any) -> None:
+        key = self.create_key(kind, request)
+
+        with self._lock:
+            self._responses[key] = response
+            if self.path is not None:
+                append_json_line(self.path, {"kind": kind, "key": key, "response": response})
+
+
+class LatencyModel:
+    """
+    A class representing the latency a `FakeOpenAI` injects into its responses, to approximate a deployment.
+
+    A completion takes `request` seconds until its first token and `per_token` seconds for each completion token after it,
+    and an embedding request takes `embedding` seconds plus `per_input` seconds per input. Each delay is scaled by a random factor within ±`jitter`.
+    """
+
+    def __init__(self, request: float = 0.0, per_token: float = 0.0, embedding: float = 0.0, per_input: float = 0.0, jitter: float = 0.0, seed: int = 0):
+        self.request = request
+        self.per_token = per_token
+        self.embedding = embedding
+        self.per_input = per_input
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _scale(self, delay: float) -> float:
+        if self.jitter <= 0 or delay <= 0:
+            return delay
+
+        with self._lock:
+            return delay * (1 + self._random.uniform(-self.jitter, self.jitter))
+
+    def first_token_delay(self) -> float:
+        return self._scale(self.request)
+
+    def token_delay(self, tokens: int) -> float:
+        return self._scale(self.per_token * tokens)
+
+    def embedding_delay(self, inputs: int) -> float:
+        return self._scale(self.embedding + self.per_input * inputs)
+
+
+class FakeOpenAI:
+    """
+    A class representing a local stand-in for an `OpenAI` client, for running and benchmarking agents without a deployment.
+
+    It exposes `chat.completions.create` (including streaming), `beta.chat.completions.parse` and `embeddings.create`.
+    Requests are answered from a `LLMRecording`, e.g. recorded from a deployment with `RecordingOpenAI`, so that runs replay deterministically.
+    Requests that weren't recorded are answered by the `responder`, if one is given, which is called with the kind of request ("chat" or "parse")
+    and its arguments, and returns a `ChatCompletion`, the content of the message, or, for "parse", the parsed model.
+    Embeddings that weren't recorded are derived from the words of each input, so that texts that share words have similar embeddings.
+
+    Responses are delayed according to the `latency` model. Completions without usage are given an estimated usage, so that token counts can be compared across runs.
+    """
+
+    def __init__(self, recording: Optional[LLMRecording] = None, responder: Optional[Callable[[str, Dict[str, Any]], Any]] = None, latency: Optional[LatencyModel] = None, embedding_dimensions: int = 256):
+        self.recording = recording if recording is not None else LLMRecording()
+        self.responder = responder
+        self.latency = latency or LatencyModel()
+        self.embedding_dimensions = embedding_dimensions
+        self.calls: Counter = Counter()
+        self._word_vectors: Dict[str, np.ndarray] = {}
+
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self._parse)))
+        self.embeddings = SimpleNamespace(create=self._create_embeddings)
+
+    def _respond(self, kind: str, request: Dict[str, Any]) -> ChatCompletion:
+        self.calls[kind] += 1
+        recorded = self.recording.get(kind, request)
+
+        if recorded is not None:
+            completion = ChatCompletion.model_validate(recorded)
+        elif self.responder is not None:
+            completion = self._to_completion(self.responder(kind, request), request)
+        else:
+            raise KeyError(f"No recorded response for the {kind} request, and no responder to answer it.")
+
+        if completion.usage is None:
+            prompt_tokens = estimate_tokens(json.dumps(request.get("messages", []), cls=CustomEncoder))
+            completion_tokens = sum(self._count_tokens(choice.message) for choice in completion.choices)
+            completion.usage = create_completion(usage=(prompt_tokens, completion_tokens)).usage
+
+        return completion
+
+    @staticmethod
+    def _to_completion(response: Any, request: Dict[str, Any]) -> ChatCompletion:
+        if isinstance(response, ChatCompletion):
+            return response
+        if isinstance(response, BaseModel):
+            return create_completion(content=response.model_dump_json(), model=request.get("model", "fake"))
+        return create_completion(content=response, model=request.get("model", "fake"))
+
+    @staticmethod
+    def _count_tokens(message: Any) -> int:
+        text = message.content or ""
+        for tool_call in message.tool_calls or []:
+            text += tool_call.function.name + tool_call.function.arguments
+        return estimate_tokens(text)
+
+    @staticmethod
+    def _to_parsed(completion: ChatCompletion, response_format: Type[BaseModel]) -> ParsedChatCompletion:
+        data = completion.model_dump()
+        for choice in data["choices"]:
+            content = choice["message"].get("content")
+            choice["message"]["parsed"] = response_format.model_validate_json(content) if content else None
+        return ParsedChatCompletion[response_format].model_validate(data)
+
+    @staticmethod
+    def create_chunks(completion: ChatCompletion, include_usage: bool = False) -> List[ChatCompletionChunk]:
+        """
+        Splits a completion into the chunks a streamed request would return: the content a word at a time, and each tool call's arguments in a few pieces.
+        """
+
+        def _chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None) -> ChatCompletionChunk:
+            return ChatCompletionChunk.model_validate({
+                "id": completion.id, "object": "chat.completion.chunk", "created": completion.created, "model": completion.model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            })
+
+        message = completion.choices[0].message
+        chunks = [_chunk({"role": "assistant"})]
+
+        for piece in re.findall(r"\s*\S+\s*", message.content or ""):
+            chunks.append(_chunk({"content": piece}))
+
+        for index, tool_call in enumerate(message.tool_calls or []):
+            chunks.append(_chunk({"tool_calls": [{"index": index, "id": tool_call.id, "type": "function",
+                                                  "function": {"name": tool_call.function.name, "arguments": ""}}]}))
+            arguments = tool_call.function.arguments
+            for start in range(0, len(arguments), 16):
+                chunks.append(_chunk({"tool_calls": [{"index": index, "function": {"arguments": arguments[start:start + 16]}}]}))
+
+        chunks.append(_chunk({}, completion.choices[0].finish_reason))
+
+        if include_usage and completion.usage is not None:
+            chunks.append(ChatCompletionChunk.model_validate({
+                "id": completion.id, "object": "chat.completion.chunk", "created": completion.created, "model": completion.model,
+                "choices": [], "usage": completion.usage.model_dump(),
+            }))
+
+        return chunks
+
+    def embed(self, text: str) -> List[float]:
+        """
+        Gets the embedding of a text that wasn't recorded: the normalized sum of a pseudo-random vector for each of its words.
+        """
+
+        vector = np.zeros(self.embedding_dimensions, dtype=np.float32)
+
+        for word in re.findall(r"[a-z0-9]+", text.lower()):
+            word_vector = self._word_vectors.get(word)
+            if word_vector is None:
+                seed = int.from_bytes(hashlib.sha256(word.encode("utf-8")).digest()[:8], "little")
+                word_vector = self._word_vectors[word] = np.random.default_rng(seed).standard_normal(self.embedding_dimensions, dtype=np.float32)
+            vector += word_vector
+
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def _respond_embeddings(self, request: Dict[str, Any]) -> CreateEmbeddingResponse:
+        self.calls["embeddings"] += 1
+        recorded = self.recording.get("embeddings", request)
+        inputs = request["input"] if isinstance(request["input"], list) else [request["input"]]
+
+        if recorded is not None:
+            return CreateEmbeddingResponse.model_validate(recorded)
+
+        tokens = sum(estimate_tokens(text) for text in inputs)
+        return CreateEmbeddingResponse.model_validate({
+            "object": "list",
+            "model": request.get("model", "fake"),
+            "data": [{"object": "embedding", "index": i, "embedding": self.embed(text)} for i, text in enumerate(inputs)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _create(self, **kwargs) -> Any:
+        completion = self._respond("chat", kwargs)
+
+        if kwargs.get("stream"):
+            return self._stream(completion, (kwargs.get("stream_options") or {}).get("include_usage", False))
+
+        time.sleep(self.latency.first_token_delay() + self.latency.token_delay(completion.usage.completion_tokens))
+        return completion
+
+    def _stream(self, completion: ChatCompletion, include_usage: bool) -> Iterator[ChatCompletionChunk]:
+        chunks = self.create_chunks(completion, include_usage)
+        token_delay = self.latency.token_delay(completion.usage.completion_tokens) / max(len(chunks) - 1, 1)
+
+        time.sleep(self.latency.first_token_delay())
+        for i, chunk in enumerate(chunks):
+            if i > 0:
+                time.sleep(token_delay)
+            yield chunk
+
+    def _parse(self, **kwargs) -> ParsedChatCompletion:
+        completion = self._respond("parse", kwargs)
+        time.sleep(self.latency.first_token_delay() + self.latency.token_delay(completion.usage.completion_tokens))
+        return self._to_parsed(completion, kwargs["response_format"])
+
+    def _create_embeddings(self, **kwargs) -> CreateEmbeddingResponse:
+        response = self._respond_embeddings(kwargs)
+        time.sleep(self.latency.embedding_delay(len(response.data)))
+        return response
+
+
+class AsyncFakeOpenAI(FakeOpenAI):
+    """
+    A class representing a local stand-in for an `AsyncOpenAI` client, with the same recording, responder and latency as a `FakeOpenAI`.
+    Latency is injected with `asyncio.sleep`, so concurrent requests overlap as they would against a deployment.
+    """
+
+    async def _create(self, **kwargs) -> Any:
+        completion = self._respond("chat", kwargs)
+
+        if kwargs.get("stream"):
+            return self._astream(completion, (kwargs.get("stream_options") or {}).get("include_usage", False))
+
+        await asyncio.sleep(self.latency.first_token_delay() + self.latency.token_delay(completion.usage.completion_tokens))
+        return completion
+
+    async def _astream(self, completion: ChatCompletion, include_usage: bool) -> AsyncIterator[ChatCompletionChunk]:
+        chunks = self.create_chunks(completion, include_usage)
+        token_delay = self.latency.token_delay(completion.usage.completion_tokens) / max(len(chunks) - 1, 1)
+
+        await asyncio.sleep(self.latency.first_token_delay())
+        for i, chunk in enumerate(chunks):
+            if i > 0:
+                await asyncio.sleep(token_delay)
+            yield chunk
+
+    async def _parse(self, **kwargs) -> ParsedChatCompletion:
+        completion = self._respond("parse", kwargs)
+        await asyncio.sleep(self.latency.first_token_delay() + self.latency.token_delay(completion.usage.completion_tokens))
+        return self._to_parsed(completion, kwargs["response_format"])
+
+    async def _create_embeddings(self, **kwargs) -> CreateEmbeddingResponse:
+        response = self._respond_embeddings(kwargs)
+        await asyncio.sleep(self.latency.embedding_delay(len(response.data)))
+        return response
+
+
+def _assemble_completion(chunks: List[ChatCompletionChunk]) -> Dict[str, Any]:
+    # Streamed requests are recorded as the completion they add up to, so that they can be replayed streamed or not.
+    content, tool_calls, finish_reason, usage = [], {}, None, None
+
+    for chunk in chunks:
+        usage = chunk.usage.model_dump() if chunk.usage is not None else usage
+        for choice in chunk.choices:
+            finish_reason = choice.finish_reason or finish_reason
+            content.append(choice.delta.content or "")
+            for delta in choice.delta.tool_calls or []:
+                tool_call = tool_calls.setdefault(delta.index, {"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+                tool_call["id"] = delta.id or tool_call["id"]
+                if delta.function is not None:
+                    tool_call["function"]["name"] += delta.function.name or ""
+                    tool_call["function"]["arguments"] += delta.function.arguments or ""
+
+    message: Dict[str, Any] = {"role": "assistant", "content": "".join(content) or None}
+    if tool_calls:
+        message["tool_calls"] = [tool_calls[index] for index in sorted(tool_calls)]
+
+    first = chunks[0] if chunks else None
+    return {
+        "id": first.id if first else "chatcmpl-recorded", "object": "chat.completion", "created": first.created if first else 0,
+        "model": first.model if first else "", "usage": usage,
+        "choices": [{"index": 0, "finish_reason": finish_reason or "stop", "message": message}],
+    }
+
+
+class RecordingOpenAI:
+    """
+    A class representing an `OpenAI` client that records every chat completion, structured output and embedding response in a `LLMRecording`,
+    so that a run against a deployment can be replayed with a `FakeOpenAI`.
+    """
+
+    def __init__(self, client: Any, recording: LLMRecording):
+        self.client = client
+        self.recording = recording
+
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self._parse)))
+        self.embeddings = SimpleNamespace(create=self._create_embeddings)
+
+    def _create(self, **kwargs) -> Any:
+        response = self.client.chat.completions.create(**kwargs)
+
+        if kwargs.get("stream"):
+            return self._record_stream(response, kwargs)
+
+        self.recording.add("chat", kwargs, response.model_dump(mode="json"))
+        return response
+
+    def _record_stream(self, chunks: Iterator[ChatCompletionChunk], request: Dict[str, Any]) -> Iterator[ChatCompletionChunk]:
+        received = []
+        for chunk in chunks:
+            received.append(chunk)
+            yield chunk
+
+        self.recording.add("chat", request, _assemble_completion(received))
+
+    def _parse(self, **kwargs) -> Any:
+        response = self.client.beta.chat.completions.parse(**kwargs)
+        self.recording.add("parse", kwargs, response.model_dump(mode="json", exclude={"choices": {"__all__": {"message": {"parsed"}}}}))
+        return response
+
+    def _create_embeddings(self, **kwargs) -> Any:
+        response = self.client.embeddings.create(**kwargs)
+        self.recording.add("embeddings", kwargs, response.model_dump(mode="json"))
+        return response
+
+
+class AsyncRecordingOpenAI(RecordingOpenAI):
+    """
+    A class representing an `AsyncOpenAI` client that records its responses in a `LLMRecording`, like a `RecordingOpenAI`.
+    """
+
+    async def _create(self, **kwargs) -> Any:
+        response = await self.client.chat.completions.create(**kwargs)
+
+        if kwargs.get("stream"):
+            return self._arecord_stream(response, kwargs)
+
+        self.recording.add("chat", kwargs, response.model_dump(mode="json"))
+        return response
+
+    async def _arecord_stream(self, chunks: AsyncIterator[ChatCompletionChunk], request: Dict[str, Any]) -> AsyncIterator[ChatCompletionChunk]:
+        received = []
+        async for chunk in chunks:
+            received.append(chunk)
+            yield chunk
+
+        self.recording.add("chat", request, _assemble_completion(received))
+
+    async def _parse(self, **kwargs) -> Any:
+        response = await self.client.beta.chat.completions.parse(**kwargs)
+        self.recording.add("parse", kwargs, response.model_dump(mode="json", exclude={"choices": {"__all__": {"message": {"parsed"}}}}))
+        return response
+
+    async def _create_embeddings(self, **kwargs) -> Any:
+        response = await self.client.embeddings.create(**kwargs)
+        self.recording.add("embeddings", kwargs, response.model_dump(mode="json"))
+        return response
@@ -0,0 +1,256 @@
+from typing import Iterable, List, Optional, Tuple
+from pydantic import BaseModel, Field
+import re
+from helpers.text_helpers import normalize_token
+
+_FRACTIONS = {"½": 0.5, "⅓": 1 / 3, "⅔": 2 / 3, "¼": 0.25, "¾": 0.75, "⅛": 0.125}
+
+# Each unit maps to its canonical name, and the dimension and factor used to compare quantities in base units (grams, millilitres or items).
+_UNITS = {
+    "g": ("g", "mass", 1.0), "gram": ("g", "mass", 1.0), "kg": ("kg", "mass", 1000.0), "kilogram": ("kg", "mass", 1000.0),
+    "lb": ("lb", "mass", 453.6), "pound": ("lb", "mass", 453.6), "oz": ("oz", "mass", 28.35), "ounce": ("oz", "mass", 28.35),
+    "ml": ("ml", "volume", 1.0), "millilitre": ("ml", "volume", 1.0), "milliliter": ("ml", "volume", 1.0),
+    "l": ("l", "volume", 1000.0), "litre": ("l", "volume", 1000.0), "liter": ("l", "volume", 1000.0),
+    "cup": ("cup", "volume", 240.0), "tbsp": ("tbsp", "volume", 15.0), "tablespoon": ("tbsp", "volume", 15.0),
+    "tsp": ("tsp", "volume", 5.0), "teaspoon": ("tsp", "volume", 5.0),
+    "can": ("can", "can", 1.0), "tin": ("can", "can", 1.0), "clove": ("clove", "clove", 1.0), "slice": ("slice", "slice", 1.0),
+    "head": ("head", "item", 1.0), "pinch": ("pinch", "pinch", 1.0), "bunch": ("bunch", "bunch", 1.0), "handful": ("handful", "handful", 1.0),
+}
+
+# Words that describe how an ingredient is prepared or sold rather than what it is.
+_DESCRIPTORS = frozenset("""
+a an of the and to for some
+fresh large small medium finely thinly roughly chopped diced sliced minced grated shredded crumbled melted softened mashed beaten
+cut into julienned soaked drained overnight overripe raw cooked chilled ground dried organic unsalted seeded baby plain boneless skinless
+""".split())
+
+# Different names for the same ingredient, mapped to a single canonical name.
+_SYNONYMS = {
+    "all-purpose flour": "flour",
+    "all purpose flour": "flour",
+    "plain flour": "flour",
+    "bicarbonate soda": "baking soda",
+    "cornflour": "cornstarch",
+    "caster sugar": "granulated sugar",
+    "light brown sugar": "brown sugar",
+    "canadian bacon": "bacon",
+}
+
+# Words that start a clause describing how to prepare an ingredient, e.g. "finely chopped" or "cut into florets".
+_PREPARATIONS = frozenset("""
+chopped diced sliced minced grated shredded crumbled melted softened mashed beaten julienned soaked drained chilled
+cut split peeled crushed halved quartered trimmed rinsed divided cubed torn toasted warmed
+finely thinly roughly coarsely freshly lightly
+optional
+""".split())
+
+_QUANTITY_PATTERN = re.compile(
+    r"^(?P<quantity>(?:\d+(?:\.\d+)?\s*)?[½⅓⅔¼¾⅛]|\d+/\d+|\d+(?:\.\d+)?(?:\s*-\s*\d+(?:\.\d+)?)?)\s*(?P<rest>.*)$")
+_PARENTHESES_PATTERN = re.compile(r"\(([^)]*)\)")
+
+
+class ParsedIngredient(BaseModel):
+    text: str = Field(description="The ingredient as written in the recipe.")
+    quantity: Optional[float] = Field(
+        default=None, description="The quantity, if one is given.")
+    unit: Optional[str] = Field(
+        default=None, description="The canonical unit of the quantity, or None for a count of items.")
+    name: str = Field(description="The canonical name of the ingredient, used to match it with other ingredients.")
+    optional: bool = Field(
+        default=False, description="Whether the recipe marks the ingredient as optional or for garnish.")
+
+    @property
+    def dimension(self) -> str:
+        return _UNITS[self.unit][1] if self.unit else "item"
+
+    @property
+    def base_quantity(self) -> Optional[float]:
+        """
+        Gets the quantity in the base unit of its dimension, e.g. grams for a quantity in kilograms, so that it can be compared with other quantities.
+        """
+
+        if self.quantity is None:
+            return None
+
+        return self.quantity * (_UNITS[self.unit][2] if self.unit else 1.0)
+
+    def matches(self, other: "ParsedIngredient") -> bool:
+        """
+        Checks whether two ingredients are the same ingredient, e.g. "brown sugar" and "light brown sugar", but not "brown sugar" and "granulated sugar".
+        """
+
+        if self.name == other.name:
+            return True
+
+        words, other_words = self.name.split(), other.name.split()
+        if not words or not other_words or words[-1] != other_words[-1]:
+            return False
+
+        return set(words) <= set(other_words) or set(other_words) <= set(words)
+
+
+def _parse_quantity(text: str) -> float:
+    text = text.strip()
+
+    if "-" in text:
+        # A range, e.g. "2-3", uses its upper bound.
+        text = text.split("-")[-1].strip()
+
+    if "/" in text:
+        numerator, denominator = text.split("/")
+        return float(numerator) / float(denominator)
+
+    quantity = 0.0
+    for fraction, value in _FRACTIONS.items():
+        if fraction in text:
+            quantity += value
+            text = text.replace(fraction, "")
+
+    return quantity + (float(text) if text.strip() else 0.0)
+
+
+def _canonical_name(text: str) -> str:
+    words = [normalize_token(word) for word in re.findall(r"[a-z]+(?:-[a-z]+)*", text.lower())]
+    name = " ".join(word for word in words if word not in _DESCRIPTORS)
+
+    return _SYNONYMS.get(name, name)
+
+
+def _is_preparation(clause: str) -> bool:
+    words = clause.lower().split()
+    return not words or words[0] in _PREPARATIONS
+
+
+def parse_ingredient(text: str) -> Optional[ParsedIngredient]:
+    """
+    Parses an ingredient, e.g. "2 cans (400g each) diced tomatoes", into its quantity ("2"), unit ("can") and canonical name ("tomato").
+
+    Args:
+        text: The ingredient as written in a recipe or kitchen inventory.
+
+    Returns:
+        Optional[ParsedIngredient]: The parsed ingredient, or None if the text is not an ingredient, e.g. a section heading such as "For the crust:".
+    """
+
+    stripped = text.strip()
+    if not stripped or stripped.endswith(":"):
+        return None
+
+    notes = " ".join(_PARENTHESES_PATTERN.findall(stripped)).lower()
+    rest = _PARENTHESES_PATTERN.sub(" ", stripped)
+
+    # Trailing clauses that start with a preparation describe how to prepare the ingredient, e.g. "1 large onion, finely chopped",
+    # while other clauses are part of its name, e.g. "1 lb boneless, skinless chicken thighs, cut into bite-sized pieces".
+    clauses = rest.split(",")
+    preparation = []
+    while len(clauses) > 1 and _is_preparation(clauses[-1]):
+        preparation.insert(0, clauses.pop())
+
+    rest = " ".join(clauses)
+    optional = "optional" in notes or "garnish" in notes or any("optional" in clause.lower() for clause in preparation)
+
+    quantity = None
+    unit = None
+
+    match = _QUANTITY_PATTERN.match(rest.strip())
+    if match:
+        quantity = _parse_quantity(match.group("quantity"))
+        rest = match.group("rest")
+    elif re.match(r"^(a|an)\s", rest.strip(), re.IGNORECASE):
+        quantity = 1.0
+        rest = re.sub(r"^(a|an)\s+", "", rest.strip(), flags=re.IGNORECASE)
+
+    words = rest.split()
+    if words:
+        candidate = normalize_token(words[0].lower().rstrip("."))
+        if candidate in _UNITS:
+            unit = _UNITS[candidate][0]
+            words = words[1:]
+            if words and words[0].lower() == "of":
+                words = words[1:]
+            if quantity is None:
+                quantity = 1.0
+
+    # A unit can also follow the name, e.g. "A broccoli head".
+    if unit is None and len(words) > 1 and normalize_token(words[-1].lower()) in _UNITS:
+        unit = _UNITS[normalize_token(words[-1].lower())][0]
+        words = words[:-1]
+
+    if "to taste" in rest.lower():
+        optional = True
+        words = rest.lower().replace("to taste", "").split()
+
+    name = _canonical_name(" ".join(words))
+    if not name:
+        return None
+
+    return ParsedIngredient(text=text, quantity=quantity, unit=unit, name=name, optional=optional)
+
+
+def parse_ingredients(texts: Iterable[str]) -> List[ParsedIngredient]:
+    return [ingredient for ingredient in map(parse_ingredient, texts) if ingredient is not None]
+
+
+def format_quantity(quantity: Optional[float], unit: Optional[str]) -> str:
+    if quantity is None:
+        return ""
+
+    amount = f"{quantity:.2f}".rstrip("0").rstrip(".")
+
+    if unit is None:
+        return amount
+    if unit in ("g", "kg", "ml", "l", "lb", "oz"):
+        return f"{amount}{unit}"
+
+    return f"{amount} {unit}{'s' if quantity > 1 and unit not in ('tbsp', 'tsp') else ''}"
+
+
+def compare_ingredients(required: Iterable[ParsedIngredient], available: Iterable[ParsedIngredient]) -> Tuple[List[Tuple[ParsedIngredient, Optional[float]]], List[ParsedIngredient]]:
+    """
+    Compares the ingredients required by a recipe with the available ingredients.
+
+    An ingredient is missing when no available ingredient matches it, or when the matching ingredients have a smaller quantity in the same dimension (e.g. both are masses).
+    The quantity each ingredient uses is taken from the available ingredients, so that an ingredient the recipe lists twice, e.g. for a marinade and for a sauce,
+    isn't counted as available twice from the same stock.
+    Quantities in different dimensions, e.g. cups of flour and grams of flour, can't be compared, so the ingredient is assumed to be available.
+
+    Args:
+        required: The ingredients required by the recipe.
+        available: The ingredients that are available.
+
+    Returns:
+        Tuple: The missing ingredients, each with the quantity still needed in the recipe's unit (None for the full amount), and the ingredients that are available.
+    """
+
+    available = list(available)
+    # The quantity of each available ingredient that is left, in base units.
+    stock = [candidate.base_quantity for candidate in available]
+    missing = []
+    found = []
+
+    for ingredient in required:
+        matches = [i for i, candidate in enumerate(available) if ingredient.matches(candidate)]
+
+        if not matches:
+            missing.append((ingredient, None))
+            continue
+
+        same_dimension = [i for i in matches if available[i].dimension == ingredient.dimension and stock[i] is not None]
+
+        if ingredient.base_quantity is None or not same_dimension:
+            found.append(ingredient)
+            continue
+
+        shortfall = ingredient.base_quantity
+        for i in same_dimension:
+            used = min(stock[i], shortfall)
+            stock[i] -= used
+            shortfall -= used
+
+        if shortfall > 1e-9:
+            factor = _UNITS[ingredient.unit][2] if ingredient.unit else 1.0
+            missing.append((ingredient, shortfall / factor))
+        else:
+            found.append(ingredient)
+
+    return missing, found
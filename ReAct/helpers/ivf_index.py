@@ -0,0 +1,287 @@
+from typing import List, Optional, Tuple
+import math
+import os
+import zlib
+import numpy as np
+from helpers.recipe_index import QUANTIZATIONS, quantize_vectors, score_quantized
+from helpers.storage_helpers import atomic_write
+
+
+class IVFIndex:
+    """
+    A class representing an inverted file (IVF) index over normalized embeddings, for approximate nearest-neighbour search in large catalogs.
+
+    Rows are clustered around `lists` centroids with spherical k-means, and each row is kept, quantized, in the list of its most similar centroid.
+    A query only scores the rows of the `nprobe` lists whose centroids are most similar to it, i.e. O(lists·d + nprobe·N/lists·d) instead of O(N·d),
+    so raising `nprobe` trades latency for recall. By default there are about 4·√N lists.
+
+    New rows are appended to the list of their most similar centroid. Once the index has grown `retrain_factor` times since its centroids were trained,
+    the centroids are trained again, so that a catalog that starts small still ends up with enough lists.
+
+    It is meant to be the `ann_index` of a `RecipeIndex`, which rescores the best rows it selects exactly, and can be saved next to a `RecipeStore`
+    and loaded again, so that it is only trained once.
+    """
+
+    # k-means is trained on a sample of this many rows per list, which is plenty to place the centroids.
+    TRAINING_ROWS_PER_LIST = 64
+    # Rows are assigned to lists in blocks, so that the similarity of a block with every centroid fits in memory.
+    ASSIGN_BLOCK_ROWS = 8192
+
+    def __init__(self, lists: Optional[int] = None, nprobe: int = 16, quantization: str = "int8", iterations: int = 10, retrain_factor: float = 4.0, seed: int = 0):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(
+                f"Unknown quantization {quantization}, expected one of {', '.join(QUANTIZATIONS)}.")
+
+        self.lists = lists
+        self.nprobe = max(1, nprobe)
+        self.quantization = quantization
+        self.iterations = iterations
+        self.retrain_factor = retrain_factor
+        self.seed = seed
+        self.reset()
+
+    def reset(self) -> None:
+        self.centroids: Optional[np.ndarray] = None
+        self._trained_rows = 0
+        self._size = 0
+        self._list_rows: List[np.ndarray] = []
+        self._list_codes: List[np.ndarray] = []
+        self._list_scales: List[Optional[np.ndarray]] = []
+        self._list_sizes: List[int] = []
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _list_count(self, count: int) -> int:
+        if self.lists is not None:
+            return max(1, min(self.lists, count))
+
+        # Fewer than about 40 rows per list makes the centroids too noisy to be worth probing.
+        return max(1, min(int(4 * math.sqrt(count)), count // 40))
+
+    def update(self, matrix: np.ndarray) -> None:
+        """
+        Indexes the rows of the matrix the index doesn't have yet, training the centroids first if needed.
+
+        Args:
+            matrix: The (count, dimensions) matrix of normalized embeddings, whose first `len(self)` rows are already indexed.
+        """
+
+        count = matrix.shape[0]
+        if count <= self._size:
+            return
+
+        if self.centroids is None or count >= self.retrain_factor * self._trained_rows:
+            self.train(matrix)
+        else:
+            self._assign(matrix, self._size, count)
+
+    def train(self, matrix: np.ndarray) -> None:
+        """
+        Trains the centroids with spherical k-means on a sample of the rows, and indexes every row.
+
+        Args:
+            matrix: The (count, dimensions) matrix of normalized embeddings.
+        """
+
+        count = matrix.shape[0]
+        self.reset()
+
+        if count == 0:
+            return
+
+        lists = self._list_count(count)
+        rng = np.random.default_rng(self.seed)
+
+        sample_rows = np.sort(rng.choice(count, size=min(count, lists * self.TRAINING_ROWS_PER_LIST), replace=False))
+        sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+        centroids = sample[rng.choice(sample.shape[0], size=lists, replace=False)].copy()
+
+        for _ in range(self.iterations):
+            assignments = self._nearest(sample, centroids)
+            order = np.argsort(assignments, kind="stable")
+            counts = np.bincount(assignments, minlength=lists)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+            sums = np.zeros_like(centroids)
+            filled = counts > 0
+            sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+
+            # Empty lists are moved to random rows, rather than kept where no row is.
+            empty = np.flatnonzero(~filled)
+            sums[empty] = sample[rng.choice(sample.shape[0], size=empty.shape[0], replace=False)]
+
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        self.centroids = centroids
+        self._trained_rows = count
+        self._list_rows = [np.empty(0, dtype=np.int64) for _ in range(lists)]
+        self._list_codes = [quantize_vectors(np.empty((0, centroids.shape[1]), dtype=np.float32), self.quantization)[0] for _ in range(lists)]
+        self._list_scales = [np.empty(0, dtype=np.float32) if self.quantization == "int8" else None for _ in range(lists)]
+        self._list_sizes = [0] * lists
+
+        self._assign(matrix, 0, count)
+
+    def _nearest(self, vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        nearest = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], self.ASSIGN_BLOCK_ROWS):
+            stop = min(start + self.ASSIGN_BLOCK_ROWS, vectors.shape[0])
+            nearest[start:stop] = np.argmax(vectors[start:stop] @ centroids.T, axis=1)
+        return nearest
+
+    def _assign(self, matrix: np.ndarray, start: int, stop: int) -> None:
+        for block_start in range(start, stop, self.ASSIGN_BLOCK_ROWS):
+            block_stop = min(block_start + self.ASSIGN_BLOCK_ROWS, stop)
+            block = np.asarray(matrix[block_start:block_stop], dtype=np.float32)
+
+            assignments = self._nearest(block, self.centroids)
+            codes, scales = quantize_vectors(block, self.quantization)
+            order = np.argsort(assignments, kind="stable")
+            lists, first = np.unique(assignments[order], return_index=True)
+
+            for list_id, begin, end in zip(lists, first, np.append(first[1:], order.shape[0])):
+                positions = order[begin:end]
+                self._append(int(list_id), positions + block_start, codes[positions],
+                             scales[positions] if scales is not None else None)
+
+        self._size = stop
+
+    def _append(self, list_id: int, rows: np.ndarray, codes: np.ndarray, scales: Optional[np.ndarray]) -> None:
+        size = self._list_sizes[list_id]
+        needed = size + rows.shape[0]
+
+        if needed > self._list_rows[list_id].shape[0]:
+            # Lists grow geometrically, so that appending rows one at a time is amortized O(d).
+            capacity = max(needed, 2 * self._list_rows[list_id].shape[0], 16)
+            self._list_rows[list_id] = self._grow(self._list_rows[list_id], size, capacity)
+            self._list_codes[list_id] = self._grow(self._list_codes[list_id], size, capacity)
+            if scales is not None:
+                self._list_scales[list_id] = self._grow(self._list_scales[list_id], size, capacity)
+
+        self._list_rows[list_id][size:needed] = rows
+        self._list_codes[list_id][size:needed] = codes
+        if scales is not None:
+            self._list_scales[list_id][size:needed] = scales
+        self._list_sizes[list_id] = needed
+
+    @staticmethod
+    def _grow(array: np.ndarray, size: int, capacity: int) -> np.ndarray:
+        grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+        grown[:size] = array[:size]
+        return grown
+
+    def probe(self, query: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Scores the rows of the `nprobe` lists most similar to the query.
+
+        Args:
+            query: The normalized float32 query.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: The probed rows, their approximate scores and the largest error of each score.
+        """
+
+        if self.centroids is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+
+        centroid_scores = self.centroids @ query
+        nprobe = min(self.nprobe, centroid_scores.shape[0])
+        probed = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+
+        rows, scores, errors = [], [], []
+        for list_id in probed:
+            size = self._list_sizes[list_id]
+            if size == 0:
+                continue
+
+            scales = self._list_scales[list_id]
+            list_scores, list_errors = score_quantized(
+                self._list_codes[list_id][:size], scales[:size] if scales is not None else None, query)
+            rows.append(self._list_rows[list_id][:size])
+            scores.append(list_scores)
+            errors.append(list_errors)
+
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+
+        return np.concatenate(rows), np.concatenate(scores), np.concatenate(errors)
+
+    @staticmethod
+    def _fingerprint(matrix: np.ndarray, count: int) -> int:
+        # A checksum of a sample of the rows, so that an index saved for other embeddings, e.g. of a store that has since been rebuilt, isn't loaded.
+        rows = np.unique(np.linspace(0, count - 1, num=min(count, 64)).astype(np.int64))
+        return zlib.crc32(np.ascontiguousarray(matrix[rows], dtype=np.float32).tobytes())
+
+    def save(self, path: str, matrix: np.ndarray) -> None:
+        """
+        Saves the centroids and lists, e.g. next to the `RecipeStore` holding the embeddings they index.
+
+        Args:
+            path: The path of the `.npz` file to write.
+            matrix: The (count, dimensions) matrix of normalized embeddings the index is for.
+        """
+
+        if self.centroids is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+
+        lists = range(len(self._list_sizes))
+
+        with atomic_write(path, "wb") as f:
+            np.savez(
+                f,
+                quantization=np.array(self.quantization),
+                centroids=self.centroids,
+                trained_rows=np.array(self._trained_rows),
+                count=np.array(self._size),
+                fingerprint=np.array(self._fingerprint(matrix, self._size)),
+                sizes=np.asarray(self._list_sizes, dtype=np.int64),
+                rows=np.concatenate([self._list_rows[i][:self._list_sizes[i]] for i in lists]),
+                codes=np.concatenate([self._list_codes[i][:self._list_sizes[i]] for i in lists]),
+                scales=np.concatenate([self._list_scales[i][:self._list_sizes[i]] for i in lists])
+                if self.quantization == "int8" else np.empty(0, dtype=np.float32),
+            )
+
+    def load(self, path: str, matrix: np.ndarray) -> bool:
+        """
+        Loads the centroids and lists saved by `save`, if they were saved for the given embeddings.
+        Rows added to the matrix since are indexed by the next `update`.
+
+        Args:
+            path: The path of the `.npz` file to read.
+            matrix: The (count, dimensions) matrix of normalized embeddings the index is for.
+
+        Returns:
+            bool: Whether the index was loaded; if not, it is left empty.
+        """
+
+        self.reset()
+
+        if not os.path.exists(path):
+            return False
+
+        with np.load(path) as data:
+            count = int(data["count"])
+            centroids = data["centroids"]
+
+            if (str(data["quantization"]) != self.quantization or count > matrix.shape[0] or count == 0
+                    or centroids.shape[1] != matrix.shape[1] or int(data["fingerprint"]) != self._fingerprint(matrix, count)):
+                return False
+
+            trained_rows = int(data["trained_rows"])
+            sizes = data["sizes"].tolist()
+            rows, codes, scales = data["rows"], data["codes"], data["scales"]
+
+        offsets = np.concatenate(([0], np.cumsum(sizes))).tolist()
+
+        self.centroids = centroids
+        self._trained_rows = trained_rows
+        self._size = count
+        self._list_sizes = sizes
+        self._list_rows = [rows[offsets[i]:offsets[i + 1]] for i in range(len(sizes))]
+        self._list_codes = [codes[offsets[i]:offsets[i + 1]] for i in range(len(sizes))]
+        self._list_scales = [scales[offsets[i]:offsets[i + 1]] if self.quantization == "int8" else None for i in range(len(sizes))]
+        return True
@@ -0,0 +1,303 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import math
+import numpy as np
+from helpers.text_helpers import tokenize, tokenize_all
+
+
+class _IntColumns:
+    """
+    A class representing parallel int32 columns that grow geometrically as items are appended, e.g. the rows a word appears in and its frequency in each of them.
+    """
+
+    __slots__ = ("_data", "_size")
+
+    def __init__(self, columns: int, data: Optional[np.ndarray] = None):
+        self._data = data if data is not None else np.empty((columns, 4), dtype=np.int32)
+        self._size = 0 if data is None else data.shape[1]
+
+    @classmethod
+    def from_lists(cls, *columns: List[int]) -> "_IntColumns":
+        return cls(len(columns), np.array(columns, dtype=np.int32).reshape(len(columns), -1))
+
+    def __len__(self) -> int:
+        return self._size
+
+    def append(self, *values: int) -> None:
+        if self._size == self._data.shape[1]:
+            grown = np.empty((self._data.shape[0], max(4, 2 * self._size)), dtype=np.int32)
+            grown[:, :self._size] = self._data[:, :self._size]
+            self._data = grown
+
+        self._data[:, self._size] = values
+        self._size += 1
+
+    @property
+    def columns(self) -> np.ndarray:
+        return self._data[:, :self._size]
+
+
+class LexicalIndex:
+    """
+    A class representing an in-memory lexical index over recipes, complementing the vector `RecipeIndex`.
+
+    It holds two inverted indexes, both keyed on normalized words (see `text_helpers.tokenize`):
+
+    - An ingredient index, which scores recipes by the fraction of their ingredients that match any of the ingredients the user has.
+    - A BM25 index over the name, ingredients and steps of each recipe, which scores recipes by how well they match the words of a query.
+
+    Postings are held as arrays in row order, so that scoring is vectorized. Both indexes can score a subset of the rows, e.g. the candidates of a vector search,
+    at a cost that depends on the number of rows scored and not on the number of recipes.
+
+    Row `i` of the index always corresponds to the recipe at position `i` in the owning agent's recipe list.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._reset()
+
+    def _reset(self) -> None:
+        # The postings of a word are the rows it appears in, with the position of the ingredient it appears in, or its frequency.
+        self._ingredient_postings: Dict[str, _IntColumns] = {}
+        self._term_postings: Dict[str, _IntColumns] = {}
+        # The length and number of ingredients of each recipe.
+        self._recipe_stats = _IntColumns(2)
+        self._total_length = 0
+        self._max_ingredients = 0
+        # The BM25 score each posting adds, by word, computed on first use. It depends on the number of recipes and their average length, so adding a recipe clears it.
+        self._impacts: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self._recipe_stats)
+
+    def ingredient_fraction(self, tokens: Sequence[str]) -> float:
+        """
+        Gets the fraction of the words that are known ingredients, e.g. to tell whether a query is mostly a list of ingredients.
+        """
+
+        if not tokens:
+            return 0.0
+
+        return sum(token in self._ingredient_postings for token in tokens) / len(tokens)
+
+    @staticmethod
+    def _analyze(name: str, ingredients: Sequence[str], steps: Sequence[str]) -> Tuple[List[Tuple[str, int]], Counter]:
+        # Ingredient postings hold the (row, ingredient) pairs a word appears in, so that each ingredient is only counted once however many of its words match.
+        pairs = sorted({(token, position) for position, ingredient in enumerate(ingredients) for token in tokenize(ingredient)})
+        terms = Counter(tokenize(name) + tokenize_all(ingredients) + tokenize_all(steps))
+        return pairs, terms
+
+    def build(self, recipes: Iterable[object]) -> None:
+        """
+        Replaces the contents of the index with the given recipes.
+
+        Args:
+            recipes: The recipes to index, in recipe order. Each must have `name`, `ingredients` and `steps`.
+        """
+
+        self._reset()
+
+        # Postings are collected in lists and converted to arrays once, rather than appended to arrays one row at a time.
+        ingredient_postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        term_postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        lengths, ingredient_counts = [], []
+
+        for row, recipe in enumerate(recipes):
+            pairs, terms = self._analyze(recipe.name, recipe.ingredients, recipe.steps)
+
+            for token, position in pairs:
+                rows, positions = ingredient_postings.setdefault(token, ([], []))
+                rows.append(row)
+                positions.append(position)
+
+            for term, frequency in terms.items():
+                rows, frequencies = term_postings.setdefault(term, ([], []))
+                rows.append(row)
+                frequencies.append(frequency)
+
+            lengths.append(sum(terms.values()))
+            ingredient_counts.append(len(recipe.ingredients))
+
+        self._ingredient_postings = {token: _IntColumns.from_lists(*lists) for token, lists in ingredient_postings.items()}
+        self._term_postings = {term: _IntColumns.from_lists(*lists) for term, lists in term_postings.items()}
+        self._recipe_stats = _IntColumns.from_lists(lengths, ingredient_counts)
+        self._total_length = sum(lengths)
+        self._max_ingredients = max(ingredient_counts, default=0)
+
+    def add(self, name: str, ingredients: Sequence[str], steps: Sequence[str]) -> int:
+        """
+        Appends a single recipe to the index.
+
+        Returns:
+            int: The row of the newly added recipe.
+        """
+
+        row = len(self)
+        pairs, terms = self._analyze(name, ingredients, steps)
+
+        for token, position in pairs:
+            self._ingredient_postings.setdefault(token, _IntColumns(2)).append(row, position)
+
+        for term, frequency in terms.items():
+            self._term_postings.setdefault(term, _IntColumns(2)).append(row, frequency)
+
+        length = sum(terms.values())
+        self._recipe_stats.append(length, len(ingredients))
+        self._total_length += length
+        self._max_ingredients = max(self._max_ingredients, len(ingredients))
+        self._impacts.clear()
+
+        return row
+
+    def ingredient_coverage(self, available_tokens: Iterable[str], rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Scores recipes by the fraction of their ingredients that are available.
+
+        Args:
+            available_tokens: The normalized words of the available ingredients.
+            rows: The rows to score, or None to score every row.
+
+        Returns:
+            np.ndarray: A score between 0 and 1 for each of the rows, in the same order.
+        """
+
+        postings = [self._ingredient_postings[token] for token in set(available_tokens) if self._ingredient_postings.get(token)]
+        ingredient_counts = self._recipe_stats.columns[1]
+
+        # Many rows are scored faster from a bitmask of the matched ingredients of every recipe, than by searching for each row in the postings.
+        if self._max_ingredients <= 64 and (rows is None or rows.shape[0] * 16 > len(self)):
+            matched_ingredients = np.zeros(len(self), dtype=np.uint64)
+
+            for item in postings:
+                posting_rows, positions = item.columns
+                np.bitwise_or.at(matched_ingredients, posting_rows, np.left_shift(np.uint64(1), positions.astype(np.uint64)))
+
+            coverage = (np.bitwise_count(matched_ingredients) / np.maximum(ingredient_counts, 1)).astype(np.float32)
+            return coverage if rows is None else coverage[rows]
+
+        count = len(self) if rows is None else rows.shape[0]
+        width = self._max_ingredients + 1
+        matched = []
+
+        # Rows are searched for with the dtype of the postings, so that the postings aren't converted.
+        search_rows = rows.astype(np.int32) if rows is not None else None
+
+        for item in postings:
+            posting_rows, positions = item.columns
+
+            if rows is None:
+                matched.append(posting_rows.astype(np.int64) * width + positions)
+                continue
+
+            # The postings of each row are a contiguous run, as postings are kept in row order.
+            starts = np.searchsorted(posting_rows, search_rows, side="left")
+            lengths = np.searchsorted(posting_rows, search_rows, side="right") - starts
+            total = int(lengths.sum())
+            if total == 0:
+                continue
+
+            indexes = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+            matched.append(np.repeat(np.arange(count), lengths) * width + positions[indexes])
+
+        if not matched:
+            return np.zeros(count, dtype=np.float32)
+
+        ingredient_counts = ingredient_counts if rows is None else ingredient_counts[rows]
+
+        # Each (row, ingredient) pair is counted once, however many of the ingredient's words are available.
+        matches = np.bincount(np.unique(np.concatenate(matched)) // width, minlength=count)
+        return (matches / np.maximum(ingredient_counts, 1)).astype(np.float32)
+
+    def _idf(self, document_frequency: int) -> float:
+        count = len(self)
+        return math.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def bm25_reference(self, query_tokens: Iterable[str]) -> float:
+        """
+        Gets the BM25 score of a recipe of average length that holds each of the query words once, so that BM25 scores can be put on the same scale across queries,
+        rather than relative to the best match of each query. Words that no recipe holds count as much as the rarest words.
+
+        Args:
+            query_tokens: The normalized words of the query.
+
+        Returns:
+            float: The reference score, or 0 for an empty query or index.
+        """
+
+        if len(self) == 0:
+            return 0.0
+
+        return sum(self._idf(len(self._term_postings.get(token, ()))) for token in set(query_tokens))
+
+    def bm25(self, query_tokens: Iterable[str], rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Scores recipes against the query words with BM25. Only the postings of the query words are visited.
+
+        Args:
+            query_tokens: The normalized words of the query.
+            rows: The rows to score, or None to score every row.
+
+        Returns:
+            np.ndarray: A non-negative score for each of the rows, in the same order, 0 for rows that match none of the words.
+        """
+
+        scores = np.zeros(len(self) if rows is None else rows.shape[0], dtype=np.float32)
+        search_rows = rows.astype(np.int32) if rows is not None else None
+
+        for token in set(query_tokens):
+            postings = self._term_postings.get(token)
+            if not postings:
+                continue
+
+            posting_rows = postings.columns[0]
+            impacts = self._get_impacts(token, postings)
+
+            if rows is None:
+                scores[posting_rows] += impacts
+                continue
+
+            indexes = np.minimum(np.searchsorted(posting_rows, search_rows), posting_rows.shape[0] - 1)
+            found = posting_rows[indexes] == search_rows
+            scores[found] += impacts[indexes[found]]
+
+        return scores
+
+    def count_terms(self, query_tokens: Iterable[str], rows: np.ndarray) -> np.ndarray:
+        """
+        Counts how many of the distinct query words each of the rows holds, e.g. to tell a recipe that matches a whole query from one that shares a single word with it.
+
+        Args:
+            query_tokens: The normalized words of the query.
+            rows: The rows to count the words of.
+
+        Returns:
+            np.ndarray: The number of query words each of the rows holds, in the same order.
+        """
+
+        counts = np.zeros(rows.shape[0], dtype=np.int32)
+        search_rows = rows.astype(np.int32)
+
+        for token in set(query_tokens):
+            postings = self._term_postings.get(token)
+            if not postings:
+                continue
+
+            posting_rows = postings.columns[0]
+            indexes = np.minimum(np.searchsorted(posting_rows, search_rows), posting_rows.shape[0] - 1)
+            counts += posting_rows[indexes] == search_rows
+
+        return counts
+
+    def _get_impacts(self, token: str, postings: _IntColumns) -> np.ndarray:
+        impacts = self._impacts.get(token)
+
+        if impacts is None:
+            posting_rows, frequencies = postings.columns
+            frequencies = frequencies.astype(np.float32)
+            length_norm = 1 - self.b + self.b * self._recipe_stats.columns[0][posting_rows] / (self._total_length / len(self) or 1.0)
+            impacts = (self._idf(posting_rows.shape[0]) * (self.k1 + 1) * frequencies / (frequencies + self.k1 * length_norm)).astype(np.float32)
+            self._impacts[token] = impacts
+
+        return impacts
+
@@ -0,0 +1,124 @@
+from typing import Any, List, Optional, Set
+import hashlib
+import json
+import re
+import numpy as np
+from helpers.skill_cache import SkillCache
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """
+    Creates the 64-bit SimHash of a text over its word shingles, so that texts that only differ in a few words have hashes that only differ in a few bits.
+
+    Args:
+        text: The text to hash.
+        shingle_size: The number of consecutive words in each shingle.
+
+    Returns:
+        int: The hash.
+    """
+
+    words = _WORD_PATTERN.findall(text.lower())
+    if not words:
+        return 0
+
+    shingles = [" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))]
+    digests = b"".join(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest() for shingle in shingles)
+
+    # Each shingle votes for every bit of the hash, and each bit is set where most shingles set it.
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+    votes = 2 * bits.sum(axis=0, dtype=np.int64) - len(shingles)
+    return int.from_bytes(np.packbits(votes > 0).tobytes(), "big")
+
+
+class LoopDetector:
+    """
+    A class representing a deterministic detector of loops in the execution of a ReAct run, so that stalls are detected without asking the validator.
+
+    Each iteration is observed once the agent has responded:
+
+    - Every tool call is fingerprinted from its name, canonicalized arguments and result. An iteration that called tools is a repeat if every one of its calls
+      was already made with the same result, since it learned nothing new.
+    - An iteration without tool calls is a repeat if its instruction or the agent's response is a near-duplicate of the instruction or response of an earlier iteration
+      without tool calls, i.e. their SimHashes differ in at most `max_distance` bits. Responses of a few sentences that differ in a single word already differ in about 10 bits,
+      so the default only matches near-verbatim repeats, and loops of tool calls are caught by their fingerprints.
+
+    A detector holds the history of a single run, and is reset when the run replans.
+    """
+
+    def __init__(self, max_distance: int = 4, shingle_size: int = 3):
+        self.max_distance = max_distance
+        self.shingle_size = shingle_size
+        self.reset()
+
+    def reset(self) -> None:
+        self._tool_calls: Set[str] = set()
+        self._hashes: List[int] = []
+        self.in_loop = False
+        self.iterations = 0
+        self.repeats = 0
+
+    @staticmethod
+    def fingerprint_tool_call(name: str, arguments: Any, result: Any) -> str:
+        """
+        Fingerprints a tool call, so that calls that only differ in case, whitespace or argument order share a fingerprint.
+        """
+
+        return SkillCache.create_key({"name": name, "arguments": arguments, "result": result})
+
+    @classmethod
+    def fingerprint_tool_results(cls, tool_results: List[Any]) -> List[str]:
+        """
+        Fingerprints the tool calls of an iteration.
+
+        Args:
+            tool_results: The messages passed to `on_tool_results`: the tool-calling assistant message, followed by the tool messages.
+
+        Returns:
+            List[str]: The fingerprint of each tool call.
+        """
+
+        calls = {}
+        for message in tool_results:
+            for tool_call in getattr(message, "tool_calls", None) or []:
+                try:
+                    arguments = json.loads(tool_call.function.arguments or "{}")
+                except ValueError:
+                    arguments = tool_call.function.arguments
+                calls[tool_call.id] = (tool_call.function.name, arguments)
+
+        return [cls.fingerprint_tool_call(*calls[message["tool_call_id"]], message["content"])
+                for message in tool_results
+                if isinstance(message, dict) and message.get("role") == "tool" and message.get("tool_call_id") in calls]
+
+    def _is_near_duplicate(self, value: int) -> bool:
+        return any((value ^ other).bit_count() <= self.max_distance for other in self._hashes)
+
+    def observe(self, instruction: str, tool_results: List[Any], response: Optional[str]) -> bool:
+        """
+        Records an iteration of the run.
+
+        Args:
+            instruction: The instruction the agent was given.
+            tool_results: The tool-calling assistant message and the tool messages of the iteration, as passed to `on_tool_results`, or an empty list if it called no tools.
+            response: The agent's response.
+
+        Returns:
+            bool: Whether the iteration repeats earlier ones, which is also kept in `in_loop` until the next iteration.
+        """
+
+        fingerprints = self.fingerprint_tool_results(tool_results)
+
+        if fingerprints:
+            self.in_loop = all(fingerprint in self._tool_calls for fingerprint in fingerprints)
+            self._tool_calls.update(fingerprints)
+        else:
+            hashes = [simhash(instruction, self.shingle_size), simhash(response or "", self.shingle_size)]
+            self.in_loop = any(self._is_near_duplicate(value) for value in hashes)
+            self._hashes.extend(hashes)
+
+        self.iterations += 1
+        self.repeats += self.in_loop
+        return self.in_loop
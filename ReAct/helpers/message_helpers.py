@@ -0,0 +1,43 @@
+from typing import Any, List, Optional
+from pydantic import BaseModel
+
+
+# Conversations mix typed dict message params (e.g. ChatCompletionUserMessageParam) with ChatCompletionMessage models returned by the API,
+# so these helpers read and update either shape.
+
+
+def get_message_role(message: Any) -> Optional[str]:
+    if isinstance(message, dict):
+        return message.get("role")
+    return getattr(message, "role", None)
+
+
+def get_message_content(message: Any) -> str:
+    content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+
+    # Content parts, e.g. [{"type": "text", "text": "..."}]
+    return "\n".join(part.get("text", "") if isinstance(part, dict) else str(getattr(part, "text", ""))
+                     for part in content)
+
+
+def get_message_tool_calls(message: Any) -> List[Any]:
+    tool_calls = message.get("tool_calls") if isinstance(message, dict) else getattr(message, "tool_calls", None)
+    return list(tool_calls or [])
+
+
+def with_message_content(message: Any, content: str) -> Any:
+    """
+    Returns a copy of the message with its content replaced, leaving the original message untouched.
+    """
+
+    if isinstance(message, dict):
+        return {**message, "content": content}
+    if isinstance(message, BaseModel):
+        return message.model_copy(update={"content": content})
+
+    raise TypeError(f"Unsupported message type {type(message).__name__}.")
@@ -0,0 +1,220 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+import hashlib
+import json
+import threading
+import time
+import numpy as np
+from pydantic import BaseModel, Field
+from helpers.embedding_pipeline import EmbeddingPipeline
+from helpers.storage_helpers import append_json_line, create_text_file, read_json_lines
+
+
+class PlanCacheEntry(BaseModel):
+    key: str = Field(description="The key of the entry, from its task and scope.")
+    scope: str = Field(description="The hash of what else the facts and plan depend on: the model, the team and the context.")
+    task: str = Field(description="The task the facts and plan were made for.")
+    facts: str = Field(description="The facts of the run.")
+    plan: str = Field(description="The plan of the run.")
+    created: float = Field(description="When the entry was stored, in seconds since the epoch.")
+    similarity: float = Field(
+        default=1.0, description="The cosine similarity of the task the entry was found for with the entry's task, or 1 for an exact match.")
+
+
+class PlanCache:
+    """
+    A class representing the facts and plans of past ReAct runs, reused by runs of the same or a similar task so that they skip gathering facts and planning.
+
+    Entries are keyed on their task and a scope, which covers everything else the facts and plan depend on: the model, the team and its skills, and the context.
+    A task matches an entry of its scope whose task is the same, ignoring case and whitespace, or, with an embedding pipeline, whose task embedding has a cosine similarity
+    of at least `similarity_threshold` with its own. Exact matches are found without an embedding call.
+
+    Up to `max_entries` entries are kept, evicting the least recently used, and entries expire after `ttl` seconds.
+    If a path is given, entries are appended to a JSON Lines file and reloaded when the cache is created, so that plans are reused across sessions.
+    The file is rewritten without stale entries once it holds twice as many lines as live entries, and whenever an entry is invalidated.
+    """
+
+    def __init__(self, path: Optional[str] = None, embedding_pipeline: Optional[EmbeddingPipeline] = None, similarity_threshold: float = 0.95, max_entries: int = 256, ttl: Optional[float] = None):
+        self.path = path
+        self.embedding_pipeline = embedding_pipeline
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, PlanCacheEntry]" = OrderedDict()
+        self._embeddings: Dict[str, np.ndarray] = {}
+        self._persisted_lines = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None:
+            for item in read_json_lines(path):
+                embedding = item.pop("embedding", None)
+                self._store(PlanCacheEntry(**item), self._normalize(embedding))
+                self._persisted_lines += 1
+
+    @staticmethod
+    def create_scope(model_deployment: str, team: str, context: str = "") -> str:
+        """
+        Creates the scope of a run, so that facts and plans are only reused by runs with the same model, team and context.
+        """
+
+        payload = json.dumps([model_deployment, team, context])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def create_key(task: str, scope: str) -> str:
+        payload = json.dumps([" ".join(task.lower().split()), scope])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize(embedding: Optional[Sequence[float]]) -> Optional[np.ndarray]:
+        if embedding is None:
+            return None
+
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _is_expired(self, entry: PlanCacheEntry) -> bool:
+        return self.ttl is not None and time.time() - entry.created > self.ttl
+
+    def _store(self, entry: PlanCacheEntry, embedding: Optional[np.ndarray]) -> None:
+        self._entries[entry.key] = entry
+        self._entries.move_to_end(entry.key)
+
+        if embedding is not None:
+            self._embeddings[entry.key] = embedding
+
+        while len(self._entries) > self.max_entries:
+            key, _ = self._entries.popitem(last=False)
+            self._embeddings.pop(key, None)
+
+    def _remove(self, key: str) -> None:
+        self._entries.pop(key, None)
+        self._embeddings.pop(key, None)
+
+    async def aget(self, task: str, scope: str) -> Tuple[Optional[PlanCacheEntry], Optional[List[float]]]:
+        """
+        Finds the entry for a task, embedding the task only if it has no exact match.
+
+        Returns:
+            Tuple[Optional[PlanCacheEntry], Optional[List[float]]]: The entry, or None, and the task's embedding if one was created, to pass to `set`.
+        """
+
+        entry = self._find(task, scope)
+        embedding = None
+
+        if entry is None and self.embedding_pipeline is not None:
+            embedding = await self.embedding_pipeline.acreate_embedding(task)
+            entry = self._find(task, scope, embedding)
+
+        self._count(entry)
+        return entry, embedding
+
+    def get(self, task: str, scope: str, embedding: Optional[Sequence[float]] = None) -> Optional[PlanCacheEntry]:
+        """
+        Finds the entry for a task: the entry of the same task, or, if the task's embedding is given, the entry of the most similar task above the similarity threshold.
+
+        Args:
+            task: The task to find an entry for.
+            scope: The scope of the run, from `create_scope`.
+            embedding: The task's embedding, to also match similar tasks.
+
+        Returns:
+            Optional[PlanCacheEntry]: The entry, with the similarity of its task, or None.
+        """
+
+        entry = self._find(task, scope, embedding)
+        self._count(entry)
+        return entry
+
+    def _count(self, entry: Optional[PlanCacheEntry]) -> None:
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+    def _find(self, task: str, scope: str, embedding: Optional[Sequence[float]] = None) -> Optional[PlanCacheEntry]:
+        key = self.create_key(task, scope)
+        query = self._normalize(embedding)
+
+        with self._lock:
+            for expired in [entry.key for entry in self._entries.values() if self._is_expired(entry)]:
+                self._remove(expired)
+
+            entry = self._entries.get(key)
+            similarity = 1.0
+
+            if entry is None and query is not None:
+                keys = [entry.key for entry in self._entries.values() if entry.scope == scope and entry.key in self._embeddings]
+
+                if keys:
+                    similarities = np.stack([self._embeddings[key] for key in keys]) @ query
+                    best = int(np.argmax(similarities))
+
+                    if similarities[best] >= self.similarity_threshold:
+                        entry = self._entries[keys[best]]
+                        similarity = float(similarities[best])
+
+            if entry is None:
+                return None
+
+            self._entries.move_to_end(entry.key)
+            return entry.model_copy(update={"similarity": similarity})
+
+    def set(self, task: str, scope: str, facts: str, plan: str, embedding: Optional[Sequence[float]] = None) -> None:
+        """
+        Stores the facts and plan of a run. Without an embedding, the entry keeps the embedding of the entry it replaces, if any.
+        """
+
+        entry = PlanCacheEntry(key=self.create_key(task, scope), scope=scope, task=task, facts=facts, plan=plan, created=time.time())
+        vector = self._normalize(embedding)
+
+        with self._lock:
+            if vector is None:
+                vector = self._embeddings.get(entry.key)
+
+            self._store(entry, vector)
+
+            if self.path is None:
+                return
+
+            append_json_line(self.path, self._to_line(entry, vector))
+            self._persisted_lines += 1
+
+            if self._persisted_lines > 2 * len(self._entries) + 64:
+                self._compact()
+
+    def invalidate(self, key: str) -> None:
+        """
+        Removes an entry, e.g. one whose plan ended in the replan limit, so that it is not reused.
+        """
+
+        with self._lock:
+            if key not in self._entries:
+                return
+
+            self._remove(key)
+
+            if self.path is not None:
+                self._compact()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._embeddings.clear()
+
+            if self.path is not None:
+                self._compact()
+
+    @staticmethod
+    def _to_line(entry: PlanCacheEntry, embedding: Optional[np.ndarray]) -> dict:
+        return {**entry.model_dump(exclude={"similarity"}), "embedding": embedding.tolist() if embedding is not None else None}
+
+    def _compact(self) -> None:
+        lines = [json.dumps(self._to_line(entry, self._embeddings.get(key))) for key, entry in self._entries.items()]
+
+        create_text_file(self.path, "".join(line + "\n" for line in lines))
+        self._persisted_lines = len(lines)
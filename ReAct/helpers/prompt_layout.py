@@ -0,0 +1,28 @@
+from typing import Any, List, Sequence
+
+
+class PromptLayout:
+    """
+    A class representing how the messages of a request are assembled, so that provider-side prompt caching can reuse as much of each request as possible.
+
+    Prompt caching matches on the longest identical prefix of a request, so messages are always assembled in the same order:
+    the static prefix (e.g. the system prompt or task header), then the conversation, which only ever grows at its end, then an optional trailing prompt.
+    The static prefix is built once and reused as-is, so it is byte-identical across every call that uses the layout.
+    """
+
+    def __init__(self, prefix: Sequence[Any] = ()):
+        self.prefix = tuple(prefix)
+
+    def build(self, messages: Sequence[Any] = (), trailing: Sequence[Any] = ()) -> List[Any]:
+        """
+        Assembles the messages of a request.
+
+        Args:
+            messages: The conversation that follows the static prefix.
+            trailing: Any messages that follow the conversation, e.g. a validation prompt.
+
+        Returns:
+            List[Any]: The messages to send.
+        """
+
+        return [*self.prefix, *messages, *trailing]
@@ -0,0 +1,478 @@
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletionMessage, ParsedChatCompletionMessage
+from openai.types.chat.chat_completion_user_message_param import ChatCompletionUserMessageParam
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional, Tuple, Union
+from pydantic import BaseModel, Field
+import asyncio
+from helpers.async_helpers import iterate_sync, run_sync
+from helpers.agent_registry import AgentRegistry
+from helpers.base_agent import BaseAgent
+from helpers.conversation_compactor import ConversationCompactor
+from helpers.plan_cache import PlanCache
+from helpers.loop_detector import LoopDetector
+from helpers.request_models import ProgressValidationModel, RequestValidationModel
+from helpers.prompt_layout import PromptLayout
+from helpers.run_stats import RunStats, record_stat, record_usage, start_run_stats
+from helpers.stream_helpers import StreamEvent, acreate_completion_stream, astream_message
+from helpers.tracing import trace
+
+
+class ReActPrompts(BaseModel):
+    initial_fact_prompt: str = Field(
+        description="Prompt to gather the initial facts, formatted with `task` and `context`.")
+    plan_prompt: str = Field(
+        description="Prompt to create the initial plan, formatted with `team`.")
+    execute_prompt: str = Field(
+        description="Header of the execution conversation, formatted with `task`, `team` and `context`, and also with `facts` and `plan` unless `execute_plan_prompt` is provided.")
+    execute_plan_prompt: Optional[str] = Field(
+        default=None, description="Optional message that follows the execution header, formatted with `facts` and `plan`. Keeps the header identical across replans.")
+    validate_prompt: str = Field(
+        description="Prompt to validate the progress of the execution, formatted with `task` and `team`.")
+    update_facts_prompt: str = Field(
+        description="Prompt to update the facts when replanning, formatted with `task`, `context` and `facts`.")
+    update_plan_prompt: str = Field(
+        description="Prompt to update the plan when replanning, formatted with `team`.")
+    result_prompt: str = Field(
+        description="Prompt to produce the final answer, formatted with `task`.")
+
+
+class ReActResult(BaseModel):
+    task: str = Field(description="The task that was run.")
+    final_response: Optional[str] = Field(
+        description="The final answer to the task.")
+    facts: str = Field(description="The facts at the end of the run.")
+    plan: str = Field(description="The plan at the end of the run.")
+    messages: List[Any] = Field(
+        description="The execution conversation, including the final answer.")
+    iterations: int = Field(
+        description="The number of validate/execute iterations that were run.")
+    replan_count: int = Field(description="The number of times the task was replanned.")
+    terminated_reason: Optional[str] = Field(
+        description="Why the run stopped before the request was satisfied, if it did.")
+    stats: RunStats = Field(
+        description="The round-trips made and saved, and the tokens used, during the run.")
+
+
+class ReActOrchestrator:
+    """
+    A class representing the ReAct orchestration loop: gathering facts, planning, validating and executing the plan with an agent, replanning when stalled, and producing the final answer.
+
+    All state of a run is local to that run, so a single orchestrator, and the agent it drives, can run many tasks at the same time.
+    The agent's shared state (e.g. a `RecipeAgent`'s recipes and index) is guarded by the agent itself.
+    The agent can also be an `AgentRegistry`, which routes each instruction to the agents of a team, running them concurrently when the instruction spans several of them.
+
+    With `speculative_validation`, the validation for the next iteration is requested as soon as the agent's tools have returned, at the same time as the agent writes its response,
+    so that it no longer adds a sequential round-trip. The validator then judges progress from the tool results rather than from the agent's summary of them.
+
+    With a `compactor`, the execution conversation sent to the validator, the agent and the final answer is kept within the compactor's token budget.
+    The full conversation is still returned in the result.
+
+    Requests are assembled with a `PromptLayout`, so that the execution header leads every request of a run unchanged and can be served from the provider's prompt cache.
+    Cached and uncached prompt tokens are recorded in the run's stats.
+
+    With a `plan_cache`, the facts and plan of a run that satisfied its request are stored, and a later run of the same or a similar task, with the same team and context,
+    reuses them instead of gathering facts and planning. A reused plan that ends in the replan limit is invalidated.
+
+    With a `loop_detector`, e.g. `LoopDetector`, which creates the detector of each run, loops are detected locally from the instructions, tool calls and responses of the run,
+    as soon as an iteration repeats earlier ones, and the validator is no longer asked whether the run is in a loop.
+
+    `astream` runs the same loop, but streams the agent's responses and the final answer as they are generated, so that output is shown without waiting for each completion.
+
+    While tracing is enabled, each run is traced as a `react.run` span, with a span for each step (facts, plan, validate, execute, replan, final) holding the spans of its LLM calls and tools.
+    """
+
+    def __init__(self, client: OpenAI, model_deployment: str, agent: Union[BaseAgent, AgentRegistry], prompts: ReActPrompts, stall_limit: int = 2, replan_limit: int = 2, max_iterations: Optional[int] = 20, async_client: Optional[AsyncOpenAI] = None, on_event: Optional[Callable[[str, str], None]] = None, speculative_validation: bool = False, compactor: Optional[ConversationCompactor] = None, plan_cache: Optional[PlanCache] = None, loop_detector: Optional[Callable[[], LoopDetector]] = None):
+        self.client = client
+        self.async_client = async_client
+        self.model_deployment = model_deployment
+        self.agent = agent
+        self.prompts = prompts
+        self.stall_limit = stall_limit
+        self.replan_limit = replan_limit
+        self.max_iterations = max_iterations
+        self.on_event = on_event
+        self.speculative_validation = speculative_validation
+        self.compactor = compactor
+        self.plan_cache = plan_cache
+        self.loop_detector = loop_detector
+        self.team = agent.get_agent_details()
+
+    @staticmethod
+    def _event(title: str, content: str) -> StreamEvent:
+        return StreamEvent(type="event", title=title, content=content)
+
+    def _emit(self, title: str, content: str) -> None:
+        if self.on_event is not None:
+            self.on_event(title, content)
+
+    def _compact(self, messages: List[Any]) -> List[Any]:
+        if self.compactor is None:
+            return list(messages)
+
+        # The execution header and the latest plan are part of the layout, so no messages need to be pinned.
+        return list(self.compactor.compact(messages, pinned=()))
+
+    def _create_execute_layout(self, task: str, context: str, facts: str, plan: str, layout: Optional[PromptLayout] = None) -> Tuple[PromptLayout, List[Any]]:
+        """
+        Creates the static execution header, and the messages holding the facts and plan.
+
+        With an `execute_plan_prompt`, the header only holds the task, team and context, and is reused as-is across replans, with the facts and plan following it in their own message.
+        Otherwise, the header holds the facts and plan too, and is recreated on every replan.
+        """
+
+        prompts = self.prompts
+
+        if prompts.execute_plan_prompt is None:
+            return PromptLayout([ChatCompletionMessage(role="assistant", content=prompts.execute_prompt.format(
+                task=task, team=self.team, context=context, facts=facts, plan=plan))]), []
+
+        if layout is None:
+            layout = PromptLayout([ChatCompletionMessage(role="assistant", content=prompts.execute_prompt.format(
+                task=task, team=self.team, context=context))])
+
+        return layout, [ChatCompletionMessage(role="assistant", content=prompts.execute_plan_prompt.format(facts=facts, plan=plan))]
+
+    @staticmethod
+    def _get_plan_content(layout: PromptLayout, plan_messages: List[Any]) -> str:
+        return "\n\n".join(message.content for message in [*layout.prefix, *plan_messages])
+
+    async def acall_openai(self, messages: List[Any]) -> ChatCompletionMessage:
+        kwargs = dict(
+            model=self.model_deployment,
+            messages=messages,
+            temperature=0.3,
+            top_p=0.3,
+        )
+
+        with trace("llm.chat", model=self.model_deployment) as span:
+            record_stat("llm_calls")
+
+            if self.async_client is not None:
+                completion = await self.async_client.chat.completions.create(**kwargs)
+            else:
+                completion = await asyncio.to_thread(self.client.chat.completions.create, **kwargs)
+
+            record_usage(completion)
+            span.record_usage(completion)
+            return completion.choices[0].message
+
+    async def avalidate_request(self, messages: List[Any]) -> ParsedChatCompletionMessage[Union[RequestValidationModel, ProgressValidationModel]]:
+        kwargs = dict(
+            model=self.model_deployment,
+            messages=messages,
+            response_format=ProgressValidationModel if self.loop_detector is not None else RequestValidationModel,
+            temperature=0.1,
+            top_p=0.1
+        )
+
+        with trace("llm.parse", model=self.model_deployment) as span:
+            record_stat("llm_calls")
+
+            if self.async_client is not None:
+                completion = await self.async_client.beta.chat.completions.parse(**kwargs)
+            else:
+                completion = await asyncio.to_thread(self.client.beta.chat.completions.parse, **kwargs)
+
+            record_usage(completion)
+            span.record_usage(completion)
+            return completion.choices[0].message
+
+    async def astream_openai(self, messages: List[Any], title: Optional[str] = None) -> AsyncIterator[StreamEvent]:
+        chunks = acreate_completion_stream(
+            self.client,
+            self.async_client,
+            model=self.model_deployment,
+            messages=messages,
+            temperature=0.3,
+            top_p=0.3,
+        )
+
+        async for event in astream_message(chunks, title):
+            yield event
+
+    async def arun(self, task: str, context: str = "") -> ReActResult:
+        """
+        Runs the ReAct loop for a single task.
+
+        Args:
+            task: The user's request.
+            context: Optional context to consider when addressing the request.
+
+        Returns:
+            ReActResult: The final answer and the trace of the run.
+        """
+
+        async for event in self._atrace_run(task, context, stream=False):
+            if event.type == "event":
+                self._emit(event.title, event.content)
+            elif event.type == "result":
+                return event.result
+
+    async def astream(self, task: str, context: str = "") -> AsyncIterator[StreamEvent]:
+        """
+        Runs the ReAct loop for a single task, streaming the agent's responses and the final answer as they are generated.
+        Progress is yielded as events rather than passed to `on_event`.
+
+        Args:
+            task: The user's request.
+            context: Optional context to consider when addressing the request.
+
+        Returns:
+            AsyncIterator[StreamEvent]: `event` events for the progress of the run (Plan, Validation, Execute, Final),
+                `token` and `tool_call` events as the agent and the final answer are streamed, and a last `result` event with the ReActResult.
+        """
+
+        async for event in self._atrace_run(task, context, stream=True):
+            yield event
+
+    def stream(self, task: str, context: str = "") -> Iterator[StreamEvent]:
+        return iterate_sync(self.astream(task, context))
+
+    async def _atrace_run(self, task: str, context: str, stream: bool) -> AsyncIterator[StreamEvent]:
+        # The result is yielded once the run's span has ended, so that the span is complete even if the caller stops iterating at the result.
+        with trace("react.run", task=task, stream=stream) as span:
+            async for event in self._arun(task, context, stream):
+                if event.type == "result":
+                    result_event = event
+                else:
+                    yield event
+
+            result = result_event.result
+            span.set_attributes(iterations=result.iterations, replan_count=result.replan_count, terminated_reason=result.terminated_reason,
+                                llm_calls=result.stats.llm_calls, prompt_tokens=result.stats.prompt_tokens, completion_tokens=result.stats.completion_tokens)
+
+        yield result_event
+
+    async def _arun(self, task: str, context: str, stream: bool) -> AsyncIterator[StreamEvent]:
+        prompts = self.prompts
+        stats = start_run_stats()
+
+        cached_plan = None
+        task_embedding = None
+
+        if self.plan_cache is not None:
+            with trace("react.plan_cache") as span:
+                scope = PlanCache.create_scope(self.model_deployment, self.team, context)
+                cached_plan, task_embedding = await self.plan_cache.aget(task, scope)
+                span.set_attribute("cache_hit", cached_plan is not None)
+
+        if cached_plan is not None:
+            # Both planning round-trips are skipped.
+            facts, plan = cached_plan.facts, cached_plan.plan
+            record_stat("plan_cache_hits")
+            record_stat("round_trips_saved", 2)
+        else:
+            # 1 - Gather Facts
+            planning_messages = [ChatCompletionUserMessageParam(
+                role="user", content=prompts.initial_fact_prompt.format(task=task, context=context))]
+            with trace("react.facts"):
+                fact_message = await self.acall_openai(planning_messages)
+            facts = fact_message.content
+            planning_messages.append(ChatCompletionMessage(
+                role="assistant", content=fact_message.content))
+
+            # 2 - Develop Plan
+            planning_messages.append(ChatCompletionUserMessageParam(
+                role="user", content=prompts.plan_prompt.format(team=self.team)))
+            with trace("react.plan"):
+                plan_message = await self.acall_openai(planning_messages)
+            plan = plan_message.content
+
+        # 3 - Execute Plan
+        loop_detector = self.loop_detector() if self.loop_detector is not None else None
+        stall_count = 0
+        replan_count = 0
+        iterations = 0
+        terminated_reason = None
+
+        # The execution header and the validation prompt are created once per run, so they are byte-identical in every request and can be reused by provider-side prompt caching.
+        layout, plan_messages = self._create_execute_layout(task, context, facts, plan)
+        execute_messages = []
+        validate_message = ChatCompletionUserMessageParam(
+            role="user", content=prompts.validate_prompt.format(task=task, team=self.team))
+
+        plan_content = self._get_plan_content(layout, plan_messages)
+        yield self._event("Plan", f"Cached plan:\n{plan_content}" if cached_plan is not None else plan_content)
+
+        speculative_validation: Optional[asyncio.Task] = None
+
+        while True:
+            if self.max_iterations is not None and iterations >= self.max_iterations:
+                terminated_reason = "Iteration Limit Reached."
+                yield self._event("Validation", "Iteration Limit Reached. Terminating.")
+                break
+
+            iterations += 1
+
+            # 3.1 - Validate the current state of the task
+            with trace("react.validate", iteration=iterations, speculative=speculative_validation is not None):
+                if speculative_validation is not None:
+                    current_state = (await speculative_validation).parsed
+                    speculative_validation = None
+                    record_stat("speculative_validations")
+                    record_stat("round_trips_saved")
+                else:
+                    validate_messages = layout.build(
+                        [*plan_messages, *self._compact(execute_messages)], trailing=[validate_message])
+
+                    current_state = (await self.avalidate_request(validate_messages)).parsed
+
+            yield self._event("Validation", current_state.model_dump_json(indent=2))
+
+            # 3.2 - Check if the task is completed
+            if current_state.is_request_completed.answer:
+                yield self._event("Validation", "Request Satisfied.")
+                break
+
+            # 3.3 - Check if the task is stuck in a loop
+            in_loop = loop_detector.in_loop if loop_detector is not None else current_state.is_in_loop.answer
+
+            if in_loop:
+                stall_count += 1
+
+                if stall_count >= self.stall_limit:
+                    replan_count += 1
+                    stall_count = 0
+
+                    if replan_count >= self.replan_limit:
+                        terminated_reason = "Replan Limit Reached."
+                        yield self._event("Validation", "Replan Limit Reached. Terminating.")
+                        break
+
+                    yield self._event("Validation", "Loop Detected. Replanning.")
+
+                    with trace("react.replan", replan=replan_count):
+                        planning_messages = layout.build(
+                            [*plan_messages, *self._compact(execute_messages)])
+
+                        # 3.3.1 - Update Facts
+                        planning_messages.append(ChatCompletionUserMessageParam(
+                            role="user", content=prompts.update_facts_prompt.format(task=task, context=context, facts=facts)))
+
+                        fact_message = await self.acall_openai(planning_messages)
+                        facts = fact_message.content
+
+                        planning_messages.append(fact_message)
+
+                        # 3.3.2 - Update Plan
+                        planning_messages.append(ChatCompletionUserMessageParam(
+                            role="user", content=prompts.update_plan_prompt.format(team=self.team)))
+
+                        plan_message = await self.acall_openai(planning_messages)
+                        plan = plan_message.content
+
+                        # 3.3.3 - Reset and Execute Updated Plan
+                        layout, plan_messages = self._create_execute_layout(
+                            task, context, facts, plan, layout)
+                        execute_messages = []
+
+                        if loop_detector is not None:
+                            loop_detector.reset()
+
+                    yield self._event("Plan", f"New plan:\n{self._get_plan_content(layout, plan_messages)}")
+
+            # 3.4 - Execute the Next Instruction
+            instruction = current_state.next_instruction_or_question.reason + \
+                " " + current_state.next_instruction_or_question.answer
+            execute_messages.append(ChatCompletionUserMessageParam(
+                role="user", content=instruction))
+
+            query_messages = layout.build(
+                [*plan_messages, *self._compact(execute_messages)])
+            on_tool_results = None
+            tool_results = []
+
+            if self.speculative_validation or loop_detector is not None:
+                def on_tool_results(tool_messages: List[Any]) -> None:
+                    nonlocal speculative_validation
+                    tool_results.extend(tool_messages)
+
+                    if self.speculative_validation:
+                        speculative_validation = asyncio.ensure_future(self.avalidate_request(
+                            [*query_messages, *tool_messages, validate_message]))
+
+            with trace("react.execute", iteration=iterations) as span:
+                if stream:
+                    async for event in self.agent.astream_query(query_messages, on_tool_results):
+                        event.title = "Execute"
+                        if event.type == "message":
+                            response_message = event.message
+                        yield event
+                else:
+                    response_message = await self.agent.aprocess_query(query_messages, on_tool_results)
+
+                # The loop is detected now, but acted on after the next validation, like the validator's judgement would be.
+                if loop_detector is not None and loop_detector.observe(instruction, tool_results, response_message.content):
+                    record_stat("loops_detected")
+                    span.set_attribute("in_loop", True)
+
+            execute_messages.append(response_message)
+
+            yield self._event("Execute", response_message.content)
+
+        if speculative_validation is not None:
+            speculative_validation.cancel()
+
+        if self.plan_cache is not None:
+            if cached_plan is not None and terminated_reason == "Replan Limit Reached.":
+                self.plan_cache.invalidate(cached_plan.key)
+            elif terminated_reason is None and (cached_plan is None or replan_count > 0):
+                self.plan_cache.set(task, scope, facts, plan, task_embedding)
+
+        # 4 - Finalize Answer
+        execute_messages.append(ChatCompletionUserMessageParam(
+            role="user", content=prompts.result_prompt.format(task=task)))
+        final_messages = layout.build([*plan_messages, *self._compact(execute_messages)])
+
+        with trace("react.final"):
+            if stream:
+                async for event in self.astream_openai(final_messages, "Final"):
+                    if event.type == "message":
+                        final_response_message = event.message
+                    yield event
+            else:
+                final_response_message = await self.acall_openai(final_messages)
+
+        execute_messages.append(final_response_message)
+
+        final_response = final_response_message.content
+
+        yield self._event("Final", final_response)
+
+        yield StreamEvent(type="result", result=ReActResult(
+            task=task,
+            final_response=final_response,
+            facts=facts,
+            plan=plan,
+            messages=layout.build([*plan_messages, *execute_messages]),
+            iterations=iterations,
+            replan_count=replan_count,
+            terminated_reason=terminated_reason,
+            stats=stats))
+
+    def run(self, task: str, context: str = "") -> ReActResult:
+        return run_sync(self.arun(task, context))
+
+    async def arun_many(self, tasks: List[Union[str, Tuple[str, str]]], max_concurrency: int = 8) -> List[Union[ReActResult, Exception]]:
+        """
+        Runs the ReAct loop for many tasks concurrently, with at most `max_concurrency` runs in flight at the same time.
+
+        Args:
+            tasks: The tasks to run, either as a task string or a (task, context) tuple.
+            max_concurrency: The maximum number of tasks to run at the same time.
+
+        Returns:
+            List[Union[ReActResult, Exception]]: The result of each task, in the same order as `tasks`. A task that fails returns its exception, without affecting the other tasks.
+        """
+
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def _run(item: Union[str, Tuple[str, str]]) -> ReActResult:
+            task, context = (item, "") if isinstance(item, str) else item
+            async with semaphore:
+                return await self.arun(task, context)
+
+        return list(await asyncio.gather(*[_run(item) for item in tasks], return_exceptions=True))
+
+    def run_many(self, tasks: List[Union[str, Tuple[str, str]]], max_concurrency: int = 8) -> List[Union[ReActResult, Exception]]:
+        return run_sync(self.arun_many(tasks, max_concurrency))
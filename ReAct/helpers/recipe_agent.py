@@ -1,362 +1,166 @@
 from helpers.base_agent import BaseAgent, skill
-from openai import OpenAI
-from openai.types.chat import ChatCompletionMessage, ChatCompletionContentPartTextParam
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageToolCall, ChatCompletionContentPartTextParam
 from openai.types.chat.chat_completion_system_message_param import ChatCompletionSystemMessageParam
 from openai.types.chat.chat_completion_user_message_param import ChatCompletionUserMessageParam
-from typing import Optional, List
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, Optional, List, Tuple
+import asyncio
+import functools
 import json
-from pydantic import BaseModel, Field
-from helpers.storage_helpers import CustomEncoder, create_json_file
-import os
+import threading
 import numpy as np
-
-
-class Recipe(BaseModel):
-    name: str = Field(description="The name of the recipe.")
-    author: Optional[str] = Field(
-        description="The author of the recipe, if available.")
-    ingredients: List[str] = Field(
-        description="The ingredients required for the recipe.")
-    steps: List[str] = Field(description="The steps to prepare the recipe.")
-    embedding: Optional[List[float]] = Field(
-        description="The embedding of the recipe for similarity matching. This field must be left as an empty array.")
-
-    def model_dump_markdown(self):
-        return f"""
-        # Recipe: {self.name}
-        ## Ingredients:
-        {"".join([f"- {ingredient}\n" for ingredient in self.ingredients])}
-        ## Steps:
-        {"".join([f"{i+1}. {step}\n" for i, step in enumerate(self.steps)])}
-        """
+from helpers.storage_helpers import CustomEncoder, get_data_path
+from helpers.recipe_catalog import RecipeCatalog
+from helpers.recipe_models import Recipe, RecipeRecord
+from helpers.recipe_name_index import RecipeNameIndex
+from helpers.skill_cache import SkillCache
+from helpers.ingredient_parser import ParsedIngredient, compare_ingredients, format_quantity, parse_ingredients
+from helpers.recipe_store import RecipeStore
+from helpers.embedding_pipeline import EmbeddingPipeline
+from helpers.embedding_cache import EmbeddingCache
+from helpers.run_stats import record_stat
+from helpers.prompt_layout import PromptLayout
+from helpers.stream_helpers import StreamEvent, astream_message
+from helpers.text_helpers import tokenize, tokenize_all
+from helpers.tracing import current_span, trace, traced
+
+
+_shared_defaults: Dict[Hashable, Any] = {}
+_shared_defaults_lock = threading.Lock()
+
+
+def _get_shared(key: Hashable, factory: Callable[[], Any]) -> Any:
+    # Default caches are shared by all agents, rather than reopened by each of them.
+    with _shared_defaults_lock:
+        if key not in _shared_defaults:
+            _shared_defaults[key] = factory()
+        return _shared_defaults[key]
 
 
 class RecipeAgent(BaseAgent):
     NAME = "Recipe Agent"
     DESCRIPTION = "An agent that can help with cooking recipes."
-
-    def __init__(self, client: OpenAI, model_deployment: str, embedding_model_deployment: str):
-        super().__init__(self.NAME, self.DESCRIPTION, client, model_deployment)
+    # The fraction of a description's words that must be known ingredients for it to be matched lexically only.
+    LEXICAL_ONLY_THRESHOLD = 0.75
+    # The cosine similarity a recipe must exceed to match a description.
+    MIN_VECTOR_SCORE = 0.5
+    # The BM25 score, relative to that of a recipe holding each word of the description once, a recipe must reach to match a description matched lexically only.
+    MIN_LEXICAL_SCORE = 0.5
+    # The fraction of a description's distinct words a recipe must hold, more than, to match a description matched lexically only,
+    # so that a recipe that shares a single word with the description, e.g. "bread" for "banana bread", doesn't match without a vector check.
+    MIN_LEXICAL_TERM_FRACTION = 0.5
+    # The skill cache entries holding the name of the vegan conversion of each recipe.
+    VEGAN_CONVERSIONS = "modify_recipe_if_not_vegan.conversions"
+
+    def __init__(self, client: OpenAI, model_deployment: str, embedding_model_deployment: str, embedding_pipeline: Optional[EmbeddingPipeline] = None, recipe_store: Optional[RecipeStore] = None, max_tool_concurrency: int = 4, async_client: Optional[AsyncOpenAI] = None, skill_cache: Optional[SkillCache] = None, catalog: Optional[RecipeCatalog] = None):
+        super().__init__(self.NAME, self.DESCRIPTION, client,
+                         model_deployment, max_tool_concurrency, async_client, skill_cache or _get_shared(("skill_cache", get_data_path("skill_cache.jsonl")), lambda: SkillCache(get_data_path("skill_cache.jsonl"))))
         self.embedding_model_deployment = embedding_model_deployment
-        self.recipes = [
-            Recipe(
-                name="Classic Margherita Pizza",
-                author="James Croft",
-                ingredients=[
-                    "1 pizza dough ball",
-                    "½ cup pizza sauce",
-                    "1 cup shredded mozzarella cheese",
-                    "Fresh basil leaves",
-                    "Olive oil",
-                    "Salt and pepper to taste"
-                ],
-                steps=[
-                    "Preheat your oven to 475°F (245°C) and place a pizza stone inside to heat up.",
-                    "Roll out the pizza dough on a floured surface to your desired thickness.",
-                    "Spread the pizza sauce over the dough, leaving a small border around the edges.",
-                    "Sprinkle the shredded mozzarella cheese over the sauce.",
-                    "Bake the pizza on the preheated stone for 10-12 minutes or until the crust is golden and the cheese is bubbly.",
-                    "Remove the pizza from the oven and top with fresh basil leaves, a drizzle of olive oil, and salt and pepper to taste."
-                ],
-                embedding=None
-            ),
-            Recipe(
-                name="Eggs Benedict",
-                author="James Croft",
-                ingredients=[
-                    "4 eggs",
-                    "2 English muffins, split",
-                    "4 slices Canadian bacon",
-                    "Hollandaise sauce",
-                    "Salt and pepper to taste",
-                    "Chopped parsley (for garnish)"
-                ],
-                steps=[
-                    "Fill a large saucepan with 2-3 inches of water and bring to a simmer.",
-                    "In a separate saucepan, heat the Hollandaise sauce over low heat, stirring occasionally.",
-                    "Toast the English muffins and cook the Canadian bacon in a skillet until heated through.",
-                    "Poach the eggs in the simmering water for 3-4 minutes until the whites are set but the yolks are still runny.",
-                    "Assemble the Eggs Benedict by placing a slice of Canadian bacon on each English muffin half, topping with a poached egg, and drizzling with Hollandaise sauce.",
-                    "Season with salt and pepper, and garnish with chopped parsley before serving."
-                ],
-                embedding=None
-            ),
-            Recipe(
-                name="Vegan Chocolate Cake",
-                author="James Croft",
-                ingredients=[
-                    "1 ½ cups all-purpose flour",
-                    "1 cup organic cane sugar",
-                    "½ cup cocoa powder",
-                    "1 tsp baking soda",
-                    "½ tsp salt",
-                    "1 cup almond milk",
-                    "⅓ cup vegetable oil",
-                    "1 tbsp apple cider vinegar",
-                    "1 tsp vanilla extract"
-                ],
-                steps=[
-                    "Preheat your oven to 350°F (175°C) and grease an 8-inch round cake pan.",
-                    "In a large bowl, sift together flour, sugar, cocoa powder, baking soda, and salt.",
-                    "In a separate bowl, whisk almond milk, vegetable oil, apple cider vinegar, and vanilla extract.",
-                    "Pour the wet ingredients into the dry ingredients and mix until just combined.",
-                    "Pour the batter into the prepared pan and bake for 30-35 minutes or until a toothpick inserted in the center comes out clean.",
-                    "Let the cake cool in the pan for 10 minutes, then transfer to a wire rack to cool completely."
-                ],
-                embedding=None
-            ),
-            Recipe(
-                name="Spaghetti Bolognese",
-                author="James Croft",
-                ingredients=[
-                    "400g spaghetti",
-                    "500g ground beef",
-                    "1 large onion, finely chopped",
-                    "3 cloves garlic, minced",
-                    "2 cans (400g each) diced tomatoes",
-                    "2 tbsp tomato paste",
-                    "100ml red wine (optional)",
-                    "1 tsp dried oregano",
-                    "1 tsp dried basil",
-                    "Salt and pepper to taste",
-                    "2 tbsp olive oil",
-                    "Grated Parmesan cheese (for serving)"
-                ],
-                steps=[
-                    "Cook the spaghetti according to package instructions until al dente. Drain and set aside.",
-                    "Heat olive oil in a large pan over medium heat. Add chopped onion and garlic; sauté until soft and translucent.",
-                    "Add ground beef and cook until browned, breaking it up with a spoon as it cooks.",
-                    "Stir in tomato paste and cook for 1-2 minutes to develop the flavor.",
-                    "Pour in diced tomatoes and red wine, then add oregano and basil. Season with salt and pepper.",
-                    "Bring the sauce to a simmer and let it cook for 20-30 minutes, stirring occasionally.",
-                    "Serve the sauce over spaghetti and top with grated Parmesan cheese."
-                ],
-                embedding=None
-            ),
-            Recipe(
-                name="Beef Stir-Fry with Vegetables",
-                author="James Croft",
-                ingredients=[
-                    "400g beef sirloin, thinly sliced",
-                    "1 head broccoli, cut into florets",
-                    "1 red bell pepper, sliced",
-                    "1 yellow bell pepper, sliced",
-                    "2 carrots, julienned",
-                    "100g snap peas",
-                    "2 cloves garlic, minced",
-                    "1 tbsp fresh ginger, grated",
-                    "3 tbsp soy sauce",
-                    "1 tbsp sesame oil",
-                    "1 tsp cornstarch mixed with 2 tsp water",
-                    "2 tbsp vegetable oil",
-                    "Cooked rice (for serving)"
-                ],
-                steps=[
-                    "Marinate the beef slices in 2 tbsp soy sauce, garlic, and ginger for 15 minutes.",
-                    "Heat vegetable oil in a wok or large pan over high heat. Stir-fry the beef until nearly cooked through, then remove from the pan.",
-                    "In the same pan, add a little more oil if needed, and stir-fry the broccoli, bell peppers, carrots, and snap peas for 3-4 minutes until crisp-tender.",
-                    "Return the beef to the pan, add the remaining 1 tbsp soy sauce and sesame oil, and stir-fry for another 2 minutes.",
-                    "Pour in the cornstarch slurry to thicken the sauce slightly, stirring well.",
-                    "Serve hot over a bed of cooked rice."
-                ],
-                embedding=None
-            ),
-            Recipe(
-                name="Strawberry Cheesecake",
-                author="James Croft",
-                ingredients=[
-                    "For the crust:",
-                    "1 ½ cups graham cracker crumbs (vegan)",
-                    "5 tbsp melted coconut oil",
-                    "2 tbsp maple syrup",
-                    "For the filling:",
-                    "3 cups raw cashews (soaked overnight, drained)",
-                    "1 cup coconut cream",
-                    "¾ cup maple syrup",
-                    "¼ cup lemon juice",
-                    "1 tsp vanilla extract",
-                    "For the topping:",
-                    "2 cups fresh strawberries, sliced",
-                    "2 tbsp strawberry jam"
-                ],
-                steps=[
-                    "Preheat your oven to 350°F (175°C).",
-                    "For the crust, mix graham cracker crumbs, melted coconut oil, and maple syrup. Press firmly into the bottom of a springform pan.",
-                    "Bake the crust for 8-10 minutes, then let cool.",
-                    "For the filling, blend soaked cashews, coconut cream, maple syrup, lemon juice, and vanilla extract until completely smooth.",
-                    "Pour the filling over the cooled crust and spread evenly.",
-                    "Bake in a water bath for 25-30 minutes, then cool to room temperature before refrigerating for at least 4 hours.",
-                    "For the topping, mix sliced strawberries with strawberry jam and arrange them on top of the cheesecake before serving."
-                ],
-                embedding=None
-            ),
-            Recipe(
-                name="Vegan Banana Bread",
-                author="James Croft",
-                ingredients=[
-                    "3 overripe bananas, mashed",
-                    "1/3 cup melted coconut oil",
-                    "1 cup brown sugar",
-                    "1 tsp vanilla extract",
-                    "1 tsp baking soda",
-                    "Pinch of salt",
-                    "1 ½ cups all-purpose flour",
-                    "1/2 cup chopped walnuts (optional)"
-                ],
-                steps=[
-                    "Preheat your oven to 350°F (175°C) and grease a 9x5-inch loaf pan.",
-                    "In a large bowl, mix mashed bananas with melted coconut oil, brown sugar, and vanilla extract.",
-                    "Sprinkle in the baking soda and salt, stirring to combine.",
-                    "Gently fold in the flour and walnuts until just incorporated.",
-                    "Pour the batter into the loaf pan and smooth the top.",
-                    "Bake for 50-60 minutes or until a toothpick inserted in the center comes out clean.",
-                    "Allow the bread to cool in the pan for 10 minutes, then transfer to a wire rack."
-                ],
-                embedding=None
-            ),
-            Recipe(
-                name="Chicken Tikka Masala",
-                author="James Croft",
-                ingredients=[
-                    "For the chicken marinade:",
-                    "1 lb boneless, skinless chicken thighs, cut into bite-sized pieces",
-                    "1 cup plain yogurt",
-                    "2 tbsp lemon juice",
-                    "2 tsp ground cumin",
-                    "2 tsp paprika",
-                    "1 tsp ground cinnamon",
-                    "1 tsp ground cayenne pepper",
-                    "1 tsp ground black pepper",
-                    "1 tsp salt",
-                    "For the sauce:",
-                    "2 tbsp vegetable oil",
-                    "1 large onion, finely chopped",
-                    "3 cloves garlic, minced",
-                    "1 tbsp fresh ginger, grated",
-                    "1 tbsp garam masala",
-                    "1 tsp ground turmeric",
-                    "1 tsp ground coriander",
-                    "1 tsp ground cumin",
-                    "1 can (400g) crushed tomatoes",
-                    "1 cup coconut milk",
-                    "Salt and pepper to taste",
-                    "Fresh cilantro (for garnish)"
-                ],
-                steps=[
-                    "In a large bowl, combine chicken pieces with yogurt, lemon juice, and spices for the marinade. Cover and refrigerate for at least 1 hour.",
-                    "Heat vegetable oil in a large pan over medium heat. Add chopped onion, garlic, and ginger; sauté until soft and fragrant.",
-                    "Add garam masala, turmeric, coriander, and cumin to the pan; cook for 1-2 minutes to toast the spices.",
-                    "Stir in crushed tomatoes and coconut milk, then season with salt and pepper.",
-                    "Add marinated chicken to the sauce and simmer for 20-30 minutes until the chicken is cooked through.",
-                    "Serve the Chicken Tikka Masala over rice, garnished with fresh cilantro."
-                ],
-                embedding=None
-            ),
-            Recipe(
-                name="Vegetable Fried Rice",
-                author="James Croft",
-                ingredients=[
-                    "2 cups cooked rice, chilled",
-                    "1 cup mixed vegetables (peas, carrots, corn, etc.)",
-                    "2 eggs, beaten",
-                    "2 cloves garlic, minced",
-                    "2 tbsp soy sauce",
-                    "1 tbsp sesame oil",
-                    "1 tbsp vegetable oil",
-                    "Salt and pepper to taste",
-                    "Green onions (for garnish)"
-                ],
-                steps=[
-                    "Heat vegetable oil in a large pan or wok over medium heat. Add minced garlic and cook until fragrant.",
-                    "Push the garlic to the side of the pan and pour in the beaten eggs. Scramble the eggs until cooked through.",
-                    "Add mixed vegetables to the pan and stir-fry until heated through.",
-                    "Stir in the chilled rice, breaking up any clumps with a spatula.",
-                    "Drizzle soy sauce and sesame oil over the rice, then season with salt and pepper.",
-                    "Continue to stir-fry the rice until everything is well combined and heated through.",
-                    "Garnish with chopped green onions before serving."
-                ],
-                embedding=None
-            ),
-            Recipe(
-                name="Classic Chocolate Chip Cookies",
-                author="James Croft",
-                ingredients=[
-                    "1 cup unsalted butter, softened",
-                    "1 cup brown sugar",
-                    "½ cup granulated sugar",
-                    "2 large eggs",
-                    "1 tsp vanilla extract",
-                    "2 ½ cups all-purpose flour",
-                    "1 tsp baking soda",
-                    "½ tsp salt",
-                    "2 cups chocolate chips"
-                ],
-                steps=[
-                    "Preheat your oven to 375°F (190°C) and line a baking sheet with parchment paper.",
-                    "In a large bowl, cream together butter, brown sugar, and granulated sugar until light and fluffy.",
-                    "Beat in eggs one at a time, then stir in vanilla extract.",
-                    "In a separate bowl, whisk together flour, baking soda, and salt.",
-                    "Gradually add the dry ingredients to the wet ingredients, mixing until just combined.",
-                    "Fold in the chocolate chips.",
-                    "Drop spoonfuls of dough onto the prepared baking sheet and bake for 8-10 minutes or until golden brown.",
-                    "Let the cookies cool on the baking sheet for a few minutes before transferring to a wire rack to cool completely."
-                ],
-                embedding=None
-            ),
-            Recipe(
-                name="Scrambled Eggs with Spinach and Feta on Toast",
-                author="James Croft",
-                ingredients=[
-                    "4 large eggs",
-                    "1 cup baby spinach",
-                    "½ cup crumbled feta cheese",
-                    "4 slices seeded bread",
-                    "2 tbsp butter",
-                    "Salt and pepper to taste"
-                ],
-                steps=[
-                    "In a bowl, whisk together eggs, baby spinach, and crumbled feta cheese.",
-                    "Heat butter in a non-stick pan over medium heat. Pour in the egg mixture and cook, stirring occasionally, until the eggs are scrambled and cooked through.",
-                    "Toast the bread slices until golden brown and crispy.",
-                    "Divide the scrambled eggs between the toast slices and season with salt and pepper before serving."
-                ],
-                embedding=None
-            )
-        ]
+        self._embedding_pipeline = embedding_pipeline
+        # The recipes are loaded on first use, and shared with every other agent using the same store, so that agents are cheap to create.
+        if catalog is None:
+            catalog = RecipeCatalog(recipe_store) if recipe_store is not None else RecipeCatalog.shared()
+        self._catalog = catalog
+
+    @property
+    def embedding_pipeline(self) -> EmbeddingPipeline:
+        if self._embedding_pipeline is None:
+            self._embedding_pipeline = EmbeddingPipeline(
+                self.client, self.embedding_model_deployment, cache=_get_shared(("embedding_cache", get_data_path("embedding_cache.sqlite3")), lambda: EmbeddingCache(get_data_path("embedding_cache.sqlite3"))), async_client=self.async_client)
+        return self._embedding_pipeline
+
+    @property
+    def catalog(self) -> RecipeCatalog:
+        return self._catalog.load(self.embedding_pipeline)
+
+    @property
+    def recipes(self) -> List[RecipeRecord]:
+        return self.catalog.recipes
+
+    @property
+    def catalog_version(self) -> int:
+        return self.catalog.version
+
+    @traced
+    def _create_embedding(self, text: str) -> List[float]:
+        return self.embedding_pipeline.create_embedding(text)
 
-        self._load_recipes()
+    @traced
+    async def _acreate_embedding(self, text: str) -> List[float]:
+        return await self.embedding_pipeline.acreate_embedding(text)
 
-    def _load_recipes(self):
-        save_recipes = False
+    async def _acreate_recipe_embedding(self, recipe: Recipe) -> List[float]:
+        return await self._acreate_embedding(recipe.model_dump_markdown())
 
-        if os.path.exists("./recipes.json") and os.path.getsize("./recipes.json") > 0:
-            with open("./recipes.json", "r") as f:
-                self.recipes = []
-                for recipe in json.load(f):
-                    self.recipes.append(Recipe(**recipe))
+    @traced
+    async def _asearch_recipes(self, description: str, available_ingredients: List[str], count: int) -> np.ndarray:
+        """
+        Finds the recipes that best match a description with hybrid retrieval, fusing the vector similarity of the description with
+        BM25 over the recipes' names, ingredients and steps, and with how much of each recipe's ingredients are available.
 
-        for recipe in self.recipes:
-            if not recipe.embedding:
-                recipe.embedding = self._create_recipe_embedding(recipe)
-                save_recipes = True
+        Only recipes whose vector similarity exceeds `MIN_VECTOR_SCORE` match; the lexical scores only rank them.
+        When the description is mostly a list of ingredients, it is matched lexically only, without an embedding call, and recipes must instead reach `MIN_LEXICAL_SCORE`
+        and hold more than `MIN_LEXICAL_TERM_FRACTION` of the description's distinct words.
 
-        if save_recipes:
-            self._save_recipes()
+        Returns:
+            np.ndarray: The rows of the matching recipes, best match first.
+        """
 
-    def _create_recipe_embedding(self, recipe: Recipe):
-        return self._create_embedding(recipe.model_dump_markdown())
+        description_tokens = tokenize(description)
+        available_tokens = tokenize_all(available_ingredients)
 
-    def _save_recipes(self):
-        create_json_file("./recipes.json", self.recipes)
+        catalog = self.catalog
 
-    def _create_embedding(self, text: str) -> List[float]:
-        embedding_response = self.client.embeddings.create(
-            input=text,
-            model=self.embedding_model_deployment)
-        return embedding_response.data[0].embedding
+        with catalog.lock:
+            lexical_only = catalog.lexical_index.ingredient_fraction(
+                description_tokens) >= self.LEXICAL_ONLY_THRESHOLD
 
-    @skill
-    def find_recipes_by_description(self, description: str, available_ingredients: Optional[List[str]], count: Optional[int] = 1) -> str:
+        current_span().set_attribute("lexical_only", lexical_only)
+
+        if lexical_only:
+            record_stat("embedding_calls_saved")
+
+            with catalog.lock:
+                lexical_scores = self._scale_bm25(catalog, description_tokens, catalog.lexical_index.bm25(description_tokens))
+                rows = np.flatnonzero(lexical_scores >= self.MIN_LEXICAL_SCORE)
+                terms = catalog.lexical_index.count_terms(description_tokens, rows)
+                rows = rows[terms > self.MIN_LEXICAL_TERM_FRACTION * len(set(description_tokens))]
+                coverage = catalog.lexical_index.ingredient_coverage(description_tokens + available_tokens, rows)
+
+            scores = 0.6 * lexical_scores[rows] + 0.4 * coverage
+        else:
+            query_embedding = await self._acreate_embedding(
+                f"Find a recipe that best matches the following description:\n{description}")
+
+            # Only the recipes above the vector threshold can match, so the lexical scores are only computed for them, e.g. for the rows an ANN index selects.
+            with trace("recipe_index.scores", rows=len(catalog.recipe_index)) as span:
+                rows, vector_scores = catalog.recipe_index.scores_above(query_embedding, self.MIN_VECTOR_SCORE)
+                span.set_attribute("candidates", int(rows.shape[0]))
+
+            with catalog.lock:
+                # Rows added to the vector index while it was searched may not be in the lexical index yet.
+                keep = rows < len(catalog.lexical_index)
+                rows, vector_scores = rows[keep], vector_scores[keep]
+                lexical_scores = self._scale_bm25(catalog, description_tokens, catalog.lexical_index.bm25(description_tokens, rows))
+                coverage = catalog.lexical_index.ingredient_coverage(description_tokens + available_tokens, rows)
+
+            scores = 0.6 * vector_scores + 0.25 * lexical_scores + 0.15 * coverage
+
+        # Partial selection of the top-k candidates is O(n), only the k best are sorted.
+        if rows.size > count:
+            top = np.sort(np.argpartition(-scores, count - 1)[:count])
+            rows, scores = rows[top], scores[top]
+
+        return rows[np.argsort(-scores, kind="stable")]
+
+    @staticmethod
+    def _scale_bm25(catalog: RecipeCatalog, description_tokens: List[str], bm25_scores: np.ndarray) -> np.ndarray:
+        # BM25 scores are unbounded, so they are scaled by the score of a recipe holding each word of the description once, which doesn't depend on the other recipes.
+        reference = catalog.lexical_index.bm25_reference(description_tokens)
+        return np.minimum(bm25_scores / reference, 1.0) if reference > 0 else bm25_scores
+
+    @skill(memoize=True, ttl=3600, max_entries=256)
+    async def find_recipes_by_description(self, description: str, available_ingredients: Optional[List[str]], count: Optional[int] = 1) -> str:
         """
         Find a single recipe that best matches the given description.
 
@@ -366,21 +170,7 @@ class RecipeAgent(BaseAgent):
         - count: The number of recipes to return. Default is 1.
         """
 
-        query = f"""Find a recipe that best matches the following description:
-        {description}
-
-        Available ingredients: {", ".join(available_ingredients)}
-        """
-
-        query_embedding = self._create_embedding(query)
-
-        embeddings_matrix = np.array(
-            [recipe.embedding for recipe in self.recipes])
-
-        similarity_scores = np.dot(embeddings_matrix, query_embedding)
-        best_match_indices = np.argsort(similarity_scores)[::-1][:count]
-
-        filtered_indices = best_match_indices[similarity_scores[best_match_indices] > 0.5]
+        filtered_indices = await self._asearch_recipes(description, available_ingredients or [], count or 1)
 
         if filtered_indices.size > 0:
             best_matches = [self.recipes[i] for i in filtered_indices]
@@ -415,7 +205,7 @@ class RecipeAgent(BaseAgent):
         ], cls=CustomEncoder)
 
     @skill
-    def modify_recipe_if_not_vegan(self, recipe_name: str) -> str:
+    async def modify_recipe_if_not_vegan(self, recipe_name: str) -> str:
         """
         Modifies a known recipe to make it vegan-friendly, if it contains meat or dairy products.
 
@@ -423,10 +213,21 @@ class RecipeAgent(BaseAgent):
         - recipe_name: The name of the recipe to modify.
         """
 
-        recipe = next((recipe for recipe in self.recipes if recipe.name.lower(
-        ) == recipe_name.lower()), None)
+        recipe = self.catalog.find(recipe_name)
 
         if recipe:
+            # Vegan conversions are persisted and reused across runs, as each one otherwise adds another copy of the converted recipe to the catalog.
+            # They are keyed on the recipe the name resolves to, so that different spellings of its name share a conversion, and the converted recipe
+            # is looked up in the catalog again, so that a conversion that is no longer in the catalog, e.g. after its store was reset, is made again.
+            key = self.skill_cache.create_key({"name": recipe.name, "ingredients": list(recipe.ingredients), "steps": list(recipe.steps)})
+            hit, converted_name = self.skill_cache.get(self.VEGAN_CONVERSIONS, key)
+            converted = self.catalog.get(converted_name) if hit else None
+            current_span().set_attribute("cache_hit", converted is not None)
+
+            if converted is not None:
+                record_stat("skill_cache_hits")
+                return converted.model_dump_markdown()
+
             messages = [ChatCompletionSystemMessageParam(role="system", content=f"""You are an AI agent that helps with modifying an existing recipe to make it vegan-friendly.
                                                          ## On your ability to modify recipes
 
@@ -440,7 +241,7 @@ class RecipeAgent(BaseAgent):
                             role="user", content=recipe.model_dump_markdown())
                         ]
 
-            completion = self.client.beta.chat.completions.parse(
+            completion = await self.aparse_completion(
                 model=self.model_deployment,
                 messages=messages,
                 response_format=Recipe,
@@ -448,52 +249,65 @@ class RecipeAgent(BaseAgent):
                 top_p=0.3,
             )
 
-            if completion.choices[0].message.parsed:
-                vegan_recipe = completion.choices[0].message.parsed
-                vegan_recipe.embedding = self._create_recipe_embedding(
-                    vegan_recipe)
-                self.recipes.append(vegan_recipe)
-                self._save_recipes()
+            vegan_recipe = completion.choices[0].message.parsed
+
+            # The model returns an empty recipe for a recipe that can't be made vegan-friendly.
+            if vegan_recipe and vegan_recipe.ingredients and vegan_recipe.steps:
+                # A conversion that keeps the name of the original recipe is stored under a name of its own, so that it isn't mistaken for the original.
+                if RecipeNameIndex.normalize(vegan_recipe.name) == RecipeNameIndex.normalize(recipe.name) and not recipe.has_same_content(vegan_recipe):
+                    vegan_recipe.name = f"{recipe.name} (Vegan)"
 
-                return vegan_recipe.model_dump_markdown()
+                embedding = await self._acreate_recipe_embedding(vegan_recipe)
+                vegan_recipe.embedding = None
+
+                converted = self.catalog.add(vegan_recipe, embedding)
+                self.skill_cache.set(self.VEGAN_CONVERSIONS, key, converted.name, max_entries=1024, persist=True)
+                return converted.model_dump_markdown()
             else:
                 return f"Sorry, I couldn't modify the recipe {recipe_name} to be vegan-friendly."
 
         return f"Sorry, I couldn't find a recipe with the name {recipe_name}."
 
     @skill
-    def generate_shopping_list_from_recipe(self, recipe_name: str, available_ingredients: Optional[List[str]]) -> str:
+    async def generate_shopping_list_from_recipe(self, recipe_name: str, available_ingredients: Optional[List[str]], suggest_substitutions: Optional[bool] = False) -> str:
         """
         Generate a shopping list based on the ingredients required for a recipe and the available ingredients in the kitchen.
 
         Args:
         - recipe_name: The name of the recipe to generate a shopping list for.
         - available_ingredients: An optional list of ingredients that are available in the kitchen.
+        - suggest_substitutions: Whether to suggest substitutions from the available ingredients for the missing ingredients. Default is false.
         """
 
-        recipe = next((recipe for recipe in self.recipes if recipe.name.lower(
-        ) == recipe_name.lower()), None)
+        recipe = self.catalog.find(recipe_name)
 
         if recipe:
-            messages = [ChatCompletionSystemMessageParam(role="system", content=f"""You are an AI agent that helps generate a shopping list based on the ingredients required for a recipe and the available ingredients in the kitchen.
-                                                         ## On your ability to generate a shopping list
-
-                                                         - Compare the ingredients required for the recipe with the available ingredients in the kitchen.
-                                                         - If there are potential substitutions or alternatives for any ingredients, you should suggest them.
-                                                         - Identify the ingredients that are missing and need to be purchased.
-                                                         - Provide a list of the missing ingredients that need to be purchased.
-                                                         - If all the ingredients are available, you should return an empty shopping list.
+            missing, _ = compare_ingredients(
+                recipe.parsed_ingredients, parse_ingredients(available_ingredients or []))
+            shopping_list = self._format_shopping_list(recipe, missing)
+
+            if not suggest_substitutions or not missing:
+                return shopping_list
+
+            messages = [ChatCompletionSystemMessageParam(role="system", content=f"""You are an AI agent that helps suggest substitutions for the missing ingredients of a recipe.
+                                                         ## On your ability to suggest substitutions
+
+                                                         - For each missing ingredient on the shopping list, suggest a substitution from the available ingredients in the kitchen, if there is a suitable one.
+                                                         - Ensure that the substitutions retain the essence and flavor of the original recipe.
+                                                         - If there are no suitable substitutions, you should say so.
                                                          """),
                         ChatCompletionUserMessageParam(
                             role="user", content=[
                                 ChatCompletionContentPartTextParam(
-                                    type="text", content=recipe.model_dump_markdown()),
+                                    type="text", text=recipe.model_dump_markdown()),
                                 ChatCompletionContentPartTextParam(
-                                    type="text", content=f"""Available ingredients:\n\n{json.dumps(available_ingredients, cls=CustomEncoder)}""")
+                                    type="text", text=shopping_list),
+                                ChatCompletionContentPartTextParam(
+                                    type="text", text=f"""Available ingredients:\n\n{json.dumps(available_ingredients, cls=CustomEncoder)}""")
                             ])
                         ]
 
-            completion = self.client.chat.completions.create(
+            completion = await self.acreate_completion(
                 model=self.model_deployment,
                 messages=messages,
                 temperature=0.3,
@@ -501,14 +315,35 @@ class RecipeAgent(BaseAgent):
             )
 
             if completion.choices[0].message.content:
-                return completion.choices[0].message.content
-            else:
-                return f"Sorry, I couldn't generate a shopping list for the recipe {recipe_name}."
+                return f"{shopping_list}\n\n## Substitutions:\n{completion.choices[0].message.content}"
+
+            return shopping_list
 
         return f"Sorry, I couldn't find a recipe with the name {recipe_name}."
 
-    def process_query(self, messages: List[str]) -> ChatCompletionMessage:
-        execute_messages = [
+    @staticmethod
+    def _format_shopping_list(recipe: RecipeRecord, missing: List[Tuple[ParsedIngredient, Optional[float]]]) -> str:
+        if not missing:
+            return f"All the ingredients for {recipe.name} are available, so the shopping list is empty."
+
+        def _format(ingredient: ParsedIngredient, shortfall: Optional[float]) -> str:
+            if shortfall is None:
+                return f"- {ingredient.text}"
+            return f"- {format_quantity(shortfall, ingredient.unit)} more {ingredient.name} (the recipe needs {ingredient.text})"
+
+        required = [_format(*item) for item in missing if not item[0].optional]
+        optional = [_format(*item) for item in missing if item[0].optional]
+
+        shopping_list = f"# Shopping list: {recipe.name}\n" + "\n".join(required)
+        if optional:
+            shopping_list += "\n\n## Optional:\n" + "\n".join(optional)
+
+        return shopping_list
+
+    @functools.cached_property
+    def prompt_layout(self) -> PromptLayout:
+        # Built once per agent, on first use, so that the system prompt is byte-identical across calls and can be served from the provider's prompt cache.
+        return PromptLayout([
             ChatCompletionSystemMessageParam(
                 role="system",
                 content=f"""You are an agent that can help with cooking recipes.
@@ -529,13 +364,13 @@ class RecipeAgent(BaseAgent):
                     [f"- {skill['function']['name']}: {skill['function']['description']}" for skill in self.skills])}
                 """
             )
-        ]
-
-        execute_messages.extend([message for message in messages])
+        ])
 
-        function_responses = []
+    @traced
+    async def aprocess_query(self, messages: List[str], on_tool_results: Optional[Callable[[List[Any]], None]] = None) -> ChatCompletionMessage:
+        execute_messages = self.prompt_layout.build(messages)
 
-        completion = self.client.chat.completions.create(
+        completion = await self.acreate_completion(
             model=self.model_deployment,
             messages=execute_messages,
             temperature=0.3,
@@ -545,34 +380,93 @@ class RecipeAgent(BaseAgent):
         )
 
         message = completion.choices[0].message
+
+        # Without tool calls, the first completion is already the response.
+        if not message.tool_calls:
+            record_stat("round_trips_saved")
+            return ChatCompletionMessage(role="assistant", content=message.content)
+
         execute_messages.append(message)
 
-        if message.tool_calls:
-            print(f"Executing {len(message.tool_calls)} tool functions...")
+        print(f"Executing {len(message.tool_calls)} tool functions...")
 
-            for tool_call in message.tool_calls:
-                function_name = tool_call.function.name
-                function_args = json.loads(tool_call.function.arguments)
+        tool_messages = await self.acall_tools(message.tool_calls)
+        execute_messages.extend(tool_messages)
 
-                print(f"Executing tool function: {
-                      function_name} with arguments: {function_args}")
+        if on_tool_results is not None:
+            on_tool_results([message, *tool_messages])
 
-                response = self.call_function(function_name, **function_args)
+        # The tools are still sent, but not offered, so that the request shares its prefix with the tool-selection request.
+        completion = await self.acreate_completion(
+            model=self.model_deployment,
+            messages=execute_messages,
+            temperature=0.3,
+            top_p=0.3,
+            tools=self.skills,
+            tool_choice="none"
+        )
 
-                execute_messages.append({
-                    "tool_call_id": tool_call.id,
-                    "role": "tool",
-                    "name": function_name,
-                    "content": response
-                })
+        return ChatCompletionMessage(role="assistant", content=completion.choices[0].message.content)
 
-                function_responses.append(response)
+    @traced
+    async def astream_query(self, messages: List[str], on_tool_results: Optional[Callable[[List[Any]], None]] = None) -> AsyncIterator[StreamEvent]:
+        execute_messages = self.prompt_layout.build(messages)
+        semaphore = asyncio.Semaphore(self.max_tool_concurrency)
+        tool_tasks = []
 
-        completion = self.client.chat.completions.create(
+        async def _call(tool_call: ChatCompletionMessageToolCall) -> dict:
+            async with semaphore:
+                return await self.acall_tool(tool_call)
+
+        chunks = self.acreate_completion_stream(
             model=self.model_deployment,
             messages=execute_messages,
             temperature=0.3,
             top_p=0.3,
+            tools=self.skills,
+            tool_choice="auto"
         )
 
-        return ChatCompletionMessage(role="assistant", content=completion.choices[0].message.content)
+        try:
+            async for event in astream_message(chunks):
+                # Each tool is started as soon as its arguments are complete, while the rest of the completion is still streaming.
+                if event.type == "tool_call":
+                    tool_tasks.append(asyncio.ensure_future(_call(event.tool_call)))
+                    yield event
+                elif event.type == "message":
+                    message = event.message
+                else:
+                    yield event
+
+            # Without tool calls, the first completion is already the response.
+            if not message.tool_calls:
+                record_stat("round_trips_saved")
+                yield StreamEvent(type="message", message=ChatCompletionMessage(role="assistant", content=message.content))
+                return
+
+            execute_messages.append(message)
+
+            print(f"Executing {len(message.tool_calls)} tool functions...")
+
+            tool_messages = list(await asyncio.gather(*tool_tasks))
+            execute_messages.extend(tool_messages)
+        finally:
+            for task in tool_tasks:
+                task.cancel()
+
+        if on_tool_results is not None:
+            on_tool_results([message, *tool_messages])
+
+        chunks = self.acreate_completion_stream(
+            model=self.model_deployment,
+            messages=execute_messages,
+            temperature=0.3,
+            top_p=0.3,
+            tools=self.skills,
+            tool_choice="none"
+        )
+
+        async for event in astream_message(chunks):
+            if event.type == "message":
+                event.message = ChatCompletionMessage(role="assistant", content=event.message.content)
+            yield event
@@ -0,0 +1,190 @@
+from typing import Any, Dict, List, Optional
+import threading
+from helpers.embedding_pipeline import EmbeddingPipeline
+from helpers.ivf_index import IVFIndex
+from helpers.lexical_index import LexicalIndex
+from helpers.recipe_index import RecipeIndex
+from helpers.recipe_models import Recipe, RecipeRecord
+from helpers.recipe_name_index import RecipeNameIndex
+from helpers.recipe_store import RecipeStore
+from helpers.seed_recipes import create_seed_recipes
+from helpers.storage_helpers import get_data_path
+
+
+class RecipeCatalog:
+    """
+    A class representing the recipes agents work with, together with their vector, lexical and name indexes and the store they are persisted in.
+
+    A catalog is loaded once, on first use, and can be shared by any number of agents, so that creating an agent per request doesn't reload the recipes.
+    `RecipeCatalog.shared` returns the catalog shared by all agents using the same store.
+    All changes are made under the catalog's `lock`, as skills of one or more agents may run concurrently.
+
+    Recipes are held as compact `RecipeRecord`s, whose embeddings live only in the recipe index; `Recipe`s are converted to records when they are added.
+    The recipe index can also hold a float16 or int8 copy of the embeddings for faster scans, or use an ANN index such as an `IVFIndex`
+    for large catalogs (see `RecipeIndex`). Unquantized catalogs of at least `ann_threshold` recipes use an `IVFIndex` unless another ANN index is given,
+    as scanning every embedding then takes longer than a search should. An ANN index is saved with each snapshot of the store, and only rebuilt if it is missing or out of date.
+    """
+
+    # About where a scan of every 1536-dimension embedding, over 100 MB, takes longer than probing an IVF index and rescoring its candidates.
+    ANN_THRESHOLD = 20000
+
+    _shared: Dict[str, "RecipeCatalog"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, recipe_store: RecipeStore, quantization: str = "float32", ann_index: Optional[Any] = None, ann_threshold: Optional[int] = ANN_THRESHOLD):
+        self.recipe_store = recipe_store
+        self.ann_threshold = ann_threshold
+        self.lock = threading.RLock()
+        self.recipes: List[RecipeRecord] = []
+        self.recipe_index = RecipeIndex(quantization=quantization, ann_index=ann_index)
+        self.lexical_index = LexicalIndex()
+        self.recipe_name_index = RecipeNameIndex()
+        self._loaded = False
+
+    @classmethod
+    def shared(cls, prefix: str = get_data_path("recipes")) -> "RecipeCatalog":
+        with cls._shared_lock:
+            catalog = cls._shared.get(prefix)
+            if catalog is None:
+                catalog = cls._shared[prefix] = cls(RecipeStore(prefix))
+            return catalog
+
+    @property
+    def version(self) -> int:
+        # Recipes are only ever appended, so the number of recipes identifies the catalog.
+        return len(self.recipes)
+
+    def load(self, embedding_pipeline: EmbeddingPipeline) -> "RecipeCatalog":
+        """
+        Loads the recipes and builds their indexes, if they have not been loaded yet.
+
+        Args:
+            embedding_pipeline: The pipeline used to embed the recipes that don't have an embedding yet, i.e. when the catalog is first created or migrated.
+
+        Returns:
+            RecipeCatalog: The catalog.
+        """
+
+        if self._loaded:
+            return self
+
+        with self.lock:
+            if not self._loaded:
+                self._load(embedding_pipeline)
+                self._loaded = True
+
+        return self
+
+    def _load(self, embedding_pipeline: EmbeddingPipeline) -> None:
+        if self.recipe_store.exists():
+            recipes, embeddings = self.recipe_store.load()
+            # The store only holds recipes that were validated before they were saved, so records are created without validating them again.
+            self.recipes = [RecipeRecord.from_dict(recipe, row) for row, recipe in enumerate(recipes)]
+            self._select_ann_index(len(self.recipes))
+            self.recipe_index.attach(embeddings)
+            self._build_indexes()
+
+            ann_index = self.recipe_index.ann_index
+            if ann_index is not None and not ann_index.load(self.recipe_store.ann_index_path, self.recipe_index.matrix):
+                self._save_ann_index()
+            return
+
+        # One-shot migration from the legacy recipes.json, which stores embeddings inline as JSON floats.
+        if self.recipe_store.legacy_exists():
+            recipes = [Recipe(**recipe)
+                       for recipe in self.recipe_store.load_legacy()]
+        else:
+            recipes = create_seed_recipes()
+
+        missing = [recipe for recipe in recipes if not recipe.embedding]
+
+        if missing:
+            embeddings = embedding_pipeline.create_embeddings(
+                [recipe.model_dump_markdown() for recipe in missing])
+            for recipe, embedding in zip(missing, embeddings):
+                recipe.embedding = embedding
+
+        # The index now owns the embeddings, so the records don't hold on to copies of them.
+        self._select_ann_index(len(recipes))
+        self.recipe_index.build([recipe.embedding for recipe in recipes])
+        self.recipes = [RecipeRecord.from_recipe(recipe, row) for row, recipe in enumerate(recipes)]
+        self._build_indexes()
+
+        self.save()
+        self.recipe_store.retire_legacy()
+
+    def _select_ann_index(self, count: int) -> None:
+        recipe_index = self.recipe_index
+        if recipe_index.ann_index is None and not recipe_index.quantized and self.ann_threshold is not None and count >= self.ann_threshold:
+            recipe_index.ann_index = IVFIndex()
+
+    def _build_indexes(self) -> None:
+        self.lexical_index.build(self.recipes)
+        self.recipe_name_index.build(recipe.name for recipe in self.recipes)
+
+    def get(self, recipe_name: str) -> Optional[RecipeRecord]:
+        with self.lock:
+            row = self.recipe_name_index.get(recipe_name)
+            return self.recipes[row] if row is not None else None
+
+    def find(self, recipe_name: str) -> Optional[RecipeRecord]:
+        with self.lock:
+            row = self.recipe_name_index.find(recipe_name)
+            return self.recipes[row] if row is not None else None
+
+    def add(self, recipe: Recipe, embedding: List[float]) -> RecipeRecord:
+        """
+        Appends a recipe to the catalog, its indexes and its store.
+
+        Args:
+            recipe: The recipe to add.
+            embedding: The embedding of the recipe.
+
+        Returns:
+            RecipeRecord: The record of the added recipe, or of the recipe with the same name, ingredients and steps, which is kept instead of adding a duplicate.
+            A recipe with the name of a different recipe is added under a numbered name, e.g. "Eggs Benedict (2)", so that it can't be mistaken for it.
+        """
+
+        with self.lock:
+            name, number = recipe.name, 1
+            existing = self.recipe_name_index.get(name)
+
+            while existing is not None:
+                if self.recipes[existing].has_same_content(recipe):
+                    return self.recipes[existing]
+
+                number += 1
+                name = f"{recipe.name} ({number})"
+                existing = self.recipe_name_index.get(name)
+
+            if name != recipe.name:
+                recipe = recipe.model_copy(update={"name": name})
+
+            row = self.recipe_index.add(embedding)
+            record = RecipeRecord.from_recipe(recipe, row)
+            self.recipes.append(record)
+            self.lexical_index.add(record.name, record.ingredients, record.steps)
+            self.recipe_name_index.add(record.name)
+            self._save_recipe(row)
+
+        return record
+
+    def save(self) -> None:
+        # The index then reads the rows from the snapshot, rather than keeping the rows added since it was loaded in memory.
+        self.recipe_index.rebase(self.recipe_store.save(self.recipes, self.recipe_index.matrix))
+        self._save_ann_index()
+
+    def _save_ann_index(self) -> None:
+        ann_index = self.recipe_index.ann_index
+        if ann_index is None:
+            return
+
+        ann_index.update(self.recipe_index.matrix)
+        ann_index.save(self.recipe_store.ann_index_path, self.recipe_index.matrix)
+
+    def _save_recipe(self, row: int) -> None:
+        self.recipe_store.put(
+            row, self.recipes[row], self.recipe_index.matrix[row])
+
+        if self.recipe_store.needs_compaction:
+            self.save()
@@ -0,0 +1,527 @@
+from typing import Any, Optional, Sequence, Tuple, Union
+import numpy as np
+
+QUANTIZATIONS = ("float32", "float16", "int8")
+# Rows are dequantized in blocks, so that a scan only needs a float32 buffer small enough to stay in cache however large the index is.
+SCAN_BLOCK_ROWS = 256
+
+
+def quantize_vectors(vectors: np.ndarray, quantization: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Quantizes normalized vectors for approximate scoring with `score_quantized`.
+
+    Int8 rows are scaled by their largest component, so each row has its own scale and rows can be quantized independently of each other.
+
+    Args:
+        vectors: The (count, dimensions) matrix of normalized vectors.
+        quantization: "float32", "float16" or "int8".
+
+    Returns:
+        Tuple[np.ndarray, Optional[np.ndarray]]: The quantized rows, and the scale of each row for int8, otherwise None.
+    """
+
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(
+            f"Unknown quantization {quantization}, expected one of {', '.join(QUANTIZATIONS)}.")
+
+    if quantization == "float32":
+        return np.asarray(vectors, dtype=np.float32), None
+    if quantization == "float16":
+        return np.asarray(vectors).astype(np.float16), None
+
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    quantized = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def score_quantized(quantized: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the approximate cosine similarity of a normalized query with quantized rows.
+
+    Args:
+        quantized: The quantized rows, as returned by `quantize_vectors`.
+        scales: The scale of each row for int8, otherwise None.
+        query: The normalized float32 query.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The approximate score of each row and the largest error of each score,
+        so that a row's exact score is within its error of its approximate score.
+    """
+
+    count = quantized.shape[0]
+
+    if quantized.dtype == np.float32:
+        return quantized @ query, np.zeros(count, dtype=np.float32)
+
+    scores = np.empty(count, dtype=np.float32)
+    for start in range(0, count, SCAN_BLOCK_ROWS):
+        stop = min(start + SCAN_BLOCK_ROWS, count)
+        scores[start:stop] = quantized[start:stop].astype(np.float32) @ query
+
+    query_norm = float(np.abs(query).sum())
+
+    if quantized.dtype == np.float16:
+        # Rounding to float16 changes each component by at most 2^-11 of its value (or 2^-25 for the smallest components),
+        # so, as both vectors are normalized, the score changes by at most 2^-11 plus 2^-25 times the L1 norm of the query.
+        return scores, np.full(count, 2 ** -11 + 2 ** -25 * query_norm, dtype=np.float32)
+
+    # Rounding to int8 changes each component by at most half a step of the row's scale.
+    scores *= scales
+    return scores, scales / 2 * query_norm
+
+
+class StackedRows:
+    """
+    A class representing a read-only matrix made of the rows of a base matrix followed by the rows of a second one, without copying either,
+    e.g. the rows of a memory-mapped store followed by the rows added to an index since the store was loaded.
+
+    It supports what readers of `RecipeIndex.matrix` need: `shape`, `dtype`, `ndim`, `len()`, indexing rows with an integer, a slice or an array of integers,
+    and multiplying by a vector. Only the rows that are read are copied.
+    """
+
+    __slots__ = ("base", "appended")
+
+    def __init__(self, base: np.ndarray, appended: np.ndarray):
+        self.base = base
+        self.appended = appended
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.base.shape[0] + self.appended.shape[0], self.base.shape[1]
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.base.dtype
+
+    @property
+    def ndim(self) -> int:
+        return 2
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, key: Any) -> np.ndarray:
+        count, split = len(self), self.base.shape[0]
+
+        if isinstance(key, (int, np.integer)):
+            row = int(key) + count if key < 0 else int(key)
+            return self.base[row] if row < split else self.appended[row - split]
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(count)
+            if step == 1:
+                if stop <= split:
+                    return self.base[start:stop]
+                if start >= split:
+                    return self.appended[start - split:stop - split]
+                return np.concatenate((self.base[start:split], self.appended[:stop - split]))
+            key = np.arange(start, stop, step)
+
+        rows = np.asarray(key)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        rows = np.where(rows < 0, rows + count, rows)
+
+        in_base = rows < split
+        result = np.empty((rows.shape[0], self.base.shape[1]), dtype=self.dtype)
+        result[in_base] = self.base[rows[in_base]]
+        result[~in_base] = self.appended[rows[~in_base] - split]
+        return result
+
+    def __matmul__(self, other: np.ndarray) -> np.ndarray:
+        return np.concatenate((self.base @ other, self.appended @ other))
+
+    def __array__(self, dtype: Any = None, copy: Any = None) -> np.ndarray:
+        matrix = np.concatenate((self.base, self.appended))
+        return matrix.astype(dtype, copy=False) if dtype is not None else matrix
+
+
+class RecipeIndex:
+    """
+    A class representing an in-memory vector index over recipe embeddings.
+
+    Embeddings are held in a single contiguous float32 matrix, normalized on insert so that the dot product with a normalized query is the cosine similarity.
+    Row `i` of the index always corresponds to the recipe at position `i` in the owning agent's recipe list.
+
+    With `quantization` set to "float16" or "int8", the index also holds a quantized copy of the matrix, which is half or a quarter of its size,
+    and searches in two stages: every row is scored against the quantized copy, then a shortlist is rescored exactly against the float32 matrix.
+    When the float32 matrix is a memory-mapped store, only the shortlisted rows of it are read.
+
+    A matrix attached with `attach`, e.g. a read-only `np.memmap`, is never copied: embeddings added later are held in a separate in-memory buffer,
+    searched alongside it, until `rebase` swaps both for a snapshot that holds every row.
+
+    With an `ann_index`, e.g. an `IVFIndex`, the first stage only scores the rows the ANN index selects for the query, instead of every row.
+    The ANN index needs `reset()`, `update(matrix)`, which indexes any rows it doesn't have yet, `probe(query)`,
+    which returns the rows it selects with their approximate scores and errors, and `__len__`. It holds its own quantized copies of the rows,
+    so the index itself must not be quantized.
+    """
+
+    QUANTIZATIONS = QUANTIZATIONS
+
+    def __init__(self, initial_capacity: int = 64, quantization: str = "float32", rescore_factor: int = 4, ann_index: Optional[Any] = None):
+        if quantization not in self.QUANTIZATIONS:
+            raise ValueError(
+                f"Unknown quantization {quantization}, expected one of {', '.join(self.QUANTIZATIONS)}.")
+        if ann_index is not None and quantization != "float32":
+            raise ValueError(
+                "An index with an ANN index can't be quantized, quantize the ANN index instead.")
+
+        self.dimensions: Optional[int] = None
+        self.quantization = quantization
+        self.rescore_factor = max(1, rescore_factor)
+        self.ann_index = ann_index
+        self._initial_capacity = max(1, initial_capacity)
+        # The attached read-only rows, if any, and the in-memory rows, which follow them.
+        self._base: Optional[np.ndarray] = None
+        self._matrix: Optional[np.ndarray] = None
+        self._quantized: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def matrix(self) -> Union[np.ndarray, StackedRows]:
+        """
+        Gets a read-only view of the populated rows of the normalized embedding matrix.
+        If embeddings were added to an attached matrix, the view is a `StackedRows` over the attached matrix and the added rows.
+        """
+
+        if self._size == 0:
+            return np.empty((0, self.dimensions or 0), dtype=np.float32)
+
+        rows = self._rows()
+        if isinstance(rows, StackedRows):
+            return rows
+
+        view = rows[:self._size]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def _offset(self) -> int:
+        return self._base.shape[0] if self._base is not None else 0
+
+    def _rows(self) -> Union[np.ndarray, StackedRows]:
+        appended = self._size - self._offset
+
+        if self._base is None:
+            return self._matrix[:appended]
+        if appended == 0:
+            return self._base
+
+        return StackedRows(self._base, self._matrix[:appended])
+
+    @property
+    def quantized(self) -> bool:
+        return self.quantization != "float32"
+
+    @property
+    def approximate(self) -> bool:
+        """
+        Gets whether searches score rows approximately before rescoring a shortlist, i.e. whether the index is quantized or has an ANN index.
+        """
+
+        return self.quantized or self.ann_index is not None
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Gets the size in bytes of the populated rows of the matrix a search scans, i.e. of the quantized copy if there is one.
+        """
+
+        if self._size == 0:
+            return 0
+        if not self.quantized:
+            return self._size * self.dimensions * 4
+
+        scales = self._scales[:self._size].nbytes if self._scales is not None else 0
+        return self._quantized[:self._size].nbytes + scales
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def build(self, embeddings: Sequence[Sequence[float]]) -> None:
+        """
+        Replaces the contents of the index with the given embeddings.
+
+        Args:
+            embeddings: The embeddings to index, in recipe order.
+        """
+
+        matrix = np.ascontiguousarray(self.normalize(np.asarray(embeddings, dtype=np.float32)))
+
+        self._base = None
+
+        if matrix.ndim != 2 or matrix.shape[0] == 0:
+            self.dimensions = None
+            self._matrix = None
+            self._size = 0
+            self._quantize_all()
+            return
+
+        self.dimensions = matrix.shape[1]
+        self._matrix = matrix
+        self._size = matrix.shape[0]
+        self._quantize_all()
+
+    def attach(self, matrix: np.ndarray) -> None:
+        """
+        Uses an already normalized float32 matrix as the contents of the index without copying it, e.g. a read-only `np.memmap` from a `RecipeStore`.
+        The matrix is never written to or copied; embeddings added later are held in memory after it.
+
+        Args:
+            matrix: The (count, dimensions) matrix of normalized embeddings, in recipe order.
+        """
+
+        if matrix.dtype != np.float32 or matrix.ndim != 2:
+            raise ValueError("Expected a two-dimensional float32 matrix.")
+
+        self.dimensions = matrix.shape[1] if matrix.shape[0] > 0 else None
+        self._base = matrix if matrix.shape[0] > 0 else None
+        self._matrix = None
+        self._size = matrix.shape[0]
+        self._quantize_all()
+
+    def rebase(self, matrix: np.ndarray) -> None:
+        """
+        Replaces the rows of the index with a read-only matrix holding the same rows, e.g. the memmap of a snapshot they were just saved to,
+        so that the rows added since the index was built or attached are no longer held in memory. The quantized copy and the ANN index are kept as they are.
+
+        Args:
+            matrix: The (count, dimensions) matrix of the rows of the index, in the same order.
+        """
+
+        if matrix.shape[0] != self._size or (self._size > 0 and matrix.shape[1] != self.dimensions):
+            raise ValueError(
+                f"Expected a {self._size} x {self.dimensions} matrix, got {matrix.shape[0]} x {matrix.shape[1]}.")
+
+        self._base = matrix if self._size > 0 else None
+        self._matrix = None
+
+    def add(self, embedding: Sequence[float]) -> int:
+        """
+        Appends a single embedding to the index, growing the in-memory matrix geometrically so that appends are amortized O(d).
+        An attached matrix is left as it is, and the embedding is held in memory after it. An ANN index indexes the new row on the next search.
+
+        Args:
+            embedding: The embedding to add.
+
+        Returns:
+            int: The row of the newly added embedding.
+        """
+
+        vector = self.normalize(np.asarray(embedding, dtype=np.float32).reshape(1, -1))
+
+        if self._size == 0:
+            self.dimensions = vector.shape[1]
+        elif vector.shape[1] != self.dimensions:
+            raise ValueError(
+                f"Embedding has {vector.shape[1]} dimensions, expected {self.dimensions}.")
+
+        appended = self._size - self._offset
+
+        if self._matrix is None or appended == self._matrix.shape[0]:
+            capacity = max(appended * 2, self._initial_capacity)
+            grown = np.empty((capacity, self.dimensions), dtype=np.float32)
+            if self._matrix is not None:
+                grown[:appended] = self._matrix[:appended]
+            self._matrix = grown
+
+        self._matrix[appended] = vector[0]
+
+        if self.quantized:
+            capacity = self._offset + self._matrix.shape[0]
+            if self._quantized is None or self._quantized.shape[0] < capacity:
+                self._grow_quantized(capacity)
+            quantized, scales = quantize_vectors(vector, self.quantization)
+            self._quantized[self._size] = quantized[0]
+            if scales is not None:
+                self._scales[self._size] = scales[0]
+
+        self._size += 1
+        return self._size - 1
+
+    def _quantize_all(self) -> None:
+        self._quantized = None
+        self._scales = None
+
+        if self.ann_index is not None:
+            self.ann_index.reset()
+
+        if not self.quantized or self._size == 0:
+            return
+
+        rows = self._rows()
+        self._grow_quantized(self._size)
+        for start in range(0, self._size, SCAN_BLOCK_ROWS):
+            stop = min(start + SCAN_BLOCK_ROWS, self._size)
+            quantized, scales = quantize_vectors(np.asarray(rows[start:stop]), self.quantization)
+            self._quantized[start:stop] = quantized
+            if scales is not None:
+                self._scales[start:stop] = scales
+
+    def _grow_quantized(self, capacity: int) -> None:
+        dtype = np.float16 if self.quantization == "float16" else np.int8
+        grown = np.empty((capacity, self.dimensions), dtype=dtype)
+        if self._quantized is not None:
+            grown[:self._size] = self._quantized[:self._size]
+        self._quantized = grown
+
+        if self.quantization == "int8":
+            scales = np.empty(capacity, dtype=np.float32)
+            if self._scales is not None:
+                scales[:self._size] = self._scales[:self._size]
+            self._scales = scales
+
+    def approximate_scores(self, query_embedding: Sequence[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Computes the cosine similarity of the query embedding with every row from the quantized copy of the matrix.
+
+        Args:
+            query_embedding: The embedding of the query.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The approximate score of each row, in row order, and the largest error of each score,
+            so that a row's exact score is within its error of its approximate score.
+        """
+
+        if self._size == 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.float32)
+
+        query = self.normalize(np.asarray(query_embedding, dtype=np.float32))
+
+        if not self.quantized:
+            return self._rows() @ query, np.zeros(self._size, dtype=np.float32)
+
+        scales = self._scales[:self._size] if self._scales is not None else None
+        return score_quantized(self._quantized[:self._size], scales, query)
+
+    def _probe(self, query: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self.ann_index is None:
+            scores, errors = self.approximate_scores(query)
+            return np.arange(self._size), scores, errors
+
+        if len(self.ann_index) < self._size:
+            self.ann_index.update(self.matrix)
+
+        return self.ann_index.probe(query)
+
+    def scores(self, query_embedding: Sequence[float], min_score: Optional[float] = None, shortlist: int = 0) -> np.ndarray:
+        """
+        Computes the cosine similarity of the query embedding with every row.
+
+        In a quantized index, the rows that may exceed `min_score` and the `shortlist` best rows are rescored exactly, and every other row keeps its approximate score.
+        Without either, every row is rescored. With an ANN index, the same applies to the rows it selects, and every other row scores 0.
+
+        Args:
+            query_embedding: The embedding of the query.
+            min_score: An optional minimum cosine similarity; rows that may exceed it are scored exactly, so that a threshold on the scores is honored exactly.
+            shortlist: The number of best rows to score exactly, e.g. the number of rows a caller returns.
+
+        Returns:
+            np.ndarray: The score of each row, in row order.
+        """
+
+        if self._size == 0:
+            return np.empty(0, dtype=np.float32)
+
+        query = self.normalize(np.asarray(query_embedding, dtype=np.float32))
+
+        if not self.approximate or (self.ann_index is None and min_score is None and shortlist <= 0):
+            return self._rows() @ query
+
+        rows, approximate, errors = self._probe(query)
+
+        rescore = np.flatnonzero(approximate + errors > min_score) if min_score is not None else np.empty(0, dtype=np.int64)
+        if shortlist > 0:
+            rescore = np.union1d(rescore, self._top_rows(approximate, shortlist))
+        rescore = rows[rescore]
+
+        scores = np.zeros(self._size, dtype=np.float32)
+        scores[rows] = approximate
+        scores[rescore] = self._rows()[rescore] @ query
+        return scores
+
+    def scores_above(self, query_embedding: Sequence[float], min_score: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the rows whose cosine similarity with the query embedding exceeds a minimum, with their exact scores.
+
+        Unlike `scores`, only the matching rows are returned, so that with an ANN index the cost depends on the rows it selects rather than on the size of the index.
+        In a quantized index or with an ANN index, only the rows that may exceed `min_score` by their approximate scores are rescored exactly.
+
+        Args:
+            query_embedding: The embedding of the query.
+            min_score: The minimum cosine similarity, which the returned rows exceed.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The matching rows, in row order, and their scores.
+        """
+
+        if self._size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = self.normalize(np.asarray(query_embedding, dtype=np.float32))
+
+        if not self.approximate:
+            scores = self._rows() @ query
+            rows = np.flatnonzero(scores > min_score)
+            return rows, scores[rows]
+
+        rows, approximate, errors = self._probe(query)
+        rows = np.sort(rows[approximate + errors > min_score])
+        scores = self._rows()[rows] @ query
+
+        keep = scores > min_score
+        return rows[keep], scores[keep]
+
+    @staticmethod
+    def _top_rows(scores: np.ndarray, count: int) -> np.ndarray:
+        if count >= scores.shape[0]:
+            return np.arange(scores.shape[0])
+
+        # Partial selection of the top-k rows is O(n), only the k candidates are sorted.
+        return np.argpartition(-scores, count - 1)[:count]
+
+    def search(self, query_embedding: Sequence[float], count: int = 1, min_score: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the rows most similar to the query embedding.
+
+        Args:
+            query_embedding: The embedding of the query.
+            count: The maximum number of rows to return.
+            min_score: An optional minimum cosine similarity that returned rows must exceed.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The matching row indices and their scores, ordered by descending similarity.
+        """
+
+        if self._size == 0 or count <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        if self.approximate:
+            # The best rows by their approximate scores are rescored exactly, and the best of them by their exact scores are returned.
+            query = self.normalize(np.asarray(query_embedding, dtype=np.float32))
+            rows, approximate, _ = self._probe(query)
+            shortlist = np.sort(rows[self._top_rows(approximate, count * self.rescore_factor)])
+            exact = self._rows()[shortlist] @ query
+            candidates = self._top_rows(exact, count)
+            order = candidates[np.argsort(-exact[candidates], kind="stable")]
+            indices, top_scores = shortlist[order], exact[order]
+        else:
+            scores = self.scores(query_embedding)
+            candidates = self._top_rows(scores, count)
+            indices = candidates[np.argsort(-scores[candidates], kind="stable")]
+            top_scores = scores[indices]
+
+        if min_score is not None:
+            keep = top_scores > min_score
+            indices, top_scores = indices[keep], top_scores[keep]
+
+        return indices, top_scores
@@ -0,0 +1,84 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from pydantic import BaseModel, Field
+import sys
+from helpers.ingredient_parser import ParsedIngredient, parse_ingredients
+
+
+class Recipe(BaseModel):
+    name: str = Field(description="The name of the recipe.")
+    author: Optional[str] = Field(
+        description="The author of the recipe, if available.")
+    ingredients: List[str] = Field(
+        description="The ingredients required for the recipe.")
+    steps: List[str] = Field(description="The steps to prepare the recipe.")
+    embedding: Optional[List[float]] = Field(
+        description="The embedding of the recipe for similarity matching. This field must be left as an empty array.")
+
+    def model_dump_markdown(self):
+        return f"""
+        # Recipe: {self.name}
+        ## Ingredients:
+        {"".join([f"- {ingredient}\n" for ingredient in self.ingredients])}
+        ## Steps:
+        {"".join([f"{i+1}. {step}\n" for i, step in enumerate(self.steps)])}
+        """
+
+
+def _intern_all(texts: Iterable[str]) -> Tuple[str, ...]:
+    return tuple(sys.intern(text) for text in texts)
+
+
+class RecipeRecord:
+    """
+    A class representing a recipe held in a `RecipeCatalog`.
+
+    `Recipe` remains the schema of the recipes agents return and models produce; records are the compact form the catalog keeps in memory.
+    Records have no per-instance dictionary, their ingredients and steps are tuples of interned strings, so that ingredients shared by many recipes
+    (e.g. "Salt and pepper to taste") are stored once, and their embedding is only referenced by `row` in the catalog's embedding matrix.
+    """
+
+    __slots__ = ("name", "author", "ingredients", "steps", "row", "_parsed_ingredients")
+
+    def __init__(self, name: str, author: Optional[str], ingredients: Iterable[str], steps: Iterable[str], row: int):
+        self.name = name
+        self.author = sys.intern(author) if author else None
+        self.ingredients = _intern_all(ingredients)
+        self.steps = _intern_all(steps)
+        self.row = row
+        self._parsed_ingredients: Optional[List[ParsedIngredient]] = None
+
+    @classmethod
+    def from_recipe(cls, recipe: Recipe, row: int) -> "RecipeRecord":
+        return cls(recipe.name, recipe.author, recipe.ingredients, recipe.steps, row)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], row: int) -> "RecipeRecord":
+        return cls(data["name"], data.get("author"), data.get("ingredients", ()), data.get("steps", ()), row)
+
+    def to_recipe(self) -> Recipe:
+        # Records are only created from recipes that were already validated, so the recipe is constructed without validating it again.
+        return Recipe.model_construct(name=self.name, author=self.author, ingredients=list(self.ingredients),
+                                      steps=list(self.steps), embedding=None)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"name": self.name, "author": self.author, "ingredients": list(self.ingredients), "steps": list(self.steps)}
+
+    def has_same_content(self, recipe: Recipe) -> bool:
+        """
+        Gets whether a recipe has the same ingredients and steps as the record, e.g. to tell a duplicate from another recipe with the same name.
+        """
+
+        return self.ingredients == tuple(recipe.ingredients) and self.steps == tuple(recipe.steps)
+
+    @property
+    def parsed_ingredients(self) -> List[ParsedIngredient]:
+        """
+        Gets the parsed ingredients of the recipe. They are parsed once, on first use.
+        """
+
+        if self._parsed_ingredients is None:
+            self._parsed_ingredients = parse_ingredients(self.ingredients)
+        return self._parsed_ingredients
+
+    def model_dump_markdown(self) -> str:
+        return self.to_recipe().model_dump_markdown()
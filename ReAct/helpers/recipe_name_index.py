@@ -0,0 +1,103 @@
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set
+import re
+
+
+class RecipeNameIndex:
+    """
+    A class representing an index of recipe names, for looking up the recipe a model refers to by name.
+
+    Names are normalized (case, punctuation and whitespace) and looked up in a dictionary in O(1).
+    Names that don't match exactly, e.g. "Spaghetti Bolognaise" for "Spaghetti Bolognese", fall back to the most similar name by character trigrams,
+    which only visits the names that share a trigram with the query.
+
+    Row `i` of the index always corresponds to the recipe at position `i` in the owning agent's recipe list.
+    """
+
+    def __init__(self, min_similarity: float = 0.5):
+        self.min_similarity = min_similarity
+        self._reset()
+
+    def _reset(self) -> None:
+        self._rows: Dict[str, int] = {}
+        self._trigram_postings: Dict[str, Set[int]] = {}
+        self._trigram_counts: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._trigram_counts)
+
+    @staticmethod
+    def normalize(name: str) -> str:
+        return " ".join(re.findall(r"[a-z0-9]+", name.lower()))
+
+    @staticmethod
+    def trigrams(name: str) -> Set[str]:
+        padded = f"  {name} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def build(self, names: Iterable[str]) -> None:
+        """
+        Replaces the contents of the index with the given names.
+
+        Args:
+            names: The recipe names to index, in recipe order.
+        """
+
+        self._reset()
+
+        for name in names:
+            self.add(name)
+
+    def add(self, name: str) -> int:
+        """
+        Appends a single recipe name to the index. If several recipes share a name, exact lookups return the first of them.
+
+        Returns:
+            int: The row of the newly added name.
+        """
+
+        row = len(self._trigram_counts)
+        normalized = self.normalize(name)
+        trigrams = self.trigrams(normalized)
+
+        self._rows.setdefault(normalized, row)
+        for trigram in trigrams:
+            self._trigram_postings.setdefault(trigram, set()).add(row)
+        self._trigram_counts.append(len(trigrams))
+
+        return row
+
+    def get(self, name: str) -> Optional[int]:
+        """
+        Gets the row of the recipe with exactly the given name, ignoring case, punctuation and whitespace.
+        """
+
+        return self._rows.get(self.normalize(name))
+
+    def find(self, name: str) -> Optional[int]:
+        """
+        Finds the row of the recipe with the given name, or with the most similar name.
+
+        Args:
+            name: The name of the recipe.
+
+        Returns:
+            Optional[int]: The row of the recipe, or None if no name is at least `min_similarity` similar (Dice coefficient of trigrams).
+        """
+
+        normalized = self.normalize(name)
+
+        row = self._rows.get(normalized)
+        if row is not None:
+            return row
+
+        trigrams = self.trigrams(normalized)
+        shared = Counter(row for trigram in trigrams for row in self._trigram_postings.get(trigram, ()))
+
+        best_row, best_similarity = None, 0.0
+        for row, count in shared.items():
+            similarity = 2 * count / (len(trigrams) + self._trigram_counts[row])
+            if similarity > best_similarity or (similarity == best_similarity and best_row is not None and row < best_row):
+                best_row, best_similarity = row, similarity
+
+        return best_row if best_similarity >= self.min_similarity else None
@@ -0,0 +1,201 @@
+from typing import Any, Dict, List, Tuple
+import base64
+import json
+import os
+import numpy as np
+from helpers.recipe_models import RecipeRecord
+from helpers.storage_helpers import append_json_line, atomic_write, create_json_file, get_data_path, read_json_lines, write_file_at
+
+
+class RecipeStore:
+    """
+    A class representing the on-disk recipe catalog, with recipe metadata kept separate from the embeddings.
+
+    - `{prefix}.meta.json` holds the recipe metadata, the embedding dimensions and the number of rows.
+    - `{prefix}.embeddings.f32` holds the normalized embeddings as a raw, row-major float32 matrix, opened with `np.memmap` so that loading does not copy or parse it.
+
+    - `{prefix}.journal.jsonl` is an append-only log of recipes added or modified since the last snapshot.
+    - `{prefix}.ann.npz` optionally holds an approximate nearest-neighbour index over the embeddings, saved by the owning `RecipeCatalog`.
+
+    Row `i` of the embeddings file belongs to recipe `i` of the metadata.
+
+    `put` costs O(1) I/O: a single line holding the recipe and its embedding is appended to the journal, which is what commits the change,
+    and only then is the embedding row written in place in the embeddings file. `load` replays the journal, writing the embedding of each entry to its row again,
+    so a row is never changed before the change is committed. `save` writes a full snapshot with write-then-rename semantics and truncates the journal.
+    Replaying journal entries is idempotent, so a crash at any point leaves the store loadable with, at worst, the last uncommitted change missing.
+    """
+
+    FORMAT_VERSION = 1
+    # Snapshots are written in blocks of rows, so that saving an index whose rows are split between a memmap and memory doesn't copy all of them.
+    WRITE_BLOCK_ROWS = 8192
+
+    def __init__(self, prefix: str = get_data_path("recipes"), compact_threshold: int = 256):
+        self.prefix = prefix
+        self.meta_path = f"{prefix}.meta.json"
+        self.embeddings_path = f"{prefix}.embeddings.f32"
+        self.journal_path = f"{prefix}.journal.jsonl"
+        self.ann_index_path = f"{prefix}.ann.npz"
+        self.legacy_path = f"{prefix}.json"
+        self.compact_threshold = compact_threshold
+        self.journal_entries = 0
+        self._dimensions = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.meta_path) and os.path.exists(self.embeddings_path)
+
+    def legacy_exists(self) -> bool:
+        return os.path.exists(self.legacy_path) and os.path.getsize(self.legacy_path) > 0
+
+    def load(self) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+        """
+        Loads the recipe metadata and memory-maps the embedding matrix.
+
+        Returns:
+            Tuple[List[Dict[str, Any]], np.ndarray]: The metadata of each recipe, and a read-only (count, dimensions) float32 memmap of their embeddings.
+        """
+
+        with open(self.meta_path, "r") as f:
+            meta = json.load(f)
+
+        recipes = meta["recipes"][:meta["count"]]
+        dimensions = meta["dimensions"]
+        journal = read_json_lines(self.journal_path)
+
+        committed = []
+
+        for entry in journal:
+            row = entry["row"]
+            if row < len(recipes):
+                recipes[row] = entry["recipe"]
+            elif row == len(recipes):
+                recipes.append(entry["recipe"])
+            else:
+                break
+
+            dimensions = dimensions or entry.get("dimensions", 0)
+            committed.append(entry)
+
+        count = len(recipes)
+        self.journal_entries = len(journal)
+        self._dimensions = dimensions
+
+        self._replay(committed)
+
+        expected_size = count * dimensions * np.dtype(np.float32).itemsize
+        if os.path.getsize(self.embeddings_path) < expected_size:
+            raise ValueError(
+                f"{self.embeddings_path} is smaller than the {count} x {dimensions} embeddings described by {self.meta_path}.")
+
+        return recipes, self._map_embeddings(count, dimensions)
+
+    def _map_embeddings(self, count: int, dimensions: int) -> np.ndarray:
+        if count == 0:
+            return np.empty((0, dimensions), dtype=np.float32)
+
+        return np.memmap(self.embeddings_path, dtype=np.float32,
+                         mode="r", shape=(count, dimensions))
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self.journal_entries >= self.compact_threshold
+
+    def put(self, row: int, recipe: RecipeRecord, embedding: np.ndarray) -> None:
+        """
+        Records a new or modified recipe without rewriting the catalog.
+
+        Args:
+            row: The row of the recipe; either an existing row to modify, or the next row to append.
+            recipe: The recipe metadata.
+            embedding: The normalized embedding of the recipe.
+        """
+
+        vector = np.ascontiguousarray(embedding, dtype=np.float32).reshape(-1)
+
+        if self._dimensions is None:
+            with open(self.meta_path, "r") as f:
+                self._dimensions = json.load(f)["dimensions"]
+
+        if self._dimensions and vector.shape[0] != self._dimensions:
+            raise ValueError(
+                f"Embedding has {vector.shape[0]} dimensions, expected {self._dimensions}.")
+
+        # The entry is committed before the row is written, so that a crash in between leaves the row to be written again by `load`,
+        # rather than the previous metadata of the row next to its new embedding.
+        append_json_line(self.journal_path, {
+            "row": row,
+            "dimensions": int(vector.shape[0]),
+            "recipe": recipe.to_dict(),
+            "embedding": base64.b64encode(vector.tobytes()).decode("ascii"),
+        })
+        write_file_at(self.embeddings_path, row * vector.nbytes, vector.tobytes())
+
+        self._dimensions = vector.shape[0]
+        self.journal_entries += 1
+
+    def _replay(self, entries: List[Dict[str, Any]]) -> None:
+        # Entries written before embeddings were journaled have no embedding, as their row was written before they were committed.
+        entries = [entry for entry in entries if entry.get("embedding")]
+        if not entries:
+            return
+
+        with open(self.embeddings_path, "r+b") as f:
+            for entry in entries:
+                data = base64.b64decode(entry["embedding"])
+                f.seek(entry["row"] * len(data))
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save(self, recipes: List[RecipeRecord], embeddings: np.ndarray) -> np.ndarray:
+        """
+        Writes a full snapshot of the recipe metadata and the embedding matrix, and compacts the journal into it.
+
+        Args:
+            recipes: The recipes to save.
+            embeddings: The (count, dimensions) matrix of normalized embeddings, in recipe order, e.g. `RecipeIndex.matrix`.
+
+        Returns:
+            np.ndarray: A read-only memmap of the saved embeddings, which the caller can use in place of its own copy of them.
+        """
+
+        if embeddings.shape[0] != len(recipes):
+            raise ValueError(
+                f"Expected {len(recipes)} embeddings, got {embeddings.shape[0]}.")
+
+        # The embeddings are replaced before the metadata, so a crash in between leaves the old metadata and journal describing a prefix of the new rows.
+        # The current file may also be memory-mapped by the caller, which a rename leaves intact.
+        with atomic_write(self.embeddings_path, "wb") as f:
+            for start in range(0, embeddings.shape[0], self.WRITE_BLOCK_ROWS):
+                np.ascontiguousarray(embeddings[start:start + self.WRITE_BLOCK_ROWS], dtype=np.float32).tofile(f)
+
+        dimensions = int(embeddings.shape[1]) if embeddings.ndim == 2 else 0
+        create_json_file(self.meta_path, {
+            "version": self.FORMAT_VERSION,
+            "dimensions": dimensions,
+            "count": len(recipes),
+            "recipes": [recipe.to_dict() for recipe in recipes],
+        })
+
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+        self.journal_entries = 0
+        self._dimensions = dimensions
+
+        return self._map_embeddings(len(recipes), dimensions)
+
+    def load_legacy(self) -> List[Dict[str, Any]]:
+        """
+        Loads recipes from the legacy `{prefix}.json` file, where embeddings are stored inline as JSON floats.
+        """
+
+        with open(self.legacy_path, "r") as f:
+            return json.load(f)
+
+    def retire_legacy(self) -> None:
+        """
+        Renames the legacy `{prefix}.json` file once it has been migrated, so that the migration only happens once.
+        """
+
+        if os.path.exists(self.legacy_path):
+            os.replace(self.legacy_path, f"{self.legacy_path}.migrated")
@@ -23,3 +23,11 @@ class RequestValidationModel(BaseModel):
 
     next_instruction_or_question: StringRequestValidationModel = Field(
         description="What is the next instruction or question to make progress on the request? Phrase it as if the user is asking the system to perform the action, e.g. 'Please provide the weather forecast for tomorrow.'")
+
+
+class ProgressValidationModel(BaseModel):
+    is_request_completed: BooleanRequestValidationModel = Field(
+        description="Has enough of the plan been executed to successfully complete the original user request? This includes the execution of planned tasks, and the provision of all requested information.")
+
+    next_instruction_or_question: StringRequestValidationModel = Field(
+        description="What is the next instruction or question to make progress on the request? Phrase it as if the user is asking the system to perform the action, e.g. 'Please provide the weather forecast for tomorrow.'")
@@ -0,0 +1,71 @@
+from contextvars import ContextVar
+from typing import Any, Optional
+from pydantic import BaseModel, Field
+import threading
+
+
+class RunStats(BaseModel):
+    llm_calls: int = Field(
+        default=0, description="The number of chat completion round-trips made during the run.")
+    round_trips_saved: int = Field(
+        default=0, description="The number of sequential round-trips that were skipped or overlapped with other work.")
+    speculative_validations: int = Field(
+        default=0, description="The number of validations requested alongside execution and used by the next iteration.")
+    embedding_calls_saved: int = Field(
+        default=0, description="The number of embedding calls that were skipped, e.g. by matching a query lexically.")
+    skill_cache_hits: int = Field(
+        default=0, description="The number of skill calls that were answered from memoized results.")
+    loops_detected: int = Field(
+        default=0, description="The number of iterations the loop detector found to repeat earlier ones.")
+    plan_cache_hits: int = Field(
+        default=0, description="The number of runs whose facts and plan were reused from a previous run of the same or a similar task.")
+    prompt_tokens: int = Field(
+        default=0, description="The number of prompt tokens sent during the run.")
+    cached_prompt_tokens: int = Field(
+        default=0, description="The number of prompt tokens that were served from the provider's prompt cache.")
+    completion_tokens: int = Field(
+        default=0, description="The number of completion tokens generated during the run.")
+
+    @property
+    def uncached_prompt_tokens(self) -> int:
+        return self.prompt_tokens - self.cached_prompt_tokens
+
+
+_current_run_stats: ContextVar[Optional[RunStats]] = ContextVar(
+    "current_run_stats", default=None)
+_lock = threading.Lock()
+
+
+def start_run_stats() -> RunStats:
+    """
+    Starts collecting stats for the current context, e.g. a single ReAct run. Tasks and worker threads started from this context record into the same stats.
+    """
+
+    stats = RunStats()
+    _current_run_stats.set(stats)
+    return stats
+
+
+def record_stat(name: str, amount: int = 1) -> None:
+    stats = _current_run_stats.get()
+    if stats is None:
+        return
+
+    with _lock:
+        setattr(stats, name, getattr(stats, name) + amount)
+
+
+def record_usage(completion: Any) -> None:
+    """
+    Records the token usage of a chat completion, including the prompt tokens that were served from the provider's prompt cache.
+    """
+
+    usage = getattr(completion, "usage", None)
+    if usage is None or _current_run_stats.get() is None:
+        return
+
+    details = getattr(usage, "prompt_tokens_details", None)
+
+    record_stat("prompt_tokens", usage.prompt_tokens or 0)
+    record_stat("completion_tokens", usage.completion_tokens or 0)
+    record_stat("cached_prompt_tokens", (getattr(details, "cached_tokens", None) or 0) if details else 0)
@@ -0,0 +1,116 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import hashlib
+import json
+import threading
+import time
+from helpers.storage_helpers import CustomEncoder, append_json_line, create_text_file, read_json_lines
+
+
+class SkillCache:
+    """
+    A class representing the memoized results of an agent's skills, for skills declared with `@skill(memoize=True)`.
+
+    Each skill has its own least-recently-used entries, bounded by the skill's `max_entries` and expiring after its `ttl`.
+    Results of skills declared with `persist=True` are also appended to a JSON Lines file, if a path is given, and reloaded when the cache is created,
+    so that they are reused across runs. The file is rewritten without stale entries once it holds twice as many lines as live entries.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._entries: Dict[str, OrderedDict[str, Tuple[float, Any]]] = {}
+        self._persisted_skills = set()
+        self._persisted_lines = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None:
+            for item in read_json_lines(path):
+                self._entries.setdefault(item["skill"], OrderedDict())[item["key"]] = (item["created"], item["value"])
+                self._persisted_skills.add(item["skill"])
+                self._persisted_lines += 1
+
+    @staticmethod
+    def create_key(arguments: Dict[str, Any], version: Any = None) -> str:
+        """
+        Creates the key of a skill call from its arguments, so that calls that only differ in case, whitespace or argument order share a key.
+
+        Args:
+            arguments: The arguments of the call, by name.
+            version: An optional version of the data the skill reads, e.g. of the agent's catalog, so that results are not reused once the data changes.
+
+        Returns:
+            str: The key of the call.
+        """
+
+        def _canonicalize(value: Any) -> Any:
+            if isinstance(value, str):
+                return " ".join(value.lower().split())
+            if isinstance(value, (list, tuple)):
+                return [_canonicalize(item) for item in value]
+            if isinstance(value, dict):
+                return {key: _canonicalize(item) for key, item in value.items()}
+            return value
+
+        payload = json.dumps([_canonicalize(arguments), version], sort_keys=True, cls=CustomEncoder)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, skill_name: str, key: str, ttl: Optional[float] = None) -> Tuple[bool, Any]:
+        """
+        Gets a memoized result.
+
+        Returns:
+            Tuple[bool, Any]: Whether a live result was found, and the result.
+        """
+
+        with self._lock:
+            entries = self._entries.get(skill_name)
+            entry = entries.get(key) if entries is not None else None
+
+            if entry is None or (ttl is not None and time.time() - entry[0] > ttl):
+                if entry is not None:
+                    del entries[key]
+                self.misses += 1
+                return False, None
+
+            entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def set(self, skill_name: str, key: str, value: Any, max_entries: Optional[int] = None, persist: bool = False) -> None:
+        created = time.time()
+
+        with self._lock:
+            entries = self._entries.setdefault(skill_name, OrderedDict())
+            entries[key] = (created, value)
+            entries.move_to_end(key)
+
+            while max_entries is not None and len(entries) > max_entries:
+                entries.popitem(last=False)
+
+            if not persist or self.path is None:
+                return
+
+            append_json_line(self.path, {"skill": skill_name, "key": key, "created": created, "value": value})
+            self._persisted_skills.add(skill_name)
+            self._persisted_lines += 1
+
+            live = sum(len(self._entries.get(name, ())) for name in self._persisted_skills)
+            if self._persisted_lines > 2 * live + 64:
+                self._compact()
+
+    def clear(self, skill_name: Optional[str] = None) -> None:
+        with self._lock:
+            if skill_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(skill_name, None)
+
+    def _compact(self) -> None:
+        lines = [json.dumps({"skill": skill_name, "key": key, "created": created, "value": value}, cls=CustomEncoder)
+                 for skill_name in sorted(self._persisted_skills)
+                 for key, (created, value) in self._entries.get(skill_name, {}).items()]
+
+        create_text_file(self.path, "".join(line + "\n" for line in lines))
+        self._persisted_lines = len(lines)
@@ -1,5 +1,14 @@
 import os
 import json
+import tempfile
+from contextlib import contextmanager
+
+# The ReAct folder, where data files such as the recipe store and caches are kept by default, so that their location doesn't depend on the working directory.
+DATA_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The umask of the process, read once, as reading it means setting it, which isn't safe while other threads create files.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
 
 
 class CustomEncoder(json.JSONEncoder):
@@ -28,6 +37,10 @@ class CustomEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+def get_data_path(name: str) -> str:
+    return os.path.join(DATA_DIRECTORY, name)
+
+
 def create_directory(dir: str, clear_if_not_empty: bool = False) -> str:
     os.makedirs(dir, exist_ok=True)
 
@@ -40,17 +53,115 @@ def create_directory(dir: str, clear_if_not_empty: bool = False) -> str:
     return dir
 
 
-def create_json_file(fpath: str, data: any, indent: int = 4) -> None:
-    if not os.path.exists(os.path.dirname(fpath)):
-        create_directory(os.path.dirname(fpath))
+def _get_file_mode(fpath: str) -> int:
+    try:
+        return os.stat(fpath).st_mode & 0o7777
+    except FileNotFoundError:
+        return 0o666 & ~_UMASK
+
+
+@contextmanager
+def atomic_write(fpath: str, mode: str = 'w'):
+    """
+    Opens a temporary file next to the target path for writing, and atomically renames it over the target once the block completes.
+    If the block raises, the target is left untouched and the temporary file is removed, so readers never observe a partially written file.
+    The file keeps the permissions of the target it replaces, or gets those of a file created with `open`, rather than the owner-only permissions of temporary files.
+
+    Args:
+        fpath: The path of the file to write.
+        mode: The mode to open the temporary file with, either 'w' or 'wb'.
+    """
 
-    with open(fpath, 'w') as f:
+    dir = os.path.dirname(fpath)
+    if dir and not os.path.exists(dir):
+        create_directory(dir)
+
+    fd, temp_path = tempfile.mkstemp(
+        dir=dir or '.', prefix=f".{os.path.basename(fpath)}.", suffix='.tmp')
+
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(temp_path, _get_file_mode(fpath))
+        os.replace(temp_path, fpath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def create_json_file(fpath: str, data: any, indent: int = 4) -> None:
+    with atomic_write(fpath) as f:
         json.dump(data, f, indent=indent, cls=CustomEncoder)
 
 
 def create_text_file(fpath: str, data: str) -> None:
-    if not os.path.exists(os.path.dirname(fpath)):
-        create_directory(os.path.dirname(fpath))
+    with atomic_write(fpath) as f:
+        f.write(data)
+
+
+def create_binary_file(fpath: str, data: bytes) -> None:
+    with atomic_write(fpath, 'wb') as f:
+        f.write(data)
+
+
+def append_json_line(fpath: str, data: any) -> None:
+    """
+    Appends a single JSON document as a line to a JSON Lines file, and flushes it to disk.
+    If a previous append was torn part way through a line, the new line is started on a fresh line so that only the torn line is lost.
+
+    Args:
+        fpath: The path of the JSON Lines file.
+        data: The data to append.
+    """
+
+    dir = os.path.dirname(fpath)
+    if dir and not os.path.exists(dir):
+        create_directory(dir)
+
+    line = json.dumps(data, cls=CustomEncoder) + '\n'
+
+    with open(fpath, 'ab+') as f:
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                line = '\n' + line
+        f.write(line.encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_json_lines(fpath: str) -> list:
+    """
+    Reads the JSON documents from a JSON Lines file, skipping blank and torn lines.
+    """
+
+    if not os.path.exists(fpath):
+        return []
+
+    items = []
+    with open(fpath, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+
+    return items
+
+
+def write_file_at(fpath: str, offset: int, data: bytes) -> None:
+    """
+    Writes bytes at the given offset of an existing file, extending it if required, and flushes them to disk.
+    """
 
-    with open(fpath, 'w') as f:
+    with open(fpath, 'r+b') as f:
+        f.seek(offset)
         f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
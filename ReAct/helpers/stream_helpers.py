@@ -0,0 +1,156 @@
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletionChunk, ChatCompletionMessage, ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_chunk import ChoiceDeltaToolCall
+from typing import Any, AsyncIterator, Dict, List, Literal, Optional
+from pydantic import BaseModel, Field
+import asyncio
+import json
+from helpers.run_stats import record_stat, record_usage
+from helpers.tracing import trace
+
+
+class StreamEvent(BaseModel):
+    type: Literal["token", "tool_call", "message", "event", "result"] = Field(
+        description="`token` for a piece of streamed content, `tool_call` for a tool call whose arguments are complete, `message` for the assembled message at the end of a completion, "
+                    "`event` for a progress update of a run, and `result` for the result of a run.")
+    title: Optional[str] = Field(
+        default=None, description="The step that produced the event, e.g. `Execute` or `Final`.")
+    content: Optional[str] = Field(
+        default=None, description="The streamed content for `token` events, or the full content for `event` events.")
+    tool_call: Optional[ChatCompletionMessageToolCall] = Field(
+        default=None, description="The completed tool call, for `tool_call` events.")
+    message: Optional[ChatCompletionMessage] = Field(
+        default=None, description="The assembled message, for `message` events.")
+    result: Optional[Any] = Field(
+        default=None, description="The result of the run, for `result` events.")
+
+
+class ToolCallAssembler:
+    """
+    A class representing the tool calls of a streamed completion, assembled from their deltas.
+
+    The arguments of each tool call arrive in pieces. A tool call is complete once its arguments are valid JSON, or once the next tool call starts,
+    so that it can be executed before the rest of the completion has been streamed.
+    """
+
+    def __init__(self):
+        self._tool_calls: Dict[int, dict] = {}
+        self._completed: set = set()
+
+    def add(self, deltas: List[ChoiceDeltaToolCall]) -> List[ChatCompletionMessageToolCall]:
+        """
+        Adds the tool call deltas of a chunk.
+
+        Returns:
+            List[ChatCompletionMessageToolCall]: The tool calls that were completed by these deltas.
+        """
+
+        completed = []
+
+        for delta in deltas:
+            # A new tool call starting means that the previous ones are complete.
+            if delta.index not in self._tool_calls:
+                completed.extend(self._complete(lambda index: index < delta.index))
+                self._tool_calls[delta.index] = {"id": "", "name": "", "arguments": ""}
+
+            tool_call = self._tool_calls[delta.index]
+            tool_call["id"] += delta.id or ""
+
+            if delta.function is not None:
+                tool_call["name"] += delta.function.name or ""
+                tool_call["arguments"] += delta.function.arguments or ""
+
+            if tool_call["arguments"].rstrip().endswith("}") and self._is_valid_json(tool_call["arguments"]):
+                completed.extend(self._complete(lambda index: index == delta.index))
+
+        return completed
+
+    def finish(self) -> List[ChatCompletionMessageToolCall]:
+        """
+        Completes the remaining tool calls once the stream has ended.
+        """
+
+        return self._complete(lambda index: True)
+
+    @property
+    def tool_calls(self) -> List[ChatCompletionMessageToolCall]:
+        return [self._create_tool_call(index) for index in sorted(self._tool_calls)]
+
+    def _complete(self, predicate) -> List[ChatCompletionMessageToolCall]:
+        indices = [index for index in sorted(self._tool_calls)
+                   if index not in self._completed and predicate(index)]
+        self._completed.update(indices)
+        return [self._create_tool_call(index) for index in indices]
+
+    def _create_tool_call(self, index: int) -> ChatCompletionMessageToolCall:
+        tool_call = self._tool_calls[index]
+        return ChatCompletionMessageToolCall(
+            id=tool_call["id"], type="function", function={"name": tool_call["name"], "arguments": tool_call["arguments"]})
+
+    @staticmethod
+    def _is_valid_json(text: str) -> bool:
+        try:
+            json.loads(text)
+            return True
+        except ValueError:
+            return False
+
+
+async def acreate_completion_stream(client: Optional[OpenAI], async_client: Optional[AsyncOpenAI], **kwargs) -> AsyncIterator[ChatCompletionChunk]:
+    """
+    Creates a streamed chat completion with the async client, or with the sync client on a worker thread if no async client was provided.
+    The usage of the completion is requested with the last chunk and recorded in the current run's stats.
+    """
+
+    kwargs = dict(kwargs, stream=True, stream_options={"include_usage": True})
+
+    # The span isn't made current, as the consumer runs between chunks, e.g. starting tools, whose spans aren't part of the completion.
+    span = trace("llm.stream", model=kwargs.get("model"))
+    record_stat("llm_calls")
+
+    try:
+        if async_client is not None:
+            async for chunk in await async_client.chat.completions.create(**kwargs):
+                record_usage(chunk)
+                span.record_usage(chunk)
+                yield chunk
+            return
+
+        chunks = iter(await asyncio.to_thread(client.chat.completions.create, **kwargs))
+
+        while (chunk := await asyncio.to_thread(next, chunks, None)) is not None:
+            record_usage(chunk)
+            span.record_usage(chunk)
+            yield chunk
+    finally:
+        span.end()
+
+
+async def astream_message(chunks: AsyncIterator[ChatCompletionChunk], title: Optional[str] = None) -> AsyncIterator[StreamEvent]:
+    """
+    Turns the chunks of a streamed completion into events: a `token` event for each piece of content, a `tool_call` event as soon as each tool call is complete,
+    and a final `message` event with the assembled message.
+    """
+
+    content = []
+    tool_calls = ToolCallAssembler()
+
+    async for chunk in chunks:
+        # The usage chunk at the end of the stream has no choices.
+        if not chunk.choices:
+            continue
+
+        delta = chunk.choices[0].delta
+
+        if delta.content:
+            content.append(delta.content)
+            yield StreamEvent(type="token", title=title, content=delta.content)
+
+        for tool_call in tool_calls.add(delta.tool_calls or []):
+            yield StreamEvent(type="tool_call", title=title, tool_call=tool_call)
+
+    for tool_call in tool_calls.finish():
+        yield StreamEvent(type="tool_call", title=title, tool_call=tool_call)
+
+    yield StreamEvent(type="message", title=title, message=ChatCompletionMessage(
+        role="assistant", content="".join(content) or None, tool_calls=tool_calls.tool_calls or None))
@@ -0,0 +1,48 @@
+from typing import Iterable, List
+import re
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens in a text, assuming roughly four characters per token for English text.
+    This is close enough for budgeting requests without depending on a tokenizer.
+    """
+
+    return len(text) // 4 + 1
+
+
+_WORD_PATTERN = re.compile(r"[a-z]+")
+
+# Words that carry no meaning for matching recipes, including units of measure, so that "200g mozzarella" and "mozzarella" match.
+_STOP_WORDS = frozenset("""
+a an and any are as at be by for from have i in into is it me my of on or some that the this to up use uses using want what which with without you
+g kg mg ml l tbsp tsp tablespoon tablespoons teaspoon teaspoons cup cups pinch handful clove cloves slice slices piece pieces
+large small medium fresh chopped diced sliced minced grated melted softened optional garnish split taste
+""".split())
+
+
+def normalize_token(token: str) -> str:
+    """
+    Reduces a lowercase word to a simple singular form, e.g. "tomatoes" to "tomato" and "berries" to "berry".
+    """
+
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 4 and token.endswith("oes"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a text into normalized words for lexical matching, dropping numbers, units and stop words.
+    """
+
+    return [normalize_token(token) for token in _WORD_PATTERN.findall(text.lower())
+            if token not in _STOP_WORDS]
+
+
+def tokenize_all(texts: Iterable[str]) -> List[str]:
+    return [token for text in texts for token in tokenize(text)]
@@ -0,0 +1,443 @@
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, List, Optional
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import threading
+import time
+import numpy as np
+from helpers.storage_helpers import CustomEncoder, create_directory, get_data_path
+
+
+class Span:
+    """
+    A class representing a timed operation of a run, e.g. an agent query, a skill or an LLM call, with the spans it started as children.
+
+    Spans are used as context managers, which makes them the current span of the context, so that spans started inside them, including in tasks
+    and worker threads started from that context, become their children. Attributes hold what was measured, e.g. token usage, cache hits and retries.
+    """
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error", "_tracer", "_started", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self._tracer = tracer
+        self._started = time.perf_counter_ns()
+        self._token = None
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # An async generator that is closed from another task, e.g. when its consumer stops early, can't restore the context it was iterated in.
+            pass
+
+        self.end(f"{exc_type.__name__}: {exc}" if exc_type is not None and not issubclass(exc_type, GeneratorExit) else None)
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        return (self.end_ns - self.start_ns) / 1e6 if self.end_ns is not None else None
+
+    def set_attribute(self, name: str, value: Any) -> None:
+        self.attributes[name] = value
+
+    def set_attributes(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def add(self, name: str, amount: int = 1) -> None:
+        self.attributes[name] = self.attributes.get(name, 0) + amount
+
+    def record_usage(self, completion: Any) -> None:
+        """
+        Records the token usage of a chat completion, a streamed chunk or an embeddings response, if it has any.
+        """
+
+        usage = getattr(completion, "usage", None)
+        if usage is None:
+            return
+
+        details = getattr(usage, "prompt_tokens_details", None)
+
+        self.add("prompt_tokens", getattr(usage, "prompt_tokens", None) or 0)
+        self.add("completion_tokens", getattr(usage, "completion_tokens", None) or 0)
+        self.add("cached_prompt_tokens", (getattr(details, "cached_tokens", None) or 0) if details else 0)
+
+    def end(self, error: Optional[str] = None) -> None:
+        if self.end_ns is not None:
+            return
+
+        self.end_ns = self.start_ns + time.perf_counter_ns() - self._started
+        self.error = error
+        self._tracer.finish(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def to_otlp(self) -> dict:
+        """
+        Converts the span to the OTLP/JSON encoding of an OpenTelemetry span.
+        """
+
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _to_otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error is not None else {},
+        }
+
+        if self.parent_id is not None:
+            span["parentSpanId"] = self.parent_id
+
+        return span
+
+
+class _NoopSpan:
+    """
+    The span returned while tracing is disabled, whose methods do nothing, so that instrumented code doesn't need to check whether tracing is enabled.
+    """
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        pass
+
+    def set_attribute(self, name: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, **attributes) -> None:
+        pass
+
+    def add(self, name: str, amount: int = 1) -> None:
+        pass
+
+    def record_usage(self, completion: Any) -> None:
+        pass
+
+    def end(self, error: Optional[str] = None) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _to_otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, (int, np.integer)):
+        return {"intValue": str(int(value))}
+    if isinstance(value, (float, np.floating)):
+        return {"doubleValue": float(value)}
+    if value is None:
+        return {"stringValue": ""}
+    if isinstance(value, str):
+        return {"stringValue": value}
+    return {"stringValue": json.dumps(value, cls=CustomEncoder)}
+
+
+class JsonLinesExporter:
+    """
+    A class representing an exporter that appends each finished span, as a flat JSON object, to a JSON Lines file.
+    """
+
+    def __init__(self, path: str = get_data_path("traces.jsonl")):
+        self.path = path
+
+    def export(self, spans: List[Span]) -> None:
+        dir = os.path.dirname(self.path)
+        if dir and not os.path.exists(dir):
+            create_directory(dir)
+
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(span.to_dict(), cls=CustomEncoder) + "\n" for span in spans))
+
+
+class OTLPJsonExporter:
+    """
+    A class representing an exporter that appends finished spans to a file in the OTLP/JSON encoding, one export request per line,
+    which is the format of the OpenTelemetry Collector's file exporter and can be ingested by its `otlpjsonfile` receiver.
+    """
+
+    def __init__(self, path: str = get_data_path("traces.otlp.jsonl"), service_name: str = "react-agent"):
+        self.path = path
+        self.service_name = service_name
+
+    def export(self, spans: List[Span]) -> None:
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [span.to_otlp() for span in spans],
+                }],
+            }]
+        }
+
+        dir = os.path.dirname(self.path)
+        if dir and not os.path.exists(dir):
+            create_directory(dir)
+
+        with open(self.path, "a") as f:
+            f.write(json.dumps(request, cls=CustomEncoder) + "\n")
+
+
+class Tracer:
+    """
+    A class representing the collector of the spans recorded while tracing is enabled.
+
+    Finished spans are kept in memory, up to `max_spans` of them, for `summarize`, and are passed to the exporters in batches of `batch_size`,
+    e.g. a `JsonLinesExporter` or an `OTLPJsonExporter`, so that files aren't written on every span. `flush` exports the remaining spans.
+    An exporter only needs to expose `export(spans)`.
+    """
+
+    def __init__(self, exporters: Optional[List[Any]] = None, max_spans: Optional[int] = 10_000, batch_size: int = 64):
+        self.exporters = list(exporters or [])
+        self.batch_size = max(1, batch_size)
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+        self._pending: List[Span] = []
+        self._lock = threading.Lock()
+
+    def start_span(self, name: str, attributes: Dict[str, Any]) -> Span:
+        return Span(self, name, _current_span.get(), attributes)
+
+    def finish(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+            if not self.exporters:
+                return
+
+            self._pending.append(span)
+            if len(self._pending) < self.batch_size:
+                return
+
+            pending, self._pending = self._pending, []
+
+        self._export(pending)
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+
+        if pending:
+            self._export(pending)
+
+    def _export(self, spans: List[Span]) -> None:
+        for exporter in self.exporters:
+            exporter.export(spans)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.spans.clear()
+
+    def summarize(self) -> Dict[str, Dict[str, float]]:
+        """
+        Aggregates the finished spans by name, to show which operations dominate a run.
+
+        Returns:
+            Dict[str, Dict[str, float]]: For each span name, the number of spans, their total, p50 and p95 duration in milliseconds,
+                and the totals of their numeric attributes, e.g. tokens, cache hits and retries. Names are ordered by total duration, longest first.
+        """
+
+        with self._lock:
+            spans = list(self.spans)
+
+        durations: Dict[str, List[float]] = {}
+        totals: Dict[str, Dict[str, float]] = {}
+
+        for span in spans:
+            durations.setdefault(span.name, []).append(span.duration_ms)
+            span_totals = totals.setdefault(span.name, {})
+            for name, value in span.attributes.items():
+                if isinstance(value, (int, float, np.integer, np.floating)):
+                    span_totals[name] = span_totals.get(name, 0) + value
+
+        summary = {
+            name: {
+                "count": len(values),
+                "total_ms": float(np.sum(values)),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                **totals[name],
+            }
+            for name, values in durations.items()
+        }
+
+        return dict(sorted(summary.items(), key=lambda item: -item[1]["total_ms"]))
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+_tracer: Optional[Tracer] = None
+
+
+class _RetryFilter(logging.Filter):
+    """
+    Counts the retries the OpenAI client logs on the current span. The client only logs them at INFO level,
+    so the logger is lowered to INFO while tracing, and the filter drops the records the logger would not have emitted otherwise.
+    """
+
+    def __init__(self, level: int):
+        super().__init__()
+        self.level = level
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if isinstance(record.msg, str) and record.msg.startswith("Retrying request"):
+            current_span().add("retries")
+
+        return record.levelno >= self.level
+
+
+_retry_logger = logging.getLogger("openai._base_client")
+_retry_filter: Optional[_RetryFilter] = None
+_retry_logger_level = logging.NOTSET
+
+
+def enable_tracing(tracer: Optional[Tracer] = None) -> Tracer:
+    """
+    Starts recording spans, for all runs of the process.
+
+    Args:
+        tracer: The tracer to record the spans with, e.g. `Tracer([JsonLinesExporter("./traces.jsonl")])`. By default, spans are only kept in memory.
+
+    Returns:
+        Tracer: The tracer recording the spans.
+    """
+
+    global _tracer, _retry_filter, _retry_logger_level
+
+    disable_tracing()
+    _tracer = tracer or Tracer()
+
+    _retry_logger_level = _retry_logger.level
+    _retry_filter = _RetryFilter(_retry_logger.getEffectiveLevel())
+    _retry_logger.addFilter(_retry_filter)
+    _retry_logger.setLevel(min(logging.INFO, _retry_logger.getEffectiveLevel()))
+
+    return _tracer
+
+
+def disable_tracing() -> None:
+    """
+    Stops recording spans, and exports the spans that haven't been exported yet.
+    """
+
+    global _tracer, _retry_filter
+
+    if _tracer is None:
+        return
+
+    tracer, _tracer = _tracer, None
+    tracer.flush()
+
+    _retry_logger.removeFilter(_retry_filter)
+    _retry_logger.setLevel(_retry_logger_level)
+    _retry_filter = None
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def current_span() -> Any:
+    """
+    Gets the current span, e.g. to record an attribute on it, or a no-op span if tracing is disabled or no span is current.
+    """
+
+    if _tracer is None:
+        return NOOP_SPAN
+
+    return _current_span.get() or NOOP_SPAN
+
+
+def trace(name: str, **attributes) -> Any:
+    """
+    Starts a span, to be used as a context manager, e.g. `with trace("recipe_index.scores", rows=size) as span:`.
+    While tracing is disabled, a no-op span is returned, so that the overhead is a single check.
+
+    Args:
+        name: The name of the operation.
+        attributes: The initial attributes of the span.
+    """
+
+    if _tracer is None:
+        return NOOP_SPAN
+
+    return _tracer.start_span(name, attributes)
+
+
+def traced(func: Optional[Callable] = None, *, name: Optional[str] = None) -> Callable:
+    """
+    Traces every call of a function, coroutine function or async generator function, which can be used as `@traced` or `@traced(name="...")`.
+    The span is named after the function's qualified name by default, e.g. `RecipeAgent.aprocess_query`.
+    """
+
+    if func is None:
+        return lambda func: traced(func, name=name)
+
+    span_name = name or func.__qualname__
+
+    if inspect.isasyncgenfunction(func):
+        @functools.wraps(func)
+        async def async_generator_wrapper(*args, **kwargs) -> Any:
+            if _tracer is None:
+                async for item in func(*args, **kwargs):
+                    yield item
+                return
+
+            with _tracer.start_span(span_name, {}):
+                async for item in func(*args, **kwargs):
+                    yield item
+
+        return async_generator_wrapper
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs) -> Any:
+            if _tracer is None:
+                return await func(*args, **kwargs)
+
+            with _tracer.start_span(span_name, {}):
+                return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) -> Any:
+        if _tracer is None:
+            return func(*args, **kwargs)
+
+        with _tracer.start_span(span_name, {}):
+            return func(*args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,79 @@
+import pytest
+from helpers.ingredient_parser import compare_ingredients, parse_ingredient, parse_ingredients
+from helpers.seed_recipes import create_seed_recipes
+
+
+def _find_seed_recipe(name: str):
+    return next(recipe for recipe in create_seed_recipes() if recipe.name == name)
+
+
+@pytest.mark.parametrize("text, quantity, unit, name", [
+    ("1 lb boneless, skinless chicken thighs, cut into bite-sized pieces", 1.0, "lb", "chicken thigh"),
+    ("1 large onion, finely chopped", 1.0, None, "onion"),
+    ("3 cloves garlic, minced", 3.0, "clove", "garlic"),
+    ("400g beef sirloin, thinly sliced", 400.0, "g", "beef sirloin"),
+    ("1 head broccoli, cut into florets", 1.0, "head", "broccoli"),
+    ("2 English muffins, split", 2.0, None, "english muffin"),
+    ("1 tbsp fresh ginger, grated", 1.0, "tbsp", "ginger"),
+    ("2 cups cooked rice, chilled", 2.0, "cup", "rice"),
+    ("1 cup unsalted butter, softened", 1.0, "cup", "butter"),
+    ("1 cup mixed vegetables (peas, carrots, corn, etc.)", 1.0, "cup", "mixed vegetable"),
+    ("2 cans (400g each) diced tomatoes", 2.0, "can", "tomato"),
+    ("1 ½ cups all-purpose flour", 1.5, "cup", "flour"),
+    ("Pinch of salt", 1.0, "pinch", "salt"),
+    ("A broccoli head", 1.0, "head", "broccoli"),
+])
+def test_parse_ingredient(text, quantity, unit, name):
+    ingredient = parse_ingredient(text)
+
+    assert ingredient is not None
+    assert ingredient.quantity == pytest.approx(quantity)
+    assert (ingredient.unit, ingredient.name) == (unit, name)
+
+
+@pytest.mark.parametrize("text", ["100ml red wine (optional)", "Chopped parsley (for garnish)", "Salt and pepper to taste"])
+def test_parse_optional_ingredient(text):
+    assert parse_ingredient(text).optional
+
+
+@pytest.mark.parametrize("text", ["", "For the crust:", "For the chicken marinade:"])
+def test_parse_heading(text):
+    assert parse_ingredient(text) is None
+
+
+def test_parse_seed_recipes():
+    for recipe in create_seed_recipes():
+        texts = [text for text in recipe.ingredients if not text.endswith(":")]
+        assert len(parse_ingredients(texts)) == len(texts), recipe.name
+
+
+def test_compare_ingredients_includes_chicken():
+    recipe = _find_seed_recipe("Chicken Tikka Masala")
+    missing, _ = compare_ingredients(parse_ingredients(recipe.ingredients), parse_ingredients(["1 cup plain yogurt"]))
+
+    assert "chicken thigh" in [ingredient.name for ingredient, _ in missing]
+    assert "yogurt" not in [ingredient.name for ingredient, _ in missing]
+
+
+def test_compare_ingredients_shortfall():
+    missing, found = compare_ingredients(parse_ingredients(["500g spaghetti", "2 tbsp olive oil"]), parse_ingredients(["100g pasta", "300g spaghetti", "Olive oil"]))
+
+    assert [(ingredient.name, shortfall) for ingredient, shortfall in missing] == [("spaghetti", pytest.approx(200.0))]
+    assert [ingredient.name for ingredient in found] == ["olive oil"]
+
+
+def test_compare_ingredients_uses_up_stock():
+    recipe = _find_seed_recipe("Chicken Tikka Masala")
+    required = [ingredient for ingredient in parse_ingredients(recipe.ingredients) if ingredient.name == "cumin"]
+    missing, found = compare_ingredients(required, parse_ingredients(["2 tsp ground cumin"]))
+
+    assert [ingredient.quantity for ingredient in required] == [2.0, 1.0]
+    assert [ingredient.quantity for ingredient in found] == [2.0]
+    assert [(ingredient.quantity, shortfall) for ingredient, shortfall in missing] == [(1.0, pytest.approx(1.0))]
+
+
+def test_compare_ingredients_shares_stock():
+    missing, found = compare_ingredients(parse_ingredients(["1 tsp vanilla extract", "1 tsp vanilla extract"]), parse_ingredients(["150ml vanilla extract"]))
+
+    assert not missing
+    assert len(found) == 2
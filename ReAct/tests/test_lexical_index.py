@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+from helpers.lexical_index import LexicalIndex
+from helpers.seed_recipes import create_seed_recipes
+from helpers.text_helpers import tokenize
+
+
+@pytest.fixture
+def index():
+    index = LexicalIndex()
+    index.build(create_seed_recipes())
+    return index
+
+
+def _find_row(name: str) -> int:
+    return next(row for row, recipe in enumerate(create_seed_recipes()) if recipe.name == name)
+
+
+def test_bm25_of_rows_matches_all_rows(index):
+    tokens = tokenize("chocolate cake with walnuts")
+    rows = np.array([0, 2, 5, 9])
+
+    np.testing.assert_allclose(index.bm25(tokens, rows), index.bm25(tokens)[rows], rtol=1e-6)
+
+
+def test_ingredient_coverage_counts_each_ingredient_once(index):
+    row = _find_row("Vegan Banana Bread")
+
+    # "brown sugar" and "sugar" match the same ingredient, and the recipe has 8 ingredients.
+    coverage = index.ingredient_coverage(tokenize("brown sugar"), np.array([row]))
+
+    assert coverage[0] == pytest.approx(1 / 8)
+
+
+def test_count_terms(index):
+    rows = np.array([_find_row("Vegan Banana Bread"), _find_row("Scrambled Eggs with Spinach and Feta on Toast")])
+
+    assert index.count_terms(tokenize("banana bread"), rows).tolist() == [2, 1]
+
+
+def test_add_keeps_scores_up_to_date(index):
+    row = index.add("Banana Pancakes", ["2 bananas", "1 cup flour"], ["Mash the bananas.", "Cook the pancakes."])
+
+    assert index.bm25(tokenize("banana pancakes"))[row] > 0
+    assert index.ingredient_coverage(tokenize("bananas"), np.array([row]))[0] == pytest.approx(0.5)
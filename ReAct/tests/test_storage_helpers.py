@@ -0,0 +1,27 @@
+import os
+from helpers.storage_helpers import create_text_file
+
+
+def _get_mode(path) -> int:
+    return os.stat(path).st_mode & 0o777
+
+
+def test_atomic_write_uses_umask_for_new_files(tmp_path):
+    path = tmp_path / "recipes.meta.json"
+    umask = os.umask(0)
+    os.umask(umask)
+
+    create_text_file(str(path), "{}")
+
+    assert _get_mode(path) == 0o666 & ~umask
+
+
+def test_atomic_write_keeps_mode_of_replaced_file(tmp_path):
+    path = tmp_path / "skill_cache.jsonl"
+    path.write_text("")
+    os.chmod(path, 0o640)
+
+    create_text_file(str(path), "{}\n")
+
+    assert _get_mode(path) == 0o640
+    assert path.read_text() == "{}\n"